@@ -0,0 +1,136 @@
+"""
+Agrupador asíncrono de predicciones individuales (micro-batching).
+
+Los /predict concurrentes se encolan hasta `max_espera_ms` o `max_lote`
+solicitudes, se evalúan como un único lote vectorizado en el threadpool y
+cada request recibe su fila. Así se obtiene el rendimiento de /predict/batch
+sin cambiar la API de un punto que consume el backend.
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Tuple
+
+import numpy as np
+
+# (latitudes, longitudes, meses) -> (contexto, probabilidades (n, n_clases))
+FuncionLote = Callable[[np.ndarray, np.ndarray, np.ndarray], Tuple[Any, np.ndarray]]
+
+
+class PredictionCoalescer:
+    """
+    Cola de predicciones de un punto que se resuelven en lotes.
+
+    Args:
+        puntuar_lote: Función que evalúa un lote; el contexto que devuelve
+                      (p.ej. la versión del modelo usada) se entrega a cada
+                      solicitud junto con su fila de probabilidades
+        max_espera_ms: Tiempo máximo que espera la primera solicitud del lote
+        max_lote: Tamaño máximo del lote
+    """
+
+    def __init__(self, puntuar_lote: FuncionLote, max_espera_ms: float = 5.0, max_lote: int = 256):
+        self.puntuar_lote = puntuar_lote
+        self.max_espera = max_espera_ms / 1000.0
+        self.max_lote = max_lote
+        self._cola = None
+        self._tarea = None
+        self._loop = None
+
+        # Métricas
+        self.lotes = 0
+        self.solicitudes = 0
+        self.max_lote_visto = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.errores_lote = 0
+
+    def _asegurar_worker(self):
+        # La cola y el worker pertenecen al event loop en que se crearon
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._tarea is None or self._tarea.done():
+            self._loop = loop
+            self._cola = asyncio.Queue()
+            self._tarea = loop.create_task(self._worker())
+
+    async def predecir(self, latitud: float, longitud: float, mes: int) -> Tuple[Any, np.ndarray]:
+        """Encola un punto y espera su resultado (contexto, probabilidades)."""
+        self._asegurar_worker()
+        futuro = self._loop.create_future()
+        await self._cola.put((latitud, longitud, mes, time.perf_counter(), futuro))
+        return await futuro
+
+    async def _worker(self):
+        while True:
+            lote = [await self._cola.get()]
+            limite = lote[0][3] + self.max_espera
+
+            while len(lote) < self.max_lote:
+                restante = limite - time.perf_counter()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+
+            # Lo que ya está en cola entra sin esperar más
+            while len(lote) < self.max_lote and not self._cola.empty():
+                lote.append(self._cola.get_nowait())
+
+            self._registrar(lote)
+            await self._resolver(lote)
+
+    def _registrar(self, lote: list):
+        ahora = time.perf_counter()
+        esperas = [ahora - item[3] for item in lote]
+        self.lotes += 1
+        self.solicitudes += len(lote)
+        self.max_lote_visto = max(self.max_lote_visto, len(lote))
+        self.espera_total += sum(esperas)
+        self.espera_max = max(self.espera_max, max(esperas))
+
+    async def _resolver(self, lote: list):
+        lat = np.array([item[0] for item in lote], dtype=np.float64)
+        lon = np.array([item[1] for item in lote], dtype=np.float64)
+        mes = np.array([item[2] for item in lote], dtype=np.int64)
+        futuros = [item[4] for item in lote]
+
+        try:
+            contexto, probs = await asyncio.to_thread(self.puntuar_lote, lat, lon, mes)
+        except Exception as e:
+            self.errores_lote += 1
+            if len(lote) == 1:
+                if not futuros[0].done():
+                    futuros[0].set_exception(e)
+                return
+            # Un punto inválido no debe tumbar al resto del lote: se evalúan uno a uno
+            for i, futuro in enumerate(futuros):
+                try:
+                    contexto, probs = await asyncio.to_thread(
+                        self.puntuar_lote, lat[i:i + 1], lon[i:i + 1], mes[i:i + 1]
+                    )
+                    if not futuro.done():
+                        futuro.set_result((contexto, probs[0]))
+                except Exception as e_punto:
+                    if not futuro.done():
+                        futuro.set_exception(e_punto)
+            return
+
+        for i, futuro in enumerate(futuros):
+            if not futuro.done():
+                futuro.set_result((contexto, probs[i]))
+
+    def estadisticas(self) -> dict:
+        return {
+            "profundidad_cola": self._cola.qsize() if self._cola is not None else 0,
+            "lotes": self.lotes,
+            "solicitudes": self.solicitudes,
+            "tamano_lote_promedio": self.solicitudes / self.lotes if self.lotes else 0.0,
+            "tamano_lote_max": self.max_lote_visto,
+            "espera_promedio_ms": 1000 * self.espera_total / self.solicitudes if self.solicitudes else 0.0,
+            "espera_max_ms": 1000 * self.espera_max,
+            "errores_lote": self.errores_lote,
+            "max_espera_ms": self.max_espera * 1000,
+            "max_lote": self.max_lote
+        }
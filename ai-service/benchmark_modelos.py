@@ -0,0 +1,117 @@
+"""
+Compara Random Forest y HistGradientBoosting con los mismos datos:
+accuracy out-of-fold, tamaño (pickle y bundle) y latencia de predicción con
+scikit-learn y con el motor compilado.
+
+Uso (desde la raíz del repo):
+    python ai-service/benchmark_modelos.py               # CSV procesado del ETL
+    python ai-service/benchmark_modelos.py --db          # PostgreSQL (variables DB_*)
+"""
+
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+from evaluation import evaluar_cv
+from features import calcular_features, mes_desde_fecha, zona_geografica
+from forest_engine import compilar, exportar_modelo
+from model_bundle import guardar_bundle
+from model_search import CONFIGURACIONES_POR_DEFECTO, crear_modelo
+
+warnings.filterwarnings('ignore')
+
+CSV_PATH = 'datasets/processed/fenomenos_naturales_clean.csv'
+
+
+def cargar_datos(desde_db: bool) -> pd.DataFrame:
+    if desde_db:
+        from train_model import get_data_from_db
+        return get_data_from_db()
+    df = pd.read_csv(CSV_PATH, usecols=['latitud', 'longitud', 'fecha_reporte_dt', 'tipo_fenomeno_normalizado'])
+    df = df.dropna(subset=['latitud', 'longitud', 'fecha_reporte_dt'])
+    return df.rename(columns={'fecha_reporte_dt': 'fecha'})
+
+
+def medir(fn, repeticiones):
+    fn()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        fn()
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Random Forest vs HistGradientBoosting")
+    parser.add_argument('--db', action='store_true', help="Leer los datos de PostgreSQL en lugar del CSV")
+    args = parser.parse_args()
+
+    from train_model import agrupar_fenomenos
+
+    df = cargar_datos(args.db)
+    mes = mes_desde_fecha(pd.to_datetime(df['fecha']).values)
+    le_zona = LabelEncoder().fit(zona_geografica(df['latitud'], df['longitud']))
+    le_target = LabelEncoder()
+    y = le_target.fit_transform(agrupar_fenomenos(df['tipo_fenomeno_normalizado']))
+    X = calcular_features(df['latitud'], df['longitud'], mes, le_zona)
+    clases = le_target.classes_.tolist()
+
+    # Puntos de consulta dentro del bbox de Nariño (zonas conocidas)
+    rng = np.random.default_rng(42)
+    n = 10000
+    consultas = calcular_features(
+        rng.uniform(max(0.8, df['latitud'].min()), 2.5, n),
+        rng.uniform(-79.5, -76.5, n),
+        rng.integers(1, 13, n),
+        le_zona
+    )
+    consultas = consultas[np.isin(zona_geografica(consultas['latitud'], consultas['longitud']), le_zona.classes_)]
+
+    print('=' * 78)
+    print(f'BENCHMARK DE MODELOS ({len(y)} muestras, {len(clases)} clases)')
+    print('=' * 78)
+
+    filas = []
+    for familia, config in CONFIGURACIONES_POR_DEFECTO.items():
+        clf = crear_modelo(config)
+        cv = evaluar_cv(clf, X, y, clases)
+        inicio = time.perf_counter()
+        clf.fit(X, y)
+        segundos_fit = time.perf_counter() - inicio
+
+        tipo, arrays = exportar_modelo(clf)
+        motor = compilar(tipo, arrays)
+        with tempfile.TemporaryDirectory() as tmp:
+            bundle_path = os.path.join(tmp, 'modelo.bundle')
+            guardar_bundle(arrays, clases, le_zona.classes_.tolist(), {}, bundle_path, tipo)
+            tamano_bundle = os.path.getsize(bundle_path)
+
+        uno = consultas.iloc[:1]
+        mil = consultas.iloc[:1000]
+        filas.append({
+            'modelo': familia,
+            'accuracy_oof': cv.oof_accuracy,
+            'fit_s': segundos_fit,
+            'pickle_mb': len(pickle.dumps(clf)) / 1e6,
+            'bundle_mb': tamano_bundle / 1e6,
+            'sk_1_ms': 1000 * medir(lambda: clf.predict_proba(uno), 30),
+            'motor_1_ms': 1000 * medir(lambda: motor.predict_proba(uno), 30),
+            'sk_1k_ms': 1000 * medir(lambda: clf.predict_proba(mil), 5),
+            'motor_1k_ms': 1000 * medir(lambda: motor.predict_proba(mil), 5),
+            'sk_todo_ms': 1000 * medir(lambda: clf.predict_proba(consultas), 2),
+            'motor_todo_ms': 1000 * medir(lambda: motor.predict_proba(consultas), 2)
+        })
+
+        # El motor debe reproducir a scikit-learn
+        np.testing.assert_allclose(motor.predict_proba(mil), clf.predict_proba(mil), rtol=0, atol=1e-9)
+
+    resultado = pd.DataFrame(filas).set_index('modelo').T
+    print(resultado.to_string(float_format=lambda v: f'{v:.4f}'))
+    print(f'(latencias: 1 punto, 1.000 puntos y {len(consultas)} puntos; sk = scikit-learn)')
+    print('=' * 78)
@@ -0,0 +1,263 @@
+"""
+Benchmark de carga del servicio de IA.
+
+Levanta la app en el mismo proceso (httpx + ASGI, sin red) o con uvicorn en
+un subproceso, y envía requests a /predict y /predict/batch con la
+concurrencia pedida. Las coordenadas y meses salen del CSV procesado de
+fenómenos, así la distribución de puntos (y de aciertos en la malla y en la
+cache) se parece al tráfico real.
+
+Reporta throughput, latencia p50/p95/p99 y memoria (RSS) del servicio, y
+guarda todo en JSON con la versión del modelo para comparar entre versiones.
+
+Uso (desde la raíz del repo):
+    python ai-service/benchmark_servicio.py
+    python ai-service/benchmark_servicio.py --modo uvicorn --concurrencia 16 --requests 5000
+    python ai-service/benchmark_servicio.py --comparar ai-service/benchmarks/anterior.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+
+DIRECTORIO_SERVICIO = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = 'datasets/processed/fenomenos_naturales_clean.csv'
+SALIDA_DIR = os.path.join(DIRECTORIO_SERVICIO, 'benchmarks')
+
+
+def cargar_puntos(csv_path: str) -> pd.DataFrame:
+    """Latitud, longitud y mes de los fenómenos registrados"""
+    df = pd.read_csv(csv_path, usecols=['latitud', 'longitud', 'mes'])
+    return df.dropna().astype({'mes': int}).reset_index(drop=True)
+
+
+def memoria_mb(pid='self') -> dict:
+    """RSS actual y pico del proceso en MB (Linux, /proc); vacío en otros sistemas"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            campos = dict(linea.split(':', 1) for linea in f if ':' in linea)
+    except OSError:
+        return {}
+    return {
+        'rss_mb': int(campos['VmRSS'].split()[0]) / 1024,
+        'rss_pico_mb': int(campos['VmHWM'].split()[0]) / 1024
+    }
+
+
+def version_git() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=DIRECTORIO_SERVICIO, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(latencias: list) -> dict:
+    ms = np.array(latencias) * 1000
+    if len(ms) == 0:
+        return {}
+    return {
+        'media_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max())
+    }
+
+
+def armar_requests(puntos: pd.DataFrame, escenario: str, n: int, tamano_lote: int,
+                   rng: np.random.Generator) -> list:
+    """(ruta, cuerpo, puntos) de cada request, muestreando puntos del CSV con reemplazo"""
+    if escenario == 'predict':
+        idx = rng.integers(len(puntos), size=n)
+        return [
+            ('/predict', {'latitud': float(puntos.latitud[i]), 'longitud': float(puntos.longitud[i]),
+                          'mes': int(puntos.mes[i])}, 1)
+            for i in idx
+        ]
+    requests = []
+    for _ in range(n):
+        lote = puntos.iloc[rng.integers(len(puntos), size=tamano_lote)]
+        requests.append(('/predict/batch', {
+            'latitud': lote.latitud.tolist(),
+            'longitud': lote.longitud.tolist(),
+            'mes': lote.mes.tolist()
+        }, tamano_lote))
+    return requests
+
+
+async def ejecutar(cliente: httpx.AsyncClient, requests: list, concurrencia: int) -> dict:
+    """Envía los requests con `concurrencia` workers y mide cada uno"""
+    latencias, estados = [], {}
+    cola = iter(requests)
+
+    async def worker():
+        for ruta, cuerpo, _ in cola:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post(ruta, json=cuerpo)
+            latencias.append(time.perf_counter() - inicio)
+            estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrencia)))
+    segundos = time.perf_counter() - inicio
+
+    return {
+        'requests': len(requests),
+        'segundos': segundos,
+        'throughput_rps': len(requests) / segundos,
+        'puntos_por_s': sum(r[2] for r in requests) / segundos,
+        'estados': {str(k): v for k, v in sorted(estados.items())},
+        'latencia': percentiles(latencias)
+    }
+
+
+async def correr_escenarios(cliente: httpx.AsyncClient, puntos: pd.DataFrame, args, pid) -> dict:
+    rng = np.random.default_rng(args.semilla)
+    resultados = {}
+    for escenario in args.escenarios:
+        n = args.requests if escenario == 'predict' else max(1, args.requests // 10)
+        # El calentamiento no entra en las métricas
+        await ejecutar(cliente, armar_requests(puntos, escenario, args.calentamiento, args.tamano_lote, rng),
+                       args.concurrencia)
+        resultado = await ejecutar(cliente, armar_requests(puntos, escenario, n, args.tamano_lote, rng),
+                                   args.concurrencia)
+        resultado['memoria'] = memoria_mb(pid)
+        resultados[escenario] = resultado
+
+        lat = resultado['latencia']
+        print(f"   {escenario:<8} {resultado['requests']:>6} req | {resultado['throughput_rps']:8.1f} req/s | "
+              f"{resultado['puntos_por_s']:9.1f} puntos/s | p50 {lat['p50_ms']:7.2f} ms | "
+              f"p95 {lat['p95_ms']:7.2f} ms | p99 {lat['p99_ms']:7.2f} ms | estados {resultado['estados']}")
+    return resultados
+
+
+async def benchmark_inproceso(puntos: pd.DataFrame, args) -> tuple:
+    """App en el mismo proceso, sin red (mide la app, no el stack HTTP)"""
+    os.chdir(DIRECTORIO_SERVICIO)
+    sys.path.insert(0, DIRECTORIO_SERVICIO)
+    import main
+
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url='http://benchmark') as cliente:
+        info = (await cliente.get('/')).json()
+        resultados = await correr_escenarios(cliente, puntos, args, 'self')
+    return info, resultados
+
+
+async def benchmark_uvicorn(puntos: pd.DataFrame, args) -> tuple:
+    """App con uvicorn en un subproceso (incluye HTTP y serialización por red)"""
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.puerto), '--log-level', 'warning'],
+        cwd=DIRECTORIO_SERVICIO
+    )
+    base_url = f'http://127.0.0.1:{args.puerto}'
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=60) as cliente:
+            for _ in range(600):
+                try:
+                    info = (await cliente.get('/')).json()
+                    break
+                except httpx.TransportError:
+                    if proceso.poll() is not None:
+                        raise RuntimeError("uvicorn terminó antes de responder") from None
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn no respondió en 60 s")
+            resultados = await correr_escenarios(cliente, puntos, args, proceso.pid)
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=10)
+    return info, resultados
+
+
+def comparar(actual: dict, anterior: dict):
+    """Diferencias relativas de throughput y latencia contra otro resultado"""
+    print(f"\n📊 Comparación con {anterior.get('modelo_version')} ({anterior.get('fecha')}):")
+    for escenario, r in actual['escenarios'].items():
+        previo = anterior.get('escenarios', {}).get(escenario)
+        if previo is None:
+            continue
+        cambios = [f"throughput {r['throughput_rps'] / previo['throughput_rps'] - 1:+.1%}"]
+        for clave in ('p50_ms', 'p95_ms', 'p99_ms'):
+            cambios.append(f"{clave[:3]} {r['latencia'][clave] / previo['latencia'][clave] - 1:+.1%}")
+        print(f"   {escenario:<8} " + ' | '.join(cambios))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de carga del servicio de IA")
+    parser.add_argument('--modo', choices=['inproceso', 'uvicorn'], default='inproceso')
+    parser.add_argument('--escenarios', nargs='+', choices=['predict', 'batch'], default=['predict', 'batch'])
+    parser.add_argument('--requests', type=int, default=2000,
+                        help="Requests de /predict (batch usa la décima parte) (default: 2000)")
+    parser.add_argument('--concurrencia', type=int, default=8, help="Requests simultáneos (default: 8)")
+    parser.add_argument('--tamano-lote', type=int, default=100, help="Puntos por request de batch (default: 100)")
+    parser.add_argument('--calentamiento', type=int, default=50, help="Requests previos sin medir (default: 50)")
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--sin-cache', action='store_true', help="Desactivar la cache de predicciones")
+    parser.add_argument('--puerto', type=int, default=8765, help="Puerto de uvicorn (default: 8765)")
+    parser.add_argument('--csv', default=CSV_PATH, help=f"CSV con latitud, longitud y mes (default: {CSV_PATH})")
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados (default: benchmarks/)")
+    parser.add_argument('--comparar', default=None, help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    if args.sin_cache:
+        os.environ['PREDICT_CACHE_MB'] = '0'
+    csv_path = os.path.abspath(args.csv)
+    comparar_path = os.path.abspath(args.comparar) if args.comparar else None
+    # Rutas absolutas antes de que el modo en proceso cambie al directorio del servicio
+    salida = os.path.abspath(args.salida) if args.salida else None
+    puntos = cargar_puntos(csv_path)
+
+    print('=' * 70)
+    print(f'BENCHMARK DEL SERVICIO ({args.modo}, concurrencia {args.concurrencia}, {len(puntos)} puntos de origen)')
+    print('=' * 70)
+
+    ejecutor = benchmark_inproceso if args.modo == 'inproceso' else benchmark_uvicorn
+    info, escenarios = asyncio.run(ejecutor(puntos, args))
+
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'modelo_version': info.get('model_version'),
+        'git': version_git(),
+        'python': platform.python_version(),
+        'maquina': platform.node(),
+        'nucleos': os.cpu_count(),
+        'configuracion': {
+            'modo': args.modo,
+            'requests': args.requests,
+            'concurrencia': args.concurrencia,
+            'tamano_lote': args.tamano_lote,
+            'calentamiento': args.calentamiento,
+            'semilla': args.semilla,
+            'cache_predicciones': not args.sin_cache,
+            'csv': args.csv
+        },
+        'servicio': info,
+        'escenarios': escenarios
+    }
+
+    salida = salida or os.path.join(
+        SALIDA_DIR, f"servicio_{resultado['modelo_version']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, 'w') as f:
+        json.dump(resultado, f, indent=2)
+    print(f"\n💾 Resultados: {salida}")
+
+    if comparar_path:
+        with open(comparar_path) as f:
+            comparar(resultado, json.load(f))
+    print('=' * 70)
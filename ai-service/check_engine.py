@@ -0,0 +1,138 @@
+"""
+Paridad del motor compilado con scikit-learn.
+
+Entrena Random Forest y HistGradientBoosting (multiclase y binario, con y sin
+valores faltantes) sobre puntos sintéticos de Nariño con las configuraciones
+por defecto, y verifica que el motor reproduzca predict_proba (atol 1e-9) y la
+clase predicha. Si hay un modelo entrenado en ai-service/models también se
+verifica ese. Termina con código distinto de 0 si algún caso falla.
+
+Uso (desde la raíz del repo):
+    python ai-service/check_engine.py              # paridad + latencia
+    python ai-service/check_engine.py --sin-latencia
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+from features import calcular_features, zona_geografica
+from forest_engine import compilar, exportar_modelo
+from model_search import CONFIGURACIONES_POR_DEFECTO, crear_modelo
+
+warnings.filterwarnings('ignore')
+
+MODELS_DIR = 'ai-service/models'
+TOLERANCIA = 1e-9
+
+
+def puntos_narino(n: int, semilla: int):
+    rng = np.random.default_rng(semilla)
+    return rng.uniform(0.8, 2.5, n), rng.uniform(-79.5, -76.5, n), rng.integers(1, 13, n)
+
+
+def datos_sinteticos(n_clases: int, n: int = 2000, faltantes: bool = False, semilla: int = 0):
+    """Features del servicio con una etiqueta que depende de la posición y el mes (más ruido)"""
+    lat, lon, mes = puntos_narino(n, semilla)
+    zona_encoder = LabelEncoder().fit(zona_geografica(lat, lon))
+    X = calcular_features(lat, lon, mes, zona_encoder).to_numpy(dtype=np.float64)
+    rng = np.random.default_rng(semilla + 1)
+    puntaje = 2 * (lat - 0.8) + (lon + 79.5) + np.sin(mes / 2) + rng.normal(0, 0.6, n)
+    y = np.digitize(puntaje, np.quantile(puntaje, np.linspace(0, 1, n_clases + 1)[1:-1]))
+    if faltantes:
+        X[rng.random(X.shape) < 0.05] = np.nan
+    return X, y
+
+
+def verificar_paridad(nombre: str, clf, X: np.ndarray) -> bool:
+    """Compara probabilidades y clase predicha del motor contra scikit-learn"""
+    tipo, arrays = exportar_modelo(clf)
+    motor = compilar(tipo, arrays)
+    esperado = clf.predict_proba(X)
+    obtenido = motor.predict_proba(X)
+    diferencia = float(np.abs(esperado - obtenido).max())
+    try:
+        np.testing.assert_allclose(obtenido, esperado, rtol=0, atol=TOLERANCIA)
+        np.testing.assert_array_equal(motor.predict(X), np.argmax(esperado, axis=1))
+        # Un punto suelto (el camino de /predict)
+        np.testing.assert_allclose(motor.predict_proba(X[:1]), esperado[:1], rtol=0, atol=TOLERANCIA)
+    except AssertionError as e:
+        print(f'❌ {nombre}: {e}')
+        return False
+    print(f'✅ {nombre:<40} max diff {diferencia:.1e}, argmax 100%')
+    return True
+
+
+def casos_sinteticos() -> list:
+    casos = []
+    for tipo in ('random_forest', 'hist_gradient_boosting'):
+        for n_clases in (3, 2):
+            for faltantes in ((False, True) if tipo == 'hist_gradient_boosting' else (False,)):
+                X, y = datos_sinteticos(n_clases, faltantes=faltantes)
+                clf = crear_modelo(CONFIGURACIONES_POR_DEFECTO[tipo], n_jobs=1).fit(X[:1500], y[:1500])
+                nombre = f"{tipo} ({n_clases} clases{', con NaN' if faltantes else ''})"
+                casos.append((nombre, clf, X[1500:]))
+    return casos
+
+
+def modelo_instalado():
+    """(clf, X de consulta) del modelo en ai-service/models, o None si no hay"""
+    if not os.path.exists(f'{MODELS_DIR}/model_riesgo.pkl'):
+        return None
+    import joblib
+    clf = joblib.load(f'{MODELS_DIR}/model_riesgo.pkl')
+    metadata = joblib.load(f'{MODELS_DIR}/metadata.pkl')
+    zona_encoder = joblib.load(f'{MODELS_DIR}/zona_encoder.pkl')
+    lat, lon, mes = puntos_narino(10000, 42)
+    conocidos = np.isin(zona_geografica(lat, lon), zona_encoder.classes_)
+    X = calcular_features(lat[conocidos], lon[conocidos], mes[conocidos], zona_encoder,
+                          metadata['feature_columns'])
+    return clf, X
+
+
+def medir(fn, repeticiones):
+    fn()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        fn()
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paridad del motor compilado con scikit-learn")
+    parser.add_argument('--sin-latencia', action='store_true', help="Solo verificar la paridad")
+    args = parser.parse_args()
+
+    print('=' * 70)
+    print('PARIDAD MOTOR COMPILADO vs SCIKIT-LEARN')
+    print('=' * 70)
+    casos = casos_sinteticos()
+    instalado = modelo_instalado()
+    if instalado is not None:
+        casos.append((f"modelo instalado ({exportar_modelo(instalado[0])[0]})", *instalado))
+
+    fallidos = [nombre for nombre, clf, X in casos if not verificar_paridad(nombre, clf, X)]
+    if fallidos:
+        print(f'❌ {len(fallidos)} de {len(casos)} casos sin paridad')
+        sys.exit(1)
+    print(f'✅ Paridad OK en {len(casos)} casos')
+
+    if args.sin_latencia or instalado is None:
+        sys.exit(0)
+
+    clf, X = instalado
+    engine = compilar(*exportar_modelo(clf))
+    print('=' * 70)
+    print('LATENCIA (modelo instalado)')
+    print('=' * 70)
+    for nombre, filas, reps in [('1 punto', X.iloc[:1], 50), ('1.000 puntos', X.iloc[:1000], 10),
+                                ('10.000 puntos', X, 3)]:
+        t_sk = medir(lambda: clf.predict_proba(filas), reps)
+        t_en = medir(lambda: engine.predict_proba(filas), reps)
+        print(f'{nombre:>14}: sklearn {t_sk*1000:8.2f} ms | motor {t_en*1000:8.2f} ms | x{t_sk/t_en:.1f}')
+    print('=' * 70)
@@ -0,0 +1,238 @@
+"""
+Validación cruzada en paralelo con probabilidades out-of-fold.
+
+Cada fold se entrena en un proceso distinto con el modelo en un solo hilo
+(n_jobs=1), así los procesos no compiten por los núcleos. Una sola pasada
+entrega las métricas por fold, las probabilidades out-of-fold (para
+calibración) y las métricas por clase; el modelo final se entrena aparte,
+una sola vez, con todos los datos.
+
+Los folds pueden ser espaciales: los eventos se agrupan en bloques (celdas
+de una grilla o municipios) y cada bloque cae completo en un solo fold. Así
+los puntos a pocos metros de uno de entrenamiento no inflan el accuracy de
+test. La asignación de bloques a folds se guarda en disco para que todos
+los experimentos sobre los mismos datos usen los mismos folds.
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, confusion_matrix, log_loss, precision_recall_fscore_support
+from sklearn.model_selection import StratifiedKFold
+from threadpoolctl import threadpool_limits
+
+# Lado de las celdas de la grilla de bloques (0.1° ≈ 11 km)
+BLOQUE_GRADOS = float(os.getenv('CV_BLOQUE_GRADOS', '0.1'))
+FOLDS_DIR = os.getenv('CV_FOLDS_DIR', 'ai-service/cache/folds')
+
+
+def nucleos_disponibles() -> int:
+    """Núcleos asignados al proceso (respeta cgroups/affinity cuando existe)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def bloques_grilla(latitud, longitud, tamano: float = BLOQUE_GRADOS) -> np.ndarray:
+    """Celda de la grilla de cada punto, nombrada por su esquina suroeste"""
+    fila = np.floor(np.asarray(latitud, dtype=np.float64) / tamano).astype(np.int64)
+    columna = np.floor(np.asarray(longitud, dtype=np.float64) / tamano).astype(np.int64)
+    celdas, inversa = np.unique(np.stack([fila, columna], axis=1), axis=0, return_inverse=True)
+    nombres = np.array([f"{f * tamano:.4g}_{c * tamano:.4g}" for f, c in celdas])
+    return nombres[inversa.reshape(-1)]
+
+
+def bloques_municipio(codigo_dane, latitud, longitud, tamano: float = BLOQUE_GRADOS) -> np.ndarray:
+    """Municipio de cada punto; los puntos fuera de geo.municipios usan su celda de grilla"""
+    codigo = np.asarray(pd.Series(codigo_dane, dtype=object).fillna('').astype(str))
+    celda = bloques_grilla(latitud, longitud, tamano)
+    return np.where(codigo != '', codigo, celda)
+
+
+def asignar_folds(bloques: np.ndarray, n_folds: int = 5) -> np.ndarray:
+    """
+    Fold de cada muestra: cada bloque completo en un fold.
+
+    Los bloques se reparten del más grande al más chico, cada uno al fold
+    con menos muestras (determinista, folds de tamaño parecido).
+    """
+    nombres, inversa, conteos = np.unique(bloques, return_inverse=True, return_counts=True)
+    if len(nombres) < n_folds:
+        raise ValueError(f"Hay {len(nombres)} bloques para {n_folds} folds: use bloques más pequeños")
+
+    fold_bloque = np.empty(len(nombres), dtype=np.int64)
+    tamanos = np.zeros(n_folds, dtype=np.int64)
+    # Orden estable por tamaño descendente y luego por nombre
+    for b in np.lexsort((nombres, -conteos)):
+        fold_bloque[b] = int(np.argmin(tamanos))
+        tamanos[fold_bloque[b]] += conteos[b]
+    return fold_bloque[inversa.reshape(-1)]
+
+
+def folds_espaciales(bloques: np.ndarray, n_folds: int = 5, directorio: Optional[str] = FOLDS_DIR) -> np.ndarray:
+    """
+    asignar_folds con caché en disco, por huella de los bloques y n_folds.
+
+    Args:
+        bloques: Bloque de cada muestra (en el orden de X)
+        n_folds: Número de folds
+        directorio: Carpeta de la caché (None = no guardar)
+
+    Returns:
+        Array con el fold de cada muestra
+    """
+    bloques = np.asarray(bloques).astype(str)
+    if directorio is None:
+        return asignar_folds(bloques, n_folds)
+
+    huella = hashlib.sha256('\n'.join(bloques.tolist()).encode())
+    huella.update(f"|{n_folds}".encode())
+    path = os.path.join(directorio, f"folds_{huella.hexdigest()[:16]}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+
+    folds = asignar_folds(bloques, n_folds)
+    os.makedirs(directorio, exist_ok=True)
+    tmp = path + '.tmp.npy'
+    np.save(tmp, folds)
+    os.replace(tmp, path)
+    return folds
+
+
+def _evaluar_fold(modelo, X: np.ndarray, y: np.ndarray, idx_train: np.ndarray,
+                  idx_test: np.ndarray, n_clases: int) -> tuple:
+    """Entrena un fold y devuelve (idx_test, probabilidades, accuracy, segundos)"""
+    inicio = time.perf_counter()
+    with threadpool_limits(limits=1):
+        modelo.fit(X[idx_train], y[idx_train])
+
+    # Un fold puede no ver todas las clases: se ubican en su columna global
+    probs = np.zeros((len(idx_test), n_clases))
+    probs[:, modelo.classes_] = modelo.predict_proba(X[idx_test])
+    accuracy = accuracy_score(y[idx_test], probs.argmax(axis=1))
+    return idx_test, probs, accuracy, time.perf_counter() - inicio
+
+
+class ResultadoCV:
+    """Resultado de una validación cruzada."""
+
+    def __init__(self, scores: np.ndarray, oof_probs: np.ndarray, y: np.ndarray,
+                 clases: List[str], segundos: float, n_procesos: int,
+                 folds: np.ndarray, bloques: Optional[np.ndarray] = None):
+        self.scores = scores
+        self.oof_probs = oof_probs
+        self.y = y
+        self.clases = clases
+        self.segundos = segundos
+        self.n_procesos = n_procesos
+        self.folds = folds
+        self.bloques = bloques
+
+    @property
+    def oof_accuracy(self) -> float:
+        return float(accuracy_score(self.y, self.oof_probs.argmax(axis=1)))
+
+    def metricas(self) -> dict:
+        """Métricas out-of-fold, serializables para la metadata del modelo"""
+        etiquetas = np.arange(len(self.clases))
+        prediccion = self.oof_probs.argmax(axis=1)
+        precision, recall, f1, soporte = precision_recall_fscore_support(
+            self.y, prediccion, labels=etiquetas, zero_division=0
+        )
+        return {
+            'cv_folds': len(self.scores),
+            'cv_scores': [float(s) for s in self.scores],
+            'oof_accuracy': self.oof_accuracy,
+            'oof_log_loss': float(log_loss(self.y, np.clip(self.oof_probs, 1e-15, 1), labels=etiquetas)),
+            'por_clase': {
+                clase: {
+                    'precision': float(precision[i]),
+                    'recall': float(recall[i]),
+                    'f1': float(f1[i]),
+                    'soporte': int(soporte[i])
+                }
+                for i, clase in enumerate(self.clases)
+            },
+            'matriz_confusion': confusion_matrix(self.y, prediccion, labels=etiquetas).tolist(),
+            'estrategia': 'estratificada' if self.bloques is None else 'espacial',
+            **({} if self.bloques is None else {'por_bloque': self.metricas_por_bloque()})
+        }
+
+    def metricas_por_bloque(self) -> dict:
+        """Muestras, fold y accuracy out-of-fold de cada bloque espacial"""
+        nombres, inversa = np.unique(self.bloques, return_inverse=True)
+        inversa = inversa.reshape(-1)
+        aciertos = (self.oof_probs.argmax(axis=1) == self.y).astype(np.float64)
+        muestras = np.bincount(inversa, minlength=len(nombres))
+        correctas = np.bincount(inversa, weights=aciertos, minlength=len(nombres))
+        fold = np.zeros(len(nombres), dtype=np.int64)
+        fold[inversa] = self.folds
+        return {
+            str(nombre): {
+                'muestras': int(muestras[b]),
+                'fold': int(fold[b]),
+                'accuracy': float(correctas[b] / muestras[b])
+            }
+            for b, nombre in enumerate(nombres)
+        }
+
+
+def evaluar_cv(modelo, X, y, clases: List[str], n_folds: int = 5,
+               n_procesos: Optional[int] = None, folds: Optional[np.ndarray] = None,
+               bloques: Optional[np.ndarray] = None) -> ResultadoCV:
+    """
+    Validación cruzada con un proceso por fold.
+
+    Args:
+        modelo: Estimador de scikit-learn sin entrenar (se clona por fold)
+        X: Features
+        y: Target codificado (0..n_clases-1)
+        clases: Nombres de las clases, en el orden del encoder
+        n_folds: Número de folds (ignorado si se pasa `folds`)
+        n_procesos: Procesos en paralelo (default: núcleos disponibles, máximo n_folds)
+        folds: Fold de cada muestra (p.ej. de folds_espaciales); default: estratificados
+        bloques: Bloque espacial de cada muestra, para las métricas por bloque
+
+    Returns:
+        ResultadoCV con scores por fold y probabilidades out-of-fold
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    if folds is None:
+        asignacion = np.empty(len(y), dtype=np.int64)
+        for k, (_, idx_test) in enumerate(StratifiedKFold(n_splits=n_folds).split(X, y)):
+            asignacion[idx_test] = k
+    else:
+        asignacion = np.asarray(folds, dtype=np.int64)
+        n_folds = int(asignacion.max()) + 1
+    folds = [(np.flatnonzero(asignacion != k), np.flatnonzero(asignacion == k)) for k in range(n_folds)]
+    n_procesos = max(1, min(n_procesos or nucleos_disponibles(), n_folds))
+
+    # Un hilo por fold: el paralelismo está en los procesos
+    base = clone(modelo)
+    if 'n_jobs' in base.get_params():
+        base.set_params(n_jobs=1)
+
+    inicio = time.perf_counter()
+    tareas = [(clone(base), X, y, idx_train, idx_test, len(clases)) for idx_train, idx_test in folds]
+    if n_procesos == 1:
+        resultados = [_evaluar_fold(*tarea) for tarea in tareas]
+    else:
+        with ProcessPoolExecutor(max_workers=n_procesos) as pool:
+            resultados = list(pool.map(_evaluar_fold, *zip(*tareas)))
+
+    oof_probs = np.zeros((len(y), len(clases)))
+    scores = np.empty(len(resultados))
+    for i, (idx_test, probs, accuracy, _) in enumerate(resultados):
+        oof_probs[idx_test] = probs
+        scores[i] = accuracy
+
+    return ResultadoCV(scores, oof_probs, y, list(clases), time.perf_counter() - inicio, n_procesos,
+                       asignacion, None if bloques is None else np.asarray(bloques).astype(str))
@@ -0,0 +1,123 @@
+"""
+Features del modelo de riesgo, compartidas por entrenamiento y servicio.
+
+Todas las features se calculan aquí, vectorizadas con NumPy, a partir de las
+columnas crudas (latitud, longitud, fecha o mes). train_model.py solo extrae
+las columnas crudas de la base de datos y el servicio llama a las mismas
+funciones, así que no puede haber diferencias entre entrenamiento y
+predicción.
+
+La especificación (versión, columnas y constantes) se guarda en la metadata
+del modelo; el servicio rechaza artefactos con otra versión de features.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Subir la versión cada vez que cambie el cálculo o el orden de las features
+FEATURE_SPEC_VERSION = 1
+
+# Centro de Nariño
+LAT_CENTRO = 1.2
+LON_CENTRO = -77.3
+
+# Reglas de zona geográfica, evaluadas en orden (la primera que se cumple gana)
+LON_COSTA = -78.0
+LAT_NORTE = 1.5
+LAT_SUR = 0.8
+ZONA_POR_DEFECTO = 'CENTRO'
+
+FEATURE_COLUMNS = [
+    'latitud', 'longitud', 'mes', 'trimestre',
+    'distancia_centro', 'zona_encoded',
+    'lat_mes', 'lon_mes'
+]
+
+
+def mes_desde_fecha(fecha) -> np.ndarray:
+    """Mes (1-12) de un array de fechas"""
+    fecha = np.asarray(fecha, dtype='datetime64[D]')
+    return fecha.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+
+def zona_geografica(latitud, longitud) -> np.ndarray:
+    """Zona geográfica por punto"""
+    latitud = np.asarray(latitud, dtype=np.float64)
+    longitud = np.asarray(longitud, dtype=np.float64)
+    return np.select(
+        [longitud < LON_COSTA, latitud > LAT_NORTE, latitud < LAT_SUR],
+        ['COSTA_PACIFICA', 'NORTE', 'SUR'],
+        default=ZONA_POR_DEFECTO
+    )
+
+
+def calcular_columnas(latitud, longitud, mes, zona_encoder,
+                      columnas: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Calcula las features del modelo para arrays de puntos.
+
+    Args:
+        latitud: Latitudes
+        longitud: Longitudes
+        mes: Meses (1-12)
+        zona_encoder: Encoder de zonas entrenado (zonas no vistas -> ValueError)
+        columnas: Orden de columnas del modelo (default: FEATURE_COLUMNS)
+
+    Returns:
+        Dict columna -> array, en el orden de `columnas`
+    """
+    latitud = np.asarray(latitud, dtype=np.float64)
+    longitud = np.asarray(longitud, dtype=np.float64)
+    mes = np.asarray(mes, dtype=np.int64)
+
+    calculadas = {
+        'latitud': latitud,
+        'longitud': longitud,
+        'mes': mes,
+        'trimestre': (mes - 1) // 3 + 1,
+        'distancia_centro': np.sqrt((latitud - LAT_CENTRO)**2 + (longitud - LON_CENTRO)**2),
+        'zona_encoded': zona_encoder.transform(zona_geografica(latitud, longitud)),
+        'lat_mes': latitud * mes,
+        'lon_mes': longitud * mes
+    }
+    return {col: calculadas[col] for col in (columnas or FEATURE_COLUMNS)}
+
+
+def calcular_features(latitud, longitud, mes, zona_encoder,
+                      columnas: Optional[List[str]] = None) -> pd.DataFrame:
+    """calcular_columnas como DataFrame, con una fila por punto"""
+    return pd.DataFrame(calcular_columnas(latitud, longitud, mes, zona_encoder, columnas))
+
+
+def especificacion() -> dict:
+    """Especificación de features que se guarda con los artefactos del modelo"""
+    return {
+        'version': FEATURE_SPEC_VERSION,
+        'columnas': list(FEATURE_COLUMNS),
+        'centro': [LAT_CENTRO, LON_CENTRO],
+        'zonas': {
+            'COSTA_PACIFICA': f'longitud < {LON_COSTA}',
+            'NORTE': f'latitud > {LAT_NORTE}',
+            'SUR': f'latitud < {LAT_SUR}',
+            ZONA_POR_DEFECTO: 'resto'
+        }
+    }
+
+
+def verificar_especificacion(metadata: dict):
+    """
+    Valida que el modelo se entrenó con esta versión de features.
+
+    Los artefactos anteriores a la especificación versionada usan la versión 1.
+    """
+    spec = metadata.get('feature_spec') or {'version': 1}
+    if spec['version'] != FEATURE_SPEC_VERSION:
+        raise ValueError(
+            f"El modelo usa la versión {spec['version']} de features y el servicio "
+            f"la versión {FEATURE_SPEC_VERSION}: reentrene o actualice el servicio"
+        )
+    desconocidas = set(metadata['feature_columns']) - set(FEATURE_COLUMNS)
+    if desconocidas:
+        raise ValueError(f"Features desconocidas en el modelo: {sorted(desconocidas)}")
@@ -0,0 +1,295 @@
+"""
+Motor de inferencia compilado para los modelos de riesgo.
+
+El ensamble de árboles (RandomForest o HistGradientBoosting) se aplana en
+arrays contiguos de NumPy (feature, threshold, left, right, value) y se
+evalúa recorriendo todos los árboles a la vez, nivel por nivel, para todo el
+lote. No depende de scikit-learn en tiempo de ejecución.
+
+Los arrays se distribuyen dentro del bundle del modelo (ver model_bundle.py).
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# Muestras por bloque al recorrer el bosque (acota la memoria de T x n índices)
+BLOQUE_MUESTRAS = 4096
+
+
+def _reordenar_hermanos(hijos_izq: np.ndarray, hijos_der: np.ndarray) -> np.ndarray:
+    """
+    Renumera los nodos en anchura de modo que los hijos de cada nodo queden
+    contiguos (derecho = izquierdo + 1). Devuelve el orden nuevo como lista
+    de índices originales; las hojas tienen hijo -1.
+    """
+    orden = [0]
+    i = 0
+    while i < len(orden):
+        nodo = orden[i]
+        if hijos_izq[nodo] != -1:
+            orden.append(hijos_izq[nodo])
+            orden.append(hijos_der[nodo])
+        i += 1
+    return np.array(orden, dtype=np.int64)
+
+
+def _aplanar_arbol(t: int, max_nodos: int, hijos_izq: np.ndarray, hijos_der: np.ndarray,
+                   features: np.ndarray, umbrales: np.ndarray, arrays: dict) -> np.ndarray:
+    """
+    Escribe el árbol t en los arrays globales con los hermanos contiguos.
+
+    Returns:
+        Orden de los nodos originales (para reordenar los valores de hoja)
+    """
+    orden = _reordenar_hermanos(hijos_izq, hijos_der)
+    n = len(orden)
+    base = t * max_nodos
+    posicion = np.empty(len(hijos_izq), dtype=np.int64)
+    posicion[orden] = np.arange(n)
+
+    izq = hijos_izq[orden]
+    der = hijos_der[orden]
+    es_hoja = izq == -1
+    propios = base + np.arange(n)
+
+    arrays['feature'][t, :n] = np.where(es_hoja, 0, features[orden])
+    arrays['threshold'][t, :n] = np.where(es_hoja, np.inf, umbrales[orden])
+    arrays['left'][t, :n] = np.where(es_hoja, propios, base + posicion[np.maximum(izq, 0)])
+    arrays['right'][t, :n] = np.where(es_hoja, propios, base + posicion[np.maximum(der, 0)])
+    return orden
+
+
+def _arrays_vacios(n_arboles: int, max_nodos: int) -> dict:
+    return {
+        'feature': np.zeros((n_arboles, max_nodos), dtype=np.int32),
+        'threshold': np.full((n_arboles, max_nodos), np.inf, dtype=np.float64),
+        'left': np.zeros((n_arboles, max_nodos), dtype=np.int32),
+        'right': np.zeros((n_arboles, max_nodos), dtype=np.int32)
+    }
+
+
+def exportar_forest(clf) -> dict:
+    """
+    Aplana un RandomForestClassifier entrenado en arrays de nodos.
+
+    Los nodos se renumeran para que los hermanos sean contiguos, así el hijo
+    es `left + (x > threshold)`. Los índices quedan globales
+    (árbol * max_nodos + nodo) y las hojas apuntan a sí mismas con umbral
+    +inf, de modo que el recorrido puede avanzar siempre `profundidad` pasos
+    sin ramas especiales.
+
+    Args:
+        clf: RandomForestClassifier entrenado
+
+    Returns:
+        Diccionario con los arrays exportados
+    """
+    arboles = [est.tree_ for est in clf.estimators_]
+    n_arboles = len(arboles)
+    max_nodos = max(t.node_count for t in arboles)
+    n_clases = int(clf.n_classes_)
+
+    arrays = _arrays_vacios(n_arboles, max_nodos)
+    value = np.zeros((n_arboles, max_nodos, n_clases), dtype=np.float64)
+
+    for t, arbol in enumerate(arboles):
+        orden = _aplanar_arbol(
+            t, max_nodos, arbol.children_left, arbol.children_right,
+            arbol.feature, arbol.threshold, arrays
+        )
+
+        # Igual que DecisionTreeClassifier.predict_proba: valor normalizado por fila
+        valores = arbol.value[orden, 0, :]
+        totales = valores.sum(axis=1, keepdims=True)
+        totales[totales == 0] = 1.0
+        value[t, :len(orden)] = valores / totales
+
+    arrays.update({
+        'value': value,
+        'profundidad': np.array(max(t.max_depth for t in arboles), dtype=np.int32),
+        'n_features': np.array(clf.n_features_in_, dtype=np.int32)
+    })
+    return arrays
+
+
+def exportar_boosting(clf) -> dict:
+    """
+    Aplana un HistGradientBoostingClassifier entrenado en arrays de nodos.
+
+    Mismo layout que exportar_forest. Los árboles quedan en orden
+    iteración-mayor (cada iteración tiene un árbol por clase, o uno solo en
+    problemas binarios) y `value` guarda el valor crudo de cada hoja; la
+    predicción es baseline + suma de hojas seguida de softmax (o sigmoide).
+
+    Args:
+        clf: HistGradientBoostingClassifier entrenado (sin features categóricas)
+
+    Returns:
+        Diccionario con los arrays exportados
+    """
+    predictores = [p for iteracion in clf._predictors for p in iteracion]
+    if any(p.nodes['is_categorical'].any() for p in predictores):
+        raise ValueError("El motor compilado no soporta splits categóricos")
+
+    n_arboles = len(predictores)
+    max_nodos = max(len(p.nodes) for p in predictores)
+
+    arrays = _arrays_vacios(n_arboles, max_nodos)
+    value = np.zeros((n_arboles, max_nodos), dtype=np.float64)
+    faltante_derecha = np.zeros((n_arboles, max_nodos), dtype=bool)
+
+    for t, predictor in enumerate(predictores):
+        nodos = predictor.nodes
+        es_hoja = nodos['is_leaf'].astype(bool)
+        orden = _aplanar_arbol(
+            t, max_nodos,
+            np.where(es_hoja, -1, nodos['left'].astype(np.int64)),
+            np.where(es_hoja, -1, nodos['right'].astype(np.int64)),
+            nodos['feature_idx'], nodos['num_threshold'], arrays
+        )
+        value[t, :len(orden)] = np.where(es_hoja, nodos['value'], 0.0)[orden]
+        faltante_derecha[t, :len(orden)] = ~nodos['missing_go_to_left'][orden].astype(bool) & ~es_hoja[orden]
+
+    arrays.update({
+        'value': value,
+        'faltante_derecha': faltante_derecha,
+        'baseline': np.asarray(clf._baseline_prediction, dtype=np.float64).ravel(),
+        'arboles_por_iteracion': np.array(len(clf._predictors[0]), dtype=np.int32),
+        'profundidad': np.array(max(int(p.nodes['depth'].max()) for p in predictores), dtype=np.int32),
+        'n_features': np.array(clf.n_features_in_, dtype=np.int32),
+        'n_clases': np.array(len(clf.classes_), dtype=np.int32)
+    })
+    return arrays
+
+
+def exportar_modelo(clf) -> tuple:
+    """(tipo, arrays) para cualquier modelo soportado por el motor"""
+    if hasattr(clf, 'estimators_'):
+        return 'random_forest', exportar_forest(clf)
+    if hasattr(clf, '_predictors'):
+        return 'hist_gradient_boosting', exportar_boosting(clf)
+    raise ValueError(f"Modelo no soportado por el motor compilado: {type(clf).__name__}")
+
+
+class _ArbolesCompilados(ABC):
+    """Recorrido vectorizado común a los dos tipos de ensamble."""
+
+    # Tipo con el que se comparan las features (igual que scikit-learn)
+    DTYPE_X = np.float32
+    # Si el modelo tiene una rama aprendida para valores faltantes (NaN)
+    RAMA_FALTANTES = False
+
+    def __init__(self, arrays: dict):
+        # Los arrays pueden venir de un np.memmap: solo se toman vistas, sin copiar
+        self.n_arboles, self.max_nodos = arrays['feature'].shape
+        self.profundidad = int(arrays['profundidad'])
+        self.n_features = int(arrays['n_features'])
+
+        # Vistas planas: los índices de hijos ya son globales
+        self.feature = arrays['feature'].reshape(-1)
+        self.threshold = arrays['threshold'].reshape(-1)
+        self.left = arrays['left'].reshape(-1)
+
+        # Nodo raíz de cada árbol
+        self.raices = (np.arange(self.n_arboles, dtype=np.int64) * self.max_nodos)[:, None]
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=self.DTYPE_X)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Se esperaban {self.n_features} features, se recibieron {X.shape}")
+
+        salida = np.empty((X.shape[0], self.n_clases), dtype=np.float64)
+        for inicio in range(0, X.shape[0], BLOQUE_MUESTRAS):
+            bloque = X[inicio:inicio + BLOQUE_MUESTRAS]
+            salida[inicio:inicio + len(bloque)] = self._proba_bloque(bloque)
+        return salida
+
+    def predict(self, X) -> np.ndarray:
+        return np.argmax(self.predict_proba(X), axis=1)
+
+    def _hojas(self, X: np.ndarray) -> np.ndarray:
+        """Nodo hoja alcanzado en cada árbol, array (n_arboles, n)"""
+        n = X.shape[0]
+        X_plano = X.ravel()
+        desplazamiento = (np.arange(n, dtype=np.int64) * self.n_features)[None, :]
+        nodos = np.repeat(self.raices, n, axis=1)
+        faltantes = self.RAMA_FALTANTES and bool(np.isnan(X).any())
+
+        # Todos los árboles avanzan un nivel por iteración; las hojas se quedan
+        # quietas porque apuntan a sí mismas y su umbral es +inf
+        for _ in range(self.profundidad):
+            x = X_plano[desplazamiento + self.feature[nodos]]
+            derecha = x > self.threshold[nodos]
+            if faltantes:
+                derecha |= np.isnan(x) & self.faltante_derecha[nodos]
+            nodos = self.left[nodos] + derecha
+        return nodos
+
+    @abstractmethod
+    def _proba_bloque(self, X: np.ndarray) -> np.ndarray:
+        """Probabilidades (n, n_clases) de un bloque de a lo sumo BLOQUE_MUESTRAS filas"""
+
+
+class CompiledForest(_ArbolesCompilados):
+    """
+    Evaluador vectorizado del bosque exportado.
+
+    Expone predict_proba con la misma semántica que scikit-learn: las features
+    se comparan en float32 contra umbrales float64 y las probabilidades son el
+    promedio de las hojas alcanzadas en cada árbol.
+    """
+
+    def __init__(self, arrays: dict):
+        super().__init__(arrays)
+        self.n_clases = arrays['value'].shape[2]
+        self.value = arrays['value'].reshape(-1, self.n_clases)
+
+    def _proba_bloque(self, X: np.ndarray) -> np.ndarray:
+        return self.value[self._hojas(X)].mean(axis=0)
+
+
+class CompiledBoosting(_ArbolesCompilados):
+    """
+    Evaluador vectorizado de HistGradientBoosting exportado.
+
+    Igual que scikit-learn: las features se comparan en float64, los valores
+    faltantes siguen la rama aprendida en el entrenamiento y el valor crudo
+    (baseline + suma de hojas por clase) pasa por softmax, o por sigmoide en
+    problemas binarios.
+    """
+
+    DTYPE_X = np.float64
+    RAMA_FALTANTES = True
+
+    def __init__(self, arrays: dict):
+        super().__init__(arrays)
+        self.n_clases = int(arrays['n_clases'])
+        self.por_iteracion = int(arrays['arboles_por_iteracion'])
+        self.value = arrays['value'].reshape(-1)
+        self.faltante_derecha = arrays['faltante_derecha'].reshape(-1)
+        self.baseline = np.asarray(arrays['baseline'], dtype=np.float64)
+
+    def _proba_bloque(self, X: np.ndarray) -> np.ndarray:
+        hojas = self.value[self._hojas(X)]
+        crudo = hojas.reshape(-1, self.por_iteracion, X.shape[0]).sum(axis=0).T + self.baseline
+
+        if self.por_iteracion == 1:
+            positiva = 1.0 / (1.0 + np.exp(-crudo[:, 0]))
+            return np.column_stack([1.0 - positiva, positiva])
+        crudo -= crudo.max(axis=1, keepdims=True)
+        exp = np.exp(crudo)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+MOTORES = {
+    'random_forest': CompiledForest,
+    'hist_gradient_boosting': CompiledBoosting
+}
+
+
+def compilar(tipo: str, arrays: dict) -> _ArbolesCompilados:
+    """Motor compilado para los arrays de un bundle según su tipo"""
+    if tipo not in MOTORES:
+        raise ValueError(f"Tipo de modelo sin motor compilado: {tipo} (opciones: {sorted(MOTORES)})")
+    return MOTORES[tipo](arrays)
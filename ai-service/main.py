@@ -1,12 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
-import joblib
-import pandas as pd
 import numpy as np
-from typing import Optional
+import pandas as pd
+import json
+import os
+from typing import Optional, List
+from model_registry import ModelRegistry, ModeloActivo
+from features import calcular_columnas, calcular_features, zona_geografica
+from metrics import CONTENT_TYPE, Etapas, MiddlewareMetricas, RegistroMetricas, gauges_de_estadisticas
+from batching import PredictionCoalescer
+from prediction_cache import PredictionCache
+from municipios import MUNICIPIOS_PASO, MUNICIPIOS_PASOS, CacheMunicipios, agregar_por_municipio, cuantizar_paso
+from tiles import FORMATOS, TILES_MAX_ZOOM, TileCache, calcular_tile, codificar_tile
+from streaming import STREAM_BLOQUE, LectorPuntos, formato_entrada, lineas_ndjson, parsear_lineas
 
 app = FastAPI(title="EcoGuard AI Service", version="3.0 - Optimized")
 
+# Métricas en formato Prometheus (GET /metrics)
+metricas = RegistroMetricas()
+latencia_requests = metricas.histograma(
+    'ecoguard_http_request_duracion_segundos', 'Latencia de los requests HTTP',
+    ('ruta', 'metodo', 'estado', 'version')
+)
+requests_en_curso = metricas.gauge('ecoguard_http_requests_en_curso', 'Requests HTTP en curso')
+etapas_predict = metricas.histograma(
+    'ecoguard_predict_etapa_segundos', 'Duración de cada etapa de /predict', ('etapa', 'version')
+)
+modelo_info = metricas.gauge('ecoguard_modelo_info', 'Versión y tipo del modelo activo', ('version', 'tipo'))
+# Cronómetro que no mide, para las llamadas fuera de /predict
+SIN_ETAPAS = Etapas(None)
+
 class PredictionRequest(BaseModel):
     latitud: float
     longitud: float
@@ -14,72 +40,135 @@ class PredictionRequest(BaseModel):
     dia_semana: Optional[int] = None
     precipitacion: float = 0.0
 
-# Cargar modelo y artefactos
-try:
-    model = joblib.load('models/model_riesgo.pkl')
-    label_encoder = joblib.load('models/label_encoder.pkl')
-    zona_encoder = joblib.load('models/zona_encoder.pkl')
-    metadata = joblib.load('models/metadata.pkl')
-    print("✅ Modelo OPTIMIZADO cargado exitosamente")
-    print(f"   - Features: {len(metadata['feature_columns'])}")
-    print(f"   - Clases: {metadata['n_classes']} - {metadata['classes']}")
-    print(f"   - Accuracy test: {metadata['test_score']:.2%}")
-    print(f"   - Accuracy CV: {metadata['cv_score_mean']:.2%}")
-except Exception as e:
-    print(f"⚠️ Error cargando modelo: {e}")
-    model = None
-    label_encoder = None
-    zona_encoder = None
-    metadata = None
-
-def calcular_features(latitud: float, longitud: float, mes: int):
-    """
-    Calcula las 8 features optimizadas del modelo.
-    """
-    # Centro de Nariño
-    LAT_CENTRO = 1.2
-    LON_CENTRO = -77.3
-    
-    # Temporales
-    trimestre = (mes - 1) // 3 + 1  # 1-4
-    
-    # Geográficas
-    distancia_centro = np.sqrt((latitud - LAT_CENTRO)**2 + (longitud - LON_CENTRO)**2)
-    
-    # Zona geográfica
-    if longitud < -78.0:
-        zona = 'COSTA_PACIFICA'
-    elif latitud > 1.5:
-        zona = 'NORTE'
-    elif latitud < 0.8:
-        zona = 'SUR'
-    else:
-        zona = 'CENTRO'
-    
-    zona_encoded = zona_encoder.transform([zona])[0]
-    
-    # Interacciones
-    lat_mes = latitud * mes
-    lon_mes = longitud * mes
+class PredictionBatchRequest(BaseModel):
+    latitud: List[float]
+    longitud: List[float]
+    mes: List[int]
+
+# Límite de puntos por lote para acotar memoria por request
+MAX_BATCH_SIZE = 50000
+
+# Segundos entre revisiones de models/ para recargar en caliente (0 = desactivado)
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', '30'))
+
+# Token opcional para POST /models/reload (cabecera X-Admin-Token)
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')
+
+# Micro-batching opcional de /predict: agrupa requests concurrentes hasta
+# PREDICT_COALESCE_MS milisegundos o PREDICT_COALESCE_MAX puntos
+PREDICT_COALESCE = os.getenv('PREDICT_COALESCE', '0').lower() in ('1', 'true', 'yes')
+PREDICT_COALESCE_MS = float(os.getenv('PREDICT_COALESCE_MS', '5'))
+PREDICT_COALESCE_MAX = int(os.getenv('PREDICT_COALESCE_MAX', '256'))
+
+# Rango permitido para el paso de muestreo de /predict/municipios (grados);
+# dentro del rango se usa el paso permitido más cercano (MUNICIPIOS_PASOS)
+MUNICIPIOS_PASO_MIN = MUNICIPIOS_PASOS[0] / 2
+MUNICIPIOS_PASO_MAX = MUNICIPIOS_PASOS[-1]
+
+# Lote fijo para calentar cada versión antes de activarla (zonas conocidas, 12 meses)
+PUNTOS_CALENTAMIENTO = [(1.2, -77.3), (1.8, -77.5), (1.5, -78.5), (2.0, -78.8)]
+
+def puntos_con_zona_conocida(modelo: ModeloActivo, latitud: np.ndarray, longitud: np.ndarray) -> np.ndarray:
+    """Máscara de puntos cuya zona fue vista por zona_encoder en el entrenamiento"""
+    return np.isin(zona_geografica(latitud, longitud), modelo.zona_encoder.classes_)
+
+def puntuar_puntos(modelo: ModeloActivo, latitud, longitud, mes) -> np.ndarray:
+    """Probabilidades por clase evaluando el modelo en vivo"""
+    return modelo.predict_proba(
+        calcular_features(latitud, longitud, mes, modelo.zona_encoder, modelo.metadata['feature_columns'])
+    )
+
+def probabilidades_puntos(modelo: ModeloActivo, latitud, longitud, mes) -> np.ndarray:
+    """Probabilidades por clase usando la malla precalculada y el modelo para el resto"""
+    latitud = np.asarray(latitud, dtype=np.float64)
+    longitud = np.asarray(longitud, dtype=np.float64)
+    mes = np.asarray(mes, dtype=np.int64)
+    n = len(latitud)
+    probs, resueltos = (
+        modelo.risk_lattice.consultar(latitud, longitud, mes)
+        if modelo.risk_lattice is not None
+        else (np.empty((n, modelo.metadata['n_classes'])), np.zeros(n, dtype=bool))
+    )
     
-    return {
-        'latitud': latitud,
-        'longitud': longitud,
-        'mes': mes,
-        'trimestre': trimestre,
-        'distancia_centro': distancia_centro,
-        'zona_encoded': zona_encoded,
-        'lat_mes': lat_mes,
-        'lon_mes': lon_mes
-    }
+    # Los puntos que la malla no resuelve se evalúan con el modelo en una sola llamada
+    pendientes = ~resueltos
+    if pendientes.any():
+        probs[pendientes] = puntuar_puntos(modelo, latitud[pendientes], longitud[pendientes], mes[pendientes])
+    return probs
+
+def top_k(probs: np.ndarray, k: int) -> np.ndarray:
+    """Índices de las k clases más probables de cada fila, de mayor a menor (todo el lote a la vez)"""
+    probs = np.atleast_2d(probs)
+    if k < probs.shape[1]:
+        candidatos = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    else:
+        candidatos = np.broadcast_to(np.arange(probs.shape[1]), probs.shape)
+    orden = np.argsort(-np.take_along_axis(probs, candidatos, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidatos, orden, axis=1)
+
+def validar_k(modelo: ModeloActivo, k: int):
+    if not 1 <= k <= len(modelo.clases):
+        raise HTTPException(status_code=422, detail=f"k debe estar entre 1 y {len(modelo.clases)}")
+
+def calentar_modelo(modelo: ModeloActivo):
+    """Ejercita una versión recién cargada (features, predicción y decodificación)"""
+    lat, lon = np.array(PUNTOS_CALENTAMIENTO).T
+    lat, lon = np.repeat(lat, 12), np.repeat(lon, 12)
+    mes = np.tile(np.arange(1, 13), len(PUNTOS_CALENTAMIENTO))
+    probs = puntuar_puntos(modelo, lat, lon, mes)
+    if probs.shape != (len(lat), modelo.metadata['n_classes']) or not np.isfinite(probs).all():
+        raise ValueError(f"Calentamiento inválido: salida {probs.shape}")
+    modelo.clases[top_k(probs, 1)]
+    formatear_prediccion(modelo, probs[0])
+
+# Registro de versiones (la carga inicial se hace al final del módulo)
+registry = ModelRegistry(
+    'models',
+    calentar=calentar_modelo,
+    # Tiles de versiones anteriores a la activada (los de versiones más nuevas se conservan)
+    al_activar=lambda modelo: cache_tiles.podar(modelo.version, modelo.creado)
+)
+
+app.add_middleware(
+    MiddlewareMetricas,
+    latencia=latencia_requests,
+    en_curso=requests_en_curso,
+    version=lambda: registry.activo.version if registry.activo else 'ninguna'
+)
+
+def modelo_activo() -> ModeloActivo:
+    """Versión activa para este request (una sola lectura de la referencia)"""
+    modelo = registry.activo
+    if modelo is None:
+        raise HTTPException(status_code=503, detail="Modelo no disponible")
+    return modelo
+
+def puntuar_lote_activo(latitud: np.ndarray, longitud: np.ndarray, mes: np.ndarray):
+    """Evalúa un lote agrupado con la versión activa y la devuelve como contexto"""
+    modelo = modelo_activo()
+    return modelo, puntuar_puntos(modelo, latitud, longitud, mes)
+
+cache_municipios = CacheMunicipios()
+cache_tiles = TileCache()
+cache_predicciones = PredictionCache()
+
+coalescer = (
+    PredictionCoalescer(puntuar_lote_activo, PREDICT_COALESCE_MS, PREDICT_COALESCE_MAX)
+    if PREDICT_COALESCE else None
+)
 
 @app.get("/")
 def read_root():
+    modelo = registry.activo
+    metadata = modelo.metadata if modelo else None
     return {
         "status": "online", 
         "service": "EcoGuard AI",
         "version": "3.0 - Optimized with Class Grouping",
-        "model_loaded": model is not None,
+        "model_loaded": modelo is not None,
+        "model_version": modelo.version if modelo else None,
+        "compiled_forest": modelo is not None and modelo.compiled_forest is not None,
+        "risk_lattice": modelo is not None and modelo.risk_lattice is not None,
         "features": len(metadata['feature_columns']) if metadata else 0,
         "classes": metadata['n_classes'] if metadata else 0,
         "accuracy_test": f"{metadata['test_score']:.2%}" if metadata else "N/A",
@@ -89,10 +178,11 @@ def read_root():
 @app.get("/info")
 def get_info():
     """Información detallada del modelo"""
-    if metadata is None:
-        raise HTTPException(status_code=503, detail="Modelo no disponible")
+    modelo = modelo_activo()
+    metadata = modelo.metadata
     
     return {
+        "modelo": modelo.info(),
         "features": {
             "total": len(metadata['feature_columns']),
             "list": metadata['feature_columns'],
@@ -114,50 +204,392 @@ def get_info():
         }
     }
 
+def formatear_prediccion(modelo: ModeloActivo, probs: np.ndarray, etapas: Etapas = SIN_ETAPAS,
+                         k: int = 3) -> dict:
+    """Arma la respuesta de /predict a partir del vector de probabilidades"""
+    metadata = modelo.metadata
+    with etapas.medir('top_k'):
+        top_idx = top_k(probs, k)[0]
+    
+    # Nombres desde la tabla precalculada del modelo
+    with etapas.medir('decodificar'):
+        top_predicciones = [
+            {"riesgo": riesgo, "probabilidad": probabilidad}
+            for riesgo, probabilidad in zip(modelo.clases[top_idx].tolist(), probs[top_idx].tolist())
+        ]
+    
+    return {
+        "riesgo": top_predicciones[0]["riesgo"],
+        "probabilidad": top_predicciones[0]["probabilidad"],
+        f"top_{k}_predicciones": top_predicciones,
+        "features_utilizadas": len(metadata['feature_columns']),
+        "modelo_version": "3.0 - Optimized",
+        "detalles": f"Predicción con {len(metadata['feature_columns'])} features (accuracy: {metadata['test_score']:.0%})"
+    }
+
+def predecir_punto(modelo: ModeloActivo, request: PredictionRequest, etapas: Etapas = SIN_ETAPAS,
+                   k: int = 3) -> dict:
+    """Predicción de un punto evaluando el modelo directamente"""
+    with etapas.medir('features'):
+        columnas = calcular_columnas(
+            [request.latitud],
+            [request.longitud],
+            [request.mes],
+            modelo.zona_encoder,
+            modelo.metadata['feature_columns']
+        )
+    with etapas.medir('dataframe'):
+        features = pd.DataFrame(columnas)
+    
+    # Predecir (una sola pasada del bosque; la clase es el argmax)
+    with etapas.medir('predict_proba'):
+        probs = modelo.predict_proba(features)[0]
+    return formatear_prediccion(modelo, probs, etapas, k)
+
+async def calcular_prediccion(modelo: ModeloActivo, request: PredictionRequest, etapas: Etapas = SIN_ETAPAS,
+                              k: int = 3):
+    """(versión que evaluó el punto, respuesta de /predict)"""
+    # Consulta O(1) en la malla precalculada, si está disponible
+    if modelo.risk_lattice is not None:
+        with etapas.medir('malla'):
+            probs, resueltos = modelo.risk_lattice.consultar([request.latitud], [request.longitud], [request.mes])
+        if resueltos[0]:
+            return modelo, formatear_prediccion(modelo, probs[0], etapas, k)
+    
+    if coalescer is None:
+        return modelo, await run_in_threadpool(predecir_punto, modelo, request, etapas, k)
+    
+    # Se agrupa con otros /predict concurrentes; la respuesta se arma con
+    # la versión que evaluó el lote
+    with etapas.medir('coalescer'):
+        modelo_lote, probs = await coalescer.predecir(request.latitud, request.longitud, request.mes)
+    return modelo_lote, formatear_prediccion(modelo_lote, probs, etapas, k)
+
 @app.post("/predict")
-def predict(request: PredictionRequest):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Modelo no disponible")
+async def predict(request: PredictionRequest, k: int = 3):
+    """Clase más probable y top-k (k clases más probables, default 3)"""
+    modelo = modelo_activo()
+    validar_k(modelo, k)
+    etapas = Etapas(etapas_predict, version=modelo.version)
+    
+    # Respuestas repetidas (mismo punto redondeado, mes, k y versión del modelo)
+    with etapas.medir('cache'):
+        respuesta = cache_predicciones.obtener(modelo.version, request.latitud, request.longitud, request.mes, k)
+    if respuesta is not None:
+        return respuesta
     
     try:
-        # Calcular features
-        features_dict = calcular_features(
-            request.latitud, 
-            request.longitud, 
-            request.mes
-        )
-        
-        # Crear DataFrame
-        features = pd.DataFrame([features_dict])
-        features = features[metadata['feature_columns']]
+        modelo_usado, respuesta = await calcular_prediccion(modelo, request, etapas, k)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    cache_predicciones.guardar(modelo_usado.version, request.latitud, request.longitud, request.mes, k, respuesta)
+    return respuesta
+
+@app.post("/predict/batch")
+def predict_batch(request: PredictionBatchRequest, k: int = 3):
+    """
+    Predicción vectorizada para muchos puntos en una sola pasada del modelo.
+    
+    Los puntos en zonas no vistas en el entrenamiento responden {"error": ...}
+    en su posición; "errores" cuenta cuántos.
+    """
+    modelo = modelo_activo()
+    validar_k(modelo, k)
+    
+    n = len(request.latitud)
+    if len(request.longitud) != n or len(request.mes) != n:
+        raise HTTPException(status_code=422, detail="latitud, longitud y mes deben tener la misma longitud")
+    if n > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_BATCH_SIZE} puntos por lote")
+    if n == 0:
+        return {"predicciones": [], "total": 0, "errores": 0, "modelo_version": "3.0 - Optimized"}
+    
+    try:
+        latitud = np.asarray(request.latitud, dtype=np.float64)
+        longitud = np.asarray(request.longitud, dtype=np.float64)
+        mes = np.asarray(request.mes, dtype=np.int64)
         
-        # Predecir
-        prediction_idx = model.predict(features)[0]
-        prediction_label = label_encoder.inverse_transform([prediction_idx])[0]
-        probs = model.predict_proba(features)[0]
-        confidence = float(max(probs))
+        # Un punto en una zona que el encoder no vio es un error de ese punto,
+        # no del lote: se evalúan los demás y se responde "error" en su posición
+        conocidos = puntos_con_zona_conocida(modelo, latitud, longitud)
+        validos = np.flatnonzero(conocidos)
+        predicciones = [{"error": "zona no vista en el entrenamiento"}] * n
         
-        # Top 3 predicciones
-        top_3_idx = np.argsort(probs)[-3:][::-1]
-        top_3_predictions = [
-            {
-                "riesgo": label_encoder.inverse_transform([idx])[0],
-                "probabilidad": float(probs[idx])
-            }
-            for idx in top_3_idx
-        ]
+        if len(validos):
+            probs = probabilidades_puntos(modelo, latitud[validos], longitud[validos], mes[validos])
+            
+            # Top-k de todo el lote en una operación; la columna 0 es la predicción
+            top_idx = top_k(probs, k)
+            top_riesgos = modelo.clases[top_idx].tolist()
+            top_probs = np.take_along_axis(probs, top_idx, axis=1).tolist()
+            
+            clave_top = f"top_{k}_predicciones"
+            for i, riesgos, valores in zip(validos.tolist(), top_riesgos, top_probs):
+                predicciones[i] = {
+                    "riesgo": riesgos[0],
+                    "probabilidad": valores[0],
+                    clave_top: [
+                        {"riesgo": riesgo, "probabilidad": probabilidad}
+                        for riesgo, probabilidad in zip(riesgos, valores)
+                    ]
+                }
         
         return {
-            "riesgo": prediction_label,
-            "probabilidad": confidence,
-            "top_3_predicciones": top_3_predictions,
-            "features_utilizadas": len(metadata['feature_columns']),
-            "modelo_version": "3.0 - Optimized",
-            "detalles": f"Predicción con {len(metadata['feature_columns'])} features (accuracy: {metadata['test_score']:.0%})"
+            "predicciones": predicciones,
+            "total": n,
+            "errores": n - len(validos),
+            "modelo_version": "3.0 - Optimized"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+def puntuar_bloque_stream(modelo: ModeloActivo, lector: LectorPuntos, inicio: int, lineas: list,
+                          k: int, nombres_json: list) -> tuple:
+    """Parsea, evalúa y serializa un bloque de /predict/stream; devuelve (bytes NDJSON, filas con error)"""
+    latitud, longitud, mes, ids, errores = parsear_lineas(lineas, lector.formato, lector.columnas)
+    
+    # Filas parseadas cuya zona no conoce el encoder: error por fila, no del trabajo
+    candidatos = np.ones(len(lineas), dtype=bool)
+    candidatos[list(errores)] = False
+    desconocidos = candidatos.copy()
+    desconocidos[candidatos] = ~puntos_con_zona_conocida(modelo, latitud[candidatos], longitud[candidatos])
+    for fila in np.flatnonzero(desconocidos).tolist():
+        errores[fila] = "zona no vista en el entrenamiento"
+    validos = np.flatnonzero(candidatos & ~desconocidos)
+    
+    if len(validos):
+        probs = probabilidades_puntos(modelo, latitud[validos], longitud[validos], mes[validos])
+        top_idx = top_k(probs, k)
+        top_probs = np.take_along_axis(probs, top_idx, axis=1)
+    else:
+        top_idx = top_probs = np.empty((0, k))
+    return lineas_ndjson(inicio, validos, top_idx, top_probs, nombres_json, k,
+                         ids if lector.con_id else None, errores), len(errores)
+
+class RespuestaDuplex(StreamingResponse):
+    """
+    StreamingResponse que se envía mientras el generador todavía lee el
+    cuerpo del request. La de Starlette (ASGI < 2.4) escucha la desconexión
+    del cliente con receive() en paralelo y se quedaría con chunks del cuerpo;
+    aquí la desconexión la detecta request.stream() (ClientDisconnect).
+    """
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, k: int = 3, bloque: int = STREAM_BLOQUE):
+    """
+    Predicción de trabajos grandes: el cuerpo es NDJSON (una fila
+    {"latitud", "longitud", "mes", "id"?} por línea) o CSV con cabecera
+    (Content-Type text/csv), de cualquier tamaño.
+    
+    La respuesta empieza de inmediato: la entrada se lee por chunks, se evalúa
+    en bloques de `bloque` filas y cada bloque se devuelve apenas está listo
+    (una línea NDJSON por fila, en orden, con "indice", "id" si la cabecera
+    CSV o la primera fila NDJSON lo trae, y "error" en las filas que no se
+    pudieron evaluar). El siguiente chunk de entrada no se lee hasta que el
+    bloque anterior se envió: si el cliente no lee la respuesta, el servicio
+    deja de leer la entrada (backpressure de TCP) y la memoria queda acotada
+    a un bloque. El cliente tiene que enviar y recibir a la vez (ver
+    stream_client.py). Todo el trabajo usa la misma versión del modelo.
+    
+    Un error del servicio a mitad del trabajo corta la respuesta sin el
+    chunk final, así que el cliente la ve incompleta.
+    """
+    modelo = modelo_activo()
+    validar_k(modelo, k)
+    if not 1 <= bloque <= MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"bloque debe estar entre 1 y {MAX_BATCH_SIZE}")
+    try:
+        lector = LectorPuntos(formato_entrada(request.headers.get('content-type')), bloque)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    cuerpo = request.stream()
+    listos = []
+    if lector.formato == 'csv':
+        # La cabecera se valida antes de responder: una inválida es un 422
+        try:
+            async for chunk in cuerpo:
+                listos.extend(lector.alimentar(chunk))
+                if lector.columnas is not None:
+                    break
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    
+    nombres_json = [json.dumps(clase, ensure_ascii=False) for clase in modelo.clases.tolist()]
+    
+    async def puntuar(inicio, lineas) -> bytes:
+        datos, _ = await run_in_threadpool(puntuar_bloque_stream, modelo, lector, inicio, lineas, k, nombres_json)
+        return datos
+    
+    async def salida():
+        try:
+            for inicio, lineas in listos:
+                yield await puntuar(inicio, lineas)
+            listos.clear()
+            async for chunk in cuerpo:
+                for inicio, lineas in lector.alimentar(chunk):
+                    yield await puntuar(inicio, lineas)
+            for inicio, lineas in lector.terminar():
+                yield await puntuar(inicio, lineas)
+        except ClientDisconnect:
+            return
+        except Exception as e:
+            print(f"⚠️ /predict/stream cortado en la fila {lector.filas}: {e}")
+            raise
+    
+    return RespuestaDuplex(
+        salida(),
+        media_type='application/x-ndjson',
+        headers={"X-Model-Version": modelo.version}
+    )
+
+def riesgo_municipios(modelo: ModeloActivo, mes: int, paso: float) -> dict:
+    """Muestrea todos los municipios, evalúa un solo lote y agrega por municipio"""
+    muestras = cache_municipios.muestras(paso)
+    clases = modelo.label_encoder.classes_
+    n_municipios = len(muestras.codigos)
+    
+    # Puntos en zonas que el encoder no conoce no se pueden evaluar
+    validos = puntos_con_zona_conocida(modelo, muestras.latitud, muestras.longitud)
+    probs = np.full((len(validos), len(clases)), np.nan)
+    # Evaluación por tramos de MAX_BATCH_SIZE puntos para acotar la memoria
+    posiciones = np.flatnonzero(validos)
+    for inicio in range(0, len(posiciones), MAX_BATCH_SIZE):
+        tramo = posiciones[inicio:inicio + MAX_BATCH_SIZE]
+        probs[tramo] = probabilidades_puntos(
+            modelo, muestras.latitud[tramo], muestras.longitud[tramo], np.full(len(tramo), mes)
+        )
+    media, maximo, puntos = agregar_por_municipio(muestras.indice, probs, validos, n_municipios)
+    muestreados = np.bincount(muestras.indice, minlength=n_municipios)
+    
+    resultados = []
+    for i in range(n_municipios):
+        evaluado = puntos[i] > 0
+        resultados.append({
+            "codigo_dane": muestras.codigos[i],
+            "nombre": muestras.nombres[i],
+            "puntos_muestreados": int(muestreados[i]),
+            "puntos_evaluados": int(puntos[i]),
+            "riesgo": clases[int(np.argmax(media[i]))] if evaluado else None,
+            "probabilidad_media": {c: float(p) for c, p in zip(clases, media[i])} if evaluado else None,
+            "probabilidad_max": {c: float(p) for c, p in zip(clases, maximo[i])} if evaluado else None
+        })
+    
+    return {
+        "municipios": resultados,
+        "total": n_municipios,
+        "mes": mes,
+        "paso_grados": paso,
+        "modelo_version": modelo.version
+    }
+
+@app.get("/predict/municipios")
+def predict_municipios(mes: int, paso: float = MUNICIPIOS_PASO):
+    """Probabilidad media y máxima por clase para cada municipio de geo.municipios (paso redondeado a MUNICIPIOS_PASOS)"""
+    if not 1 <= mes <= 12:
+        raise HTTPException(status_code=422, detail="mes debe estar entre 1 y 12")
+    if not MUNICIPIOS_PASO_MIN <= paso <= MUNICIPIOS_PASO_MAX:
+        raise HTTPException(
+            status_code=422,
+            detail=f"paso debe estar entre {MUNICIPIOS_PASO_MIN} y {MUNICIPIOS_PASO_MAX} grados"
+        )
+    paso = cuantizar_paso(paso)
+    modelo = modelo_activo()
+    
+    try:
+        return cache_municipios.obtener(
+            modelo.version, mes, paso,
+            lambda: riesgo_municipios(modelo, mes, paso)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/tiles/{z}/{x}/{y}")
+def get_tile(z: int, x: int, y: int, mes: int, clase: str, formato: str = 'png'):
+    """Tile XYZ con la probabilidad de una clase (PNG coloreado o .npy float32)"""
+    if not 0 <= z <= TILES_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile fuera de rango")
+    if not 1 <= mes <= 12:
+        raise HTTPException(status_code=422, detail="mes debe estar entre 1 y 12")
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=422, detail=f"formato debe ser uno de {sorted(FORMATOS)}")
+    modelo = modelo_activo()
+    clases = list(modelo.label_encoder.classes_)
+    if clase not in clases:
+        raise HTTPException(status_code=422, detail=f"clase debe ser una de {clases}")
+    
+    try:
+        contenido = cache_tiles.obtener(
+            (modelo.version, mes, clase, z, x, y, formato),
+            lambda: codificar_tile(
+                calcular_tile(
+                    lambda lat, lon, m: probabilidades_puntos(modelo, lat, lon, m),
+                    lambda lat, lon: puntos_con_zona_conocida(modelo, lat, lon),
+                    z, x, y, mes, clases.index(clase)
+                ),
+                formato
+            )
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    return Response(
+        content=contenido,
+        media_type=FORMATOS[formato],
+        headers={"X-Model-Version": modelo.version, "Cache-Control": "public, max-age=3600"}
+    )
+
+@app.get("/metrics")
+def get_metrics(formato: str = 'prometheus'):
+    """
+    Métricas en formato de texto de Prometheus: latencia por ruta, requests en
+    curso, etapas de /predict, modelo activo, agrupador y caches.
+    Con formato=json devuelve solo las estadísticas del agrupador y las caches.
+    """
+    estadisticas = {
+        "coalescer": {"activo": coalescer is not None, **(coalescer.estadisticas() if coalescer else {})},
+        "predicciones": cache_predicciones.estadisticas(),
+        "tiles": cache_tiles.estadisticas()
+    }
+    if formato == 'json':
+        return estadisticas
+    if formato != 'prometheus':
+        raise HTTPException(status_code=422, detail="formato debe ser prometheus o json")
+    
+    modelo = registry.activo
+    modelo_info.reemplazar({(modelo.version, modelo.tipo): 1.0} if modelo else {})
+    extra = []
+    for seccion, valores in estadisticas.items():
+        extra += gauges_de_estadisticas(f'ecoguard_{seccion}', valores, f'Estadística de {seccion}')
+    return Response(content=metricas.exponer(extra), media_type=CONTENT_TYPE)
+
+@app.post("/models/reload")
+def reload_model(forzar: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """Carga, calienta y activa la versión en models/ sin reiniciar el servicio"""
+    if MODEL_ADMIN_TOKEN and x_admin_token != MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+    
+    resultado = registry.recargar(forzar=forzar)
+    if resultado["status"] == "error":
+        raise HTTPException(status_code=500, detail=resultado)
+    return resultado
+
+# Carga inicial y vigilancia de models/ para recarga en caliente
+if registry.recargar()["status"] == "recargado":
+    _metadata = registry.activo.metadata
+    print("✅ Modelo OPTIMIZADO cargado exitosamente")
+    print(f"   - Features: {len(_metadata['feature_columns'])}")
+    print(f"   - Clases: {_metadata['n_classes']} - {_metadata['classes']}")
+    print(f"   - Accuracy test: {_metadata['test_score']:.2%}")
+    print(f"   - Accuracy CV: {_metadata['cv_score_mean']:.2%}")
+registry.iniciar_vigilancia(MODEL_WATCH_INTERVAL)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
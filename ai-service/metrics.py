@@ -0,0 +1,238 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores, gauges e histogramas con labels, un middleware ASGI que mide la
+latencia de cada request por ruta (la plantilla, p.ej. /tiles/{z}/{x}/{y},
+no la URL) y los requests en curso, y un cronómetro por etapas para ver en
+qué se van los milisegundos de /predict.
+
+Cada observación es una búsqueda binaria y una suma bajo un lock, así el
+costo por request es de pocos microsegundos.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Buckets de latencia en segundos (de 50 µs a 10 s)
+BUCKETS_LATENCIA = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = '') -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor: float) -> str:
+    if math.isinf(valor):
+        return '+Inf' if valor > 0 else '-Inf'
+    return repr(float(valor))
+
+
+class _Metrica:
+    tipo = 'untyped'
+
+    def __init__(self, nombre: str, ayuda: str, labels: Iterable[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _clave(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labels)
+
+    def lineas(self) -> List[str]:
+        return [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def __init__(self, nombre: str, ayuda: str, labels: Iterable[str] = ()):
+        super().__init__(nombre, ayuda, labels)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, cantidad: float = 1.0, **labels):
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0.0) + cantidad
+
+    def lineas(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        return super().lineas() + [
+            f'{self.nombre}{_labels(self.labels, clave)} {_numero(v)}' for clave, v in valores
+        ]
+
+
+class Gauge(Contador):
+    tipo = 'gauge'
+
+    def dec(self, cantidad: float = 1.0, **labels):
+        self.inc(-cantidad, **labels)
+
+    def set(self, valor: float, **labels):
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = float(valor)
+
+    def reemplazar(self, valores: Dict[Tuple[str, ...], float]):
+        """Reemplaza todas las series (p.ej. la versión activa del modelo)"""
+        with self._lock:
+            self._valores = dict(valores)
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre: str, ayuda: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Por serie: [conteo por bucket (+Inf al final), suma]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, **labels):
+        clave = self._clave(labels)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def lineas(self) -> List[str]:
+        with self._lock:
+            series = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._series.items()]
+        lineas = super().lineas()
+        for clave, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (math.inf,), conteos):
+                acumulado += conteo
+                le = _labels(self.labels, clave, f'le="{_numero(limite)}"')
+                lineas.append(f'{self.nombre}_bucket{le} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{_labels(self.labels, clave)} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{_labels(self.labels, clave)} {acumulado}')
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas del servicio y su exposición en texto."""
+
+    def __init__(self):
+        self._metricas: List[_Metrica] = []
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, labels: Iterable[str] = ()) -> Contador:
+        return self.registrar(Contador(nombre, ayuda, labels))
+
+    def gauge(self, nombre: str, ayuda: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.registrar(Gauge(nombre, ayuda, labels))
+
+    def histograma(self, nombre: str, ayuda: str, labels: Iterable[str] = (),
+                   buckets: Tuple[float, ...] = BUCKETS_LATENCIA) -> Histograma:
+        return self.registrar(Histograma(nombre, ayuda, labels, buckets))
+
+    def exponer(self, extra: Iterable[str] = ()) -> str:
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.lineas())
+        lineas.extend(extra)
+        return '\n'.join(lineas) + '\n'
+
+
+def gauges_de_estadisticas(prefijo: str, estadisticas: dict, ayuda: str) -> List[str]:
+    """Expone como gauges los valores numéricos de un dict de estadisticas()"""
+    lineas = []
+    for clave, valor in estadisticas.items():
+        if isinstance(valor, bool):
+            valor = int(valor)
+        if not isinstance(valor, (int, float)):
+            continue
+        nombre = f'{prefijo}_{clave}'
+        lineas += [f'# HELP {nombre} {ayuda}: {clave}', f'# TYPE {nombre} gauge', f'{nombre} {_numero(valor)}']
+    return lineas
+
+
+class Etapas:
+    """
+    Cronómetro de etapas secuenciales de un request (sin histograma no mide).
+
+        etapas = Etapas(histograma, version=modelo.version)
+        with etapas.medir('features'):
+            ...
+    """
+
+    __slots__ = ('histograma', 'labels', '_nombre', '_inicio')
+
+    def __init__(self, histograma: Optional[Histograma], **labels):
+        self.histograma = histograma
+        self.labels = labels
+        self._nombre = None
+        self._inicio = 0.0
+
+    def medir(self, nombre: str) -> 'Etapas':
+        self._nombre = nombre
+        return self
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.histograma is not None:
+            self.histograma.observar(time.perf_counter() - self._inicio, etapa=self._nombre, **self.labels)
+        return False
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI: latencia por ruta, método, estado y versión del modelo, y requests en curso."""
+
+    def __init__(self, app, latencia: Histograma, en_curso: Gauge, version: Callable[[], str]):
+        self.app = app
+        self.latencia = latencia
+        self.en_curso = en_curso
+        self.version = version
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        estado = {'codigo': 500}
+
+        async def enviar(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                estado['codigo'] = mensaje['status']
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        self.en_curso.inc()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            self.en_curso.dec()
+            # El router deja la ruta encontrada en el scope; sin ruta (404) se
+            # agrupa para no crear una serie por URL
+            ruta = getattr(scope.get('route'), 'path', None) or 'sin_ruta'
+            self.latencia.observar(
+                time.perf_counter() - inicio,
+                ruta=ruta, metodo=scope['method'], estado=str(estado['codigo']), version=self.version()
+            )
@@ -0,0 +1,261 @@
+"""
+Bundle de modelo en un solo archivo, mapeable en memoria.
+
+Formato (versión 1):
+    [cabecera]  magic b'ECOGBNDL' | versión uint32 | largo del manifiesto uint64
+    [manifiesto] JSON utf-8: encoders, metadata, tabla de arrays y checksum
+    [datos]     arrays de NumPy sin comprimir, alineados a 64 bytes
+
+Los arrays se abren con np.memmap en modo lectura, así que varios workers de
+uvicorn en el mismo nodo comparten las mismas páginas físicas y el arranque no
+depende del tamaño del modelo. El checksum (SHA-256 de la sección de datos)
+identifica la versión: el registro lo lee del manifiesto para saber si el
+bundle en disco cambió (leer_checksum). Validarlo contra los datos obliga a
+leer todo el archivo, así que al cargar es opcional (MODEL_BUNDLE_VERIFICAR).
+
+El manifiesto puede referenciar el pickle de scikit-learn del que salió
+(archivo y SHA-256): el servicio lo carga recién cuando llega un lote grande,
+donde scikit-learn es más rápido que el motor compilado.
+
+Convertir artefactos existentes (desde la raíz del repo):
+    python ai-service/model_bundle.py
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+BUNDLE_PATH = 'ai-service/models/model_riesgo.bundle'
+
+MAGIC = b'ECOGBNDL'
+# Checksum de un archivo que no se pudo leer como bundle (ver leer_checksum)
+BUNDLE_INVALIDO = 'invalido'
+FORMATO_VERSION = 1
+CABECERA = struct.Struct('<8sIQ')
+ALINEACION = 64
+
+
+def _alinear(n: int) -> int:
+    return (n + ALINEACION - 1) // ALINEACION * ALINEACION
+
+
+class EncoderEtiquetas:
+    """
+    Sustituto liviano de sklearn.preprocessing.LabelEncoder ya entrenado.
+
+    Solo implementa lo que usa el servicio (classes_, transform e
+    inverse_transform) a partir de la lista de clases guardada en el
+    manifiesto.
+    """
+
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes)
+
+    def transform(self, y) -> np.ndarray:
+        y = np.asarray(y)
+        idx = np.searchsorted(self.classes_, y)
+        idx_seguro = np.minimum(idx, len(self.classes_) - 1)
+        desconocidas = self.classes_[idx_seguro] != y
+        if np.any(desconocidas):
+            nuevas = ', '.join(repr(str(v)) for v in np.unique(y[desconocidas]))
+            raise ValueError(f"y contains previously unseen labels: {nuevas}")
+        return idx
+
+    def inverse_transform(self, y) -> np.ndarray:
+        return self.classes_[np.asarray(y, dtype=np.int64)]
+
+
+def _sha256_archivo(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def guardar_bundle(arrays: Dict[str, np.ndarray], clases: list, zonas: list,
+                   metadata: dict, path: str = BUNDLE_PATH, tipo: str = 'random_forest',
+                   estimador: Optional[str] = None) -> str:
+    """
+    Escribe el bundle.
+
+    Args:
+        arrays: Arrays del modelo (p.ej. salida de forest_engine.exportar_modelo)
+        clases: Clases del label encoder del target
+        zonas: Clases del encoder de zonas geográficas
+        metadata: Metadata del entrenamiento (serializable a JSON)
+        path: Ruta del archivo de salida
+        tipo: Tipo de modelo contenido en los arrays (random_forest o hist_gradient_boosting)
+        estimador: Pickle de scikit-learn equivalente (junto al bundle) para lotes grandes
+
+    Returns:
+        Checksum SHA-256 de la sección de datos
+    """
+    tabla = {}
+    offset = 0
+    for nombre, arr in arrays.items():
+        arr = np.asarray(arr)
+        tabla[nombre] = {
+            'dtype': arr.dtype.str,
+            'shape': list(arr.shape),
+            'offset': offset,
+            'nbytes': int(arr.nbytes)
+        }
+        offset = _alinear(offset + arr.nbytes)
+
+    # Sección de datos completa en memoria para calcular el checksum antes del manifiesto
+    datos = bytearray(offset)
+    for nombre, arr in arrays.items():
+        info = tabla[nombre]
+        datos[info['offset']:info['offset'] + info['nbytes']] = np.asarray(arr).tobytes()
+    checksum = hashlib.sha256(datos).hexdigest()
+
+    manifiesto = json.dumps({
+        'formato': FORMATO_VERSION,
+        'tipo': tipo,
+        'checksum': checksum,
+        'creado': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'encoders': {
+            'label': [str(c) for c in clases],
+            'zona': [str(z) for z in zonas]
+        },
+        'metadata': metadata,
+        'estimador': (
+            {'archivo': os.path.basename(estimador), 'sha256': _sha256_archivo(estimador)}
+            if estimador else None
+        ),
+        'arrays': tabla
+    }, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, 'item') else str(o)).encode('utf-8')
+
+    # Escritura atómica: los workers que tienen mapeado el bundle anterior
+    # conservan el inodo viejo y nunca ven un archivo a medio escribir
+    inicio_datos = _alinear(CABECERA.size + len(manifiesto))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(CABECERA.pack(MAGIC, FORMATO_VERSION, len(manifiesto)))
+        f.write(manifiesto)
+        f.write(b'\0' * (inicio_datos - CABECERA.size - len(manifiesto)))
+        f.write(datos)
+    os.replace(tmp_path, path)
+
+    return checksum
+
+
+def leer_manifiesto(path: str = BUNDLE_PATH) -> dict:
+    """Lee solo la cabecera y el manifiesto (sin tocar los arrays)."""
+    with open(path, 'rb') as f:
+        magic, version, largo = CABECERA.unpack(f.read(CABECERA.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} no es un bundle de EcoGuard")
+        if version != FORMATO_VERSION:
+            raise ValueError(f"Versión de bundle no soportada: {version} (esperada {FORMATO_VERSION})")
+        manifiesto = json.loads(f.read(largo).decode('utf-8'))
+    manifiesto['_inicio_datos'] = _alinear(CABECERA.size + largo)
+    return manifiesto
+
+
+def leer_checksum(path: str = BUNDLE_PATH) -> str:
+    """
+    Checksum del bundle en disco según su manifiesto (sin leer los arrays),
+    o BUNDLE_INVALIDO si el archivo no se puede leer como bundle.
+    """
+    try:
+        return leer_manifiesto(path)['checksum']
+    except (OSError, ValueError, KeyError, struct.error):
+        return BUNDLE_INVALIDO
+
+
+class ModelBundle:
+    """Bundle abierto: arrays mapeados en memoria, encoders y metadata."""
+
+    def __init__(self, path: str, manifiesto: dict, arrays: Dict[str, np.ndarray]):
+        self.path = path
+        self.manifiesto = manifiesto
+        self.arrays = arrays
+        self.tipo = manifiesto['tipo']
+        self.checksum = manifiesto['checksum']
+        self.metadata = manifiesto['metadata']
+        self.label_encoder = EncoderEtiquetas(manifiesto['encoders']['label'])
+        self.zona_encoder = EncoderEtiquetas(manifiesto['encoders']['zona'])
+        self.estimador = manifiesto.get('estimador')
+
+    @classmethod
+    def cargar(cls, path: str = BUNDLE_PATH, verificar: bool = False) -> 'ModelBundle':
+        """
+        Abre el bundle con mmap en modo lectura.
+
+        Args:
+            path: Ruta del bundle
+            verificar: Si True, valida el checksum de la sección de datos
+                       (lee el archivo completo: anula la carga perezosa del mmap)
+        """
+        manifiesto = leer_manifiesto(path)
+        inicio = manifiesto['_inicio_datos']
+
+        if verificar:
+            fin = max((a['offset'] + a['nbytes'] for a in manifiesto['arrays'].values()), default=0)
+            datos = np.memmap(path, dtype=np.uint8, mode='r', offset=inicio, shape=(_alinear(fin),)) if fin else b''
+            if hashlib.sha256(datos).hexdigest() != manifiesto['checksum']:
+                raise ValueError(f"Checksum inválido en {path}: bundle corrupto o incompleto")
+
+        arrays = {}
+        for nombre, info in manifiesto['arrays'].items():
+            # np.memmap no admite shape (): los escalares se leen como (1,) y se copian
+            arr = np.memmap(
+                path, dtype=np.dtype(info['dtype']), mode='r',
+                offset=inicio + info['offset'], shape=tuple(info['shape']) or (1,)
+            )
+            arrays[nombre] = arr if info['shape'] else np.array(arr[0])
+        return cls(path, manifiesto, arrays)
+
+    def path_estimador(self) -> Optional[str]:
+        """Pickle de scikit-learn referenciado por el manifiesto, si existe junto al bundle"""
+        if not self.estimador:
+            return None
+        path = os.path.join(os.path.dirname(self.path), self.estimador['archivo'])
+        return path if os.path.exists(path) else None
+
+    def estimador_valido(self) -> bool:
+        """True si el pickle referenciado es el mismo con el que se generó el bundle"""
+        path = self.path_estimador()
+        return path is not None and _sha256_archivo(path) == self.estimador['sha256']
+
+
+def convertir_artefactos(models_dir: str = 'ai-service/models', path: Optional[str] = None) -> str:
+    """
+    Convierte los pickles de joblib existentes (modelo, encoders y metadata)
+    en un bundle.
+
+    Returns:
+        Checksum del bundle generado
+    """
+    import joblib
+    from forest_engine import exportar_modelo
+
+    clf = joblib.load(f'{models_dir}/model_riesgo.pkl')
+    label_encoder = joblib.load(f'{models_dir}/label_encoder.pkl')
+    zona_encoder = joblib.load(f'{models_dir}/zona_encoder.pkl')
+    metadata = joblib.load(f'{models_dir}/metadata.pkl')
+
+    tipo, arrays = exportar_modelo(clf)
+    return guardar_bundle(
+        arrays,
+        label_encoder.classes_.tolist(),
+        zona_encoder.classes_.tolist(),
+        metadata,
+        path or f'{models_dir}/model_riesgo.bundle',
+        tipo,
+        estimador=f'{models_dir}/model_riesgo.pkl'
+    )
+
+
+if __name__ == "__main__":
+    print("🔄 Convirtiendo artefactos joblib a bundle...")
+    checksum = convertir_artefactos()
+    print(f"✅ Bundle: {BUNDLE_PATH} ({os.path.getsize(BUNDLE_PATH)} bytes)")
+    print(f"   - Checksum: {checksum}")
@@ -0,0 +1,312 @@
+"""
+Registro de versiones del modelo con recarga en caliente.
+
+Cada versión cargada es un ModeloActivo inmutable. Los handlers toman la
+referencia una sola vez por request, así que una recarga nunca cambia el
+modelo a mitad de una predicción: la versión nueva se carga y se calienta en
+segundo plano y luego se reemplaza la referencia de forma atómica.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+from features import verificar_especificacion
+from forest_engine import compilar
+from model_bundle import ModelBundle, leer_checksum
+from risk_lattice import MODO_POR_DEFECTO, RiskLattice, firma_archivo
+
+# Hasta este tamaño de lote el motor compilado es más rápido que scikit-learn;
+# para lotes mayores se usa el modelo de scikit-learn (en un bundle se carga
+# recién cuando hace falta, desde el pickle que referencia el manifiesto)
+COMPILED_FOREST_MAX_ROWS = int(os.getenv('COMPILED_FOREST_MAX_ROWS', '512'))
+
+# Lo mismo para HistGradientBoosting: sus árboles son más profundos y el
+# motor deja de ganar mucho antes (~64 filas medidas con benchmark_modelos)
+COMPILED_BOOSTING_MAX_ROWS = int(os.getenv('COMPILED_BOOSTING_MAX_ROWS', '64'))
+
+# Validar el checksum del bundle al cargarlo (lee el archivo completo)
+MODEL_BUNDLE_VERIFICAR = os.getenv('MODEL_BUNDLE_VERIFICAR', '0').lower() in ('1', 'true', 'yes')
+
+# Archivos que determinan la versión servida
+ARCHIVOS_MODELO = (
+    'model_riesgo.bundle',
+    'model_riesgo.pkl',
+    'label_encoder.pkl',
+    'zona_encoder.pkl',
+    'metadata.pkl',
+    'risk_lattice.npy',
+    'risk_lattice.json'
+)
+
+
+class ModeloActivo:
+    """Una versión cargada del modelo con sus encoders, metadata y malla."""
+
+    def __init__(self, version: str, firma: str, origen: str, metadata: dict,
+                 label_encoder, zona_encoder, model=None,
+                 compiled_forest=None,
+                 risk_lattice: Optional[RiskLattice] = None, tipo: str = 'random_forest',
+                 cargar_estimador: Optional[Callable[[], object]] = None):
+        self.version = version
+        self.firma = firma
+        self.origen = origen
+        self.metadata = metadata
+        self.label_encoder = label_encoder
+        # Tabla de nombres de clase (str de Python) para decodificar índices sin inverse_transform
+        self.clases = np.array(label_encoder.classes_.tolist(), dtype=object)
+        self.zona_encoder = zona_encoder
+        self.model = model
+        # Carga diferida del modelo de scikit-learn (bundle): se llama una sola vez
+        self._cargar_estimador = cargar_estimador
+        self._lock_estimador = threading.Lock()
+        # Motor compilado (bosque o boosting según el tipo del bundle)
+        self.compiled_forest = compiled_forest
+        self.risk_lattice = risk_lattice
+        self.tipo = tipo
+        self.max_filas_compilado = (
+            COMPILED_BOOSTING_MAX_ROWS if tipo == 'hist_gradient_boosting' else COMPILED_FOREST_MAX_ROWS
+        )
+        self.cargado_en = datetime.now().isoformat(timespec='seconds')
+        # mtime del artefacto principal (bundle o pickle): orden entre versiones
+        self.creado = 0.0
+        self.segundos_carga = 0.0
+
+    def estimador(self):
+        """Modelo de scikit-learn, cargándolo la primera vez si viene de un bundle (o None)"""
+        if self.model is None and self._cargar_estimador is not None:
+            with self._lock_estimador:
+                if self._cargar_estimador is not None:
+                    cargar, self._cargar_estimador = self._cargar_estimador, None
+                    try:
+                        self.model = cargar()
+                    except Exception as e:
+                        print(f"⚠️ Error cargando el modelo de scikit-learn: {e}")
+        return self.model
+
+    def predict_proba(self, features) -> np.ndarray:
+        """Evalúa con el motor compilado o con scikit-learn según el tamaño del lote"""
+        if self.compiled_forest is not None and len(features) <= self.max_filas_compilado:
+            return self.compiled_forest.predict_proba(features)
+        model = self.estimador()
+        if model is None:
+            return self.compiled_forest.predict_proba(features)
+        return model.predict_proba(features)
+
+    @property
+    def identidad(self) -> tuple:
+        """Modelo + malla: dos cargas con la misma identidad sirven lo mismo"""
+        malla = self.risk_lattice.meta.get('creado') if self.risk_lattice is not None else None
+        return (self.firma, malla)
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "origen": self.origen,
+            "tipo": self.tipo,
+            "cargado_en": self.cargado_en,
+            "segundos_carga": round(self.segundos_carga, 3),
+            "compiled_forest": self.compiled_forest is not None,
+            "sklearn": self.model is not None,
+            "risk_lattice": self.risk_lattice is not None
+        }
+
+
+def estimador_del_bundle(bundle: ModelBundle) -> Optional[Callable[[], object]]:
+    """
+    Cargador diferido del pickle de scikit-learn que referencia el bundle
+    (None si no hay referencia o el archivo no existe). Al cargarlo se
+    verifica que sea el mismo con el que se generó el bundle.
+    """
+    path = bundle.path_estimador()
+    if path is None:
+        return None
+
+    def cargar():
+        if not bundle.estimador_valido():
+            print(f"⚠️ {path} no corresponde al bundle: los lotes grandes siguen en el motor compilado")
+            return None
+        import joblib
+        return joblib.load(path)
+
+    return cargar
+
+
+def cargar_modelo(models_dir: str = 'models') -> ModeloActivo:
+    """
+    Carga la versión presente en models_dir: primero el bundle mapeado en
+    memoria (python ai-service/model_bundle.py convierte los pickles
+    existentes); si no existe, los pickles de joblib.
+    """
+    bundle_path = os.path.join(models_dir, 'model_riesgo.bundle')
+
+    if os.path.exists(bundle_path):
+        bundle = ModelBundle.cargar(bundle_path, verificar=MODEL_BUNDLE_VERIFICAR)
+        modelo = ModeloActivo(
+            version=bundle.checksum[:12],
+            firma=bundle.checksum,
+            origen='bundle',
+            metadata=bundle.metadata,
+            label_encoder=bundle.label_encoder,
+            zona_encoder=bundle.zona_encoder,
+            compiled_forest=compilar(bundle.tipo, bundle.arrays),
+            tipo=bundle.tipo,
+            cargar_estimador=estimador_del_bundle(bundle)
+        )
+    else:
+        import joblib
+        model_path = os.path.join(models_dir, 'model_riesgo.pkl')
+        firma = firma_archivo(model_path)
+        model = joblib.load(model_path)
+        modelo = ModeloActivo(
+            version=firma[:12],
+            firma=firma,
+            origen='joblib',
+            metadata=joblib.load(os.path.join(models_dir, 'metadata.pkl')),
+            label_encoder=joblib.load(os.path.join(models_dir, 'label_encoder.pkl')),
+            zona_encoder=joblib.load(os.path.join(models_dir, 'zona_encoder.pkl')),
+            model=model,
+            tipo='hist_gradient_boosting' if hasattr(model, '_predictors') else 'random_forest'
+        )
+
+    modelo.creado = os.path.getmtime(bundle_path if modelo.origen == 'bundle' else model_path)
+
+    # Artefactos con otra versión de features no se pueden servir
+    verificar_especificacion(modelo.metadata)
+
+    # Malla precalculada (opcional, se genera con: python risk_lattice.py)
+    try:
+        modelo.risk_lattice = RiskLattice.cargar(
+            modelo.firma,
+            modo=os.getenv('RISK_LATTICE_MODE', MODO_POR_DEFECTO),
+            path=os.path.join(models_dir, 'risk_lattice.npy'),
+            meta_path=os.path.join(models_dir, 'risk_lattice.json')
+        )
+    except Exception as e:
+        print(f"⚠️ Error cargando malla de riesgo: {e}")
+
+    return modelo
+
+
+class ModelRegistry:
+    """
+    Mantiene la versión activa y la reemplaza sin cortar el servicio.
+
+    Args:
+        models_dir: Directorio de artefactos
+        calentar: Función que recibe un ModeloActivo y lo ejercita con un lote
+                  de prueba antes de activarlo (falla -> no se activa)
+        al_activar: Función que recibe la versión recién activada (en segundo
+                    plano; p.ej. borrar caches de versiones anteriores)
+    """
+
+    def __init__(self, models_dir: str = 'models',
+                 calentar: Optional[Callable[[ModeloActivo], None]] = None,
+                 al_activar: Optional[Callable[[ModeloActivo], None]] = None):
+        self.models_dir = models_dir
+        self.calentar = calentar
+        self.al_activar = al_activar
+        self.activo: Optional[ModeloActivo] = None
+        self.ultimo_error: Optional[str] = None
+        self.recargas = 0
+        self._lock = threading.Lock()
+        self._huella = self._huella_archivos()
+        self._vigilante: Optional[threading.Thread] = None
+
+    def _huella_archivos(self) -> tuple:
+        """
+        Checksum del bundle (solo cabecera y manifiesto) y (mtime, tamaño) del
+        resto de los artefactos; cambia cuando se reentrena. Un bundle copiado
+        con el mismo contenido no cambia la huella, y uno reemplazado con la
+        misma fecha y tamaño sí.
+        """
+        huella = []
+        for nombre in ARCHIVOS_MODELO:
+            if nombre == 'model_riesgo.bundle':
+                path = os.path.join(self.models_dir, nombre)
+                if os.path.exists(path):
+                    huella.append((nombre, leer_checksum(path)))
+                continue
+            try:
+                st = os.stat(os.path.join(self.models_dir, nombre))
+                huella.append((nombre, st.st_mtime_ns, st.st_size))
+            except OSError:
+                continue
+        return tuple(huella)
+
+    def recargar(self, forzar: bool = False) -> dict:
+        """
+        Carga, calienta y activa la versión en disco.
+
+        Si la carga o el calentamiento fallan, la versión activa se mantiene.
+        Solo una recarga corre a la vez.
+
+        Returns:
+            Diccionario con el resultado de la recarga
+        """
+        with self._lock:
+            self._huella = self._huella_archivos()
+            inicio = time.perf_counter()
+            try:
+                nuevo = cargar_modelo(self.models_dir)
+                if not forzar and self.activo is not None and nuevo.identidad == self.activo.identidad:
+                    return {"status": "sin_cambios", "version": self.activo.version}
+                if self.calentar is not None:
+                    self.calentar(nuevo)
+            except Exception as e:
+                self.ultimo_error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Error cargando modelo: {e}")
+                return {
+                    "status": "error",
+                    "error": self.ultimo_error,
+                    "version": self.activo.version if self.activo else None
+                }
+
+            nuevo.segundos_carga = time.perf_counter() - inicio
+            anterior = self.activo
+            # Reemplazo atómico: los requests en curso conservan su referencia
+            self.activo = nuevo
+            self.ultimo_error = None
+            self.recargas += 1
+
+        # El modelo de scikit-learn de un bundle se carga en segundo plano para
+        # que el primer lote grande no pague la carga
+        threading.Thread(target=nuevo.estimador, name='model-sklearn', daemon=True).start()
+        if self.al_activar is not None:
+            threading.Thread(target=self.al_activar, args=(nuevo,), name='model-activado', daemon=True).start()
+
+        print(f"✅ Modelo {nuevo.version} activo ({nuevo.origen}, {nuevo.segundos_carga:.2f}s)")
+        return {
+            "status": "recargado",
+            "version": nuevo.version,
+            "version_anterior": anterior.version if anterior else None
+        }
+
+    def iniciar_vigilancia(self, intervalo: float):
+        """
+        Revisa periódicamente models_dir y recarga cuando los artefactos
+        cambian y se mantienen estables durante un intervalo completo (evita
+        cargar un reentrenamiento a medio escribir).
+        """
+        if intervalo <= 0 or self._vigilante is not None:
+            return
+
+        def vigilar():
+            pendiente = None
+            while True:
+                time.sleep(intervalo)
+                huella = self._huella_archivos()
+                if huella == self._huella:
+                    pendiente = None
+                elif huella == pendiente:
+                    self.recargar()
+                    pendiente = None
+                else:
+                    pendiente = huella
+
+        self._vigilante = threading.Thread(target=vigilar, name='model-watch', daemon=True)
+        self._vigilante.start()
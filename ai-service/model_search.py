@@ -0,0 +1,329 @@
+"""
+Búsqueda de hiperparámetros del modelo de riesgo (successive halving).
+
+Se muestrean configuraciones de Random Forest y HistGradientBoosting y se
+evalúan por rondas: todas con una fracción pequeña de los datos, y solo el
+mejor 1/eta pasa a la ronda siguiente con eta veces más datos, hasta la
+última ronda con el dataset completo.
+
+Cada (configuración, fold) es una tarea de un pool de procesos. X, y, la
+permutación de muestras y la asignación de folds viven en memoria compartida,
+así los workers no reciben copias del dataset por tarea.
+
+El objetivo combina accuracy con el costo de servir el modelo (el servicio
+atiende tráfico interactivo del mapa):
+
+    objetivo = accuracy - peso_latencia * latencia_ms - peso_tamano * tamano_mb
+
+Uso (desde la raíz del repo):
+    python ai-service/train_model.py --search
+"""
+
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from threadpoolctl import threadpool_limits
+
+from evaluation import nucleos_disponibles
+from forest_engine import compilar, exportar_modelo
+
+LEADERBOARD_PATH = 'ai-service/models/search_leaderboard.json'
+
+# Configuración de partida de cada familia (sin --search)
+CONFIGURACIONES_POR_DEFECTO = {
+    'random_forest': {
+        'modelo': 'random_forest',
+        'params': {
+            'n_estimators': 200,
+            'max_depth': 12,
+            'min_samples_split': 5,
+            'min_samples_leaf': 2
+        }
+    },
+    'hist_gradient_boosting': {
+        'modelo': 'hist_gradient_boosting',
+        'params': {
+            'max_iter': 200,
+            'learning_rate': 0.1,
+            'max_leaf_nodes': 31,
+            'min_samples_leaf': 20,
+            'l2_regularization': 0.0
+        }
+    }
+}
+
+# Configuración histórica del modelo
+CONFIG_POR_DEFECTO = CONFIGURACIONES_POR_DEFECTO['random_forest']
+
+ESPACIO_BUSQUEDA = {
+    'random_forest': {
+        'n_estimators': [50, 100, 200, 300],
+        'max_depth': [6, 8, 10, 12, 16],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4, 8],
+        'max_features': ['sqrt', 0.5, None]
+    },
+    'hist_gradient_boosting': {
+        'max_iter': [50, 100, 200, 400],
+        'learning_rate': [0.03, 0.05, 0.1, 0.2],
+        'max_leaf_nodes': [15, 31, 63],
+        'min_samples_leaf': [10, 20, 50],
+        'l2_regularization': [0.0, 0.1, 1.0]
+    }
+}
+
+# Penalizaciones por defecto: 1 punto de accuracy equivale a 2 ms de
+# latencia de un punto o a 20 MB de modelo
+PESO_LATENCIA = 0.005
+PESO_TAMANO = 0.0005
+
+
+def crear_modelo(config: dict, n_jobs: int = -1, random_state: int = 42):
+    """Instancia el clasificador de una configuración {'modelo', 'params'}"""
+    if config['modelo'] == 'random_forest':
+        return RandomForestClassifier(
+            **config['params'], random_state=random_state, n_jobs=n_jobs, class_weight='balanced'
+        )
+    if config['modelo'] == 'hist_gradient_boosting':
+        # HistGradientBoosting no expone n_jobs (usa OpenMP)
+        return HistGradientBoostingClassifier(
+            **config['params'], random_state=random_state, class_weight='balanced', early_stopping=False
+        )
+    raise ValueError(f"Tipo de modelo desconocido: {config['modelo']}")
+
+
+def costo_servicio(modelo, X_muestra: np.ndarray, repeticiones: int = 20) -> tuple:
+    """
+    (latencia_ms de un punto, tamaño en MB) tal como se serviría el modelo:
+    con el motor compilado cargado desde el bundle.
+    """
+    tipo, arrays = exportar_modelo(modelo)
+    tamano = sum(np.asarray(a).nbytes for a in arrays.values())
+    predecir = compilar(tipo, arrays).predict_proba
+
+    fila = X_muestra[:1]
+    predecir(fila)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        predecir(fila)
+        tiempos.append(time.perf_counter() - inicio)
+    return 1000 * float(np.median(tiempos)), tamano / 1e6
+
+
+class DatosCompartidos:
+    """Arrays de NumPy en memoria compartida, adjuntables desde otros procesos."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self._segmentos = []
+        self.descriptor = {}
+        for nombre, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self._segmentos.append(shm)
+            self.descriptor[nombre] = (shm.name, arr.shape, arr.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for shm in self._segmentos:
+            shm.close()
+            shm.unlink()
+
+
+# Arrays del proceso worker (se adjuntan una vez en el initializer del pool)
+_DATOS: Dict[str, np.ndarray] = {}
+_SEGMENTOS: List[shared_memory.SharedMemory] = []
+
+
+def _adjuntar(descriptor: dict):
+    for nombre, (shm_name, shape, dtype) in descriptor.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _SEGMENTOS.append(shm)
+        _DATOS[nombre] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _evaluar_tarea(config: dict, n_muestras: int, fold: int) -> dict:
+    """Entrena una configuración en un fold del subconjunto de n_muestras"""
+    X, y = _DATOS['X'], _DATOS['y']
+    subconjunto = _DATOS['orden'][:n_muestras]
+    es_test = _DATOS['fold'][subconjunto] == fold
+    idx_train, idx_test = subconjunto[~es_test], subconjunto[es_test]
+
+    inicio = time.perf_counter()
+    modelo = crear_modelo(config, n_jobs=1)
+    # Un hilo por tarea también para OpenMP (HistGradientBoosting)
+    with threadpool_limits(limits=1):
+        modelo.fit(X[idx_train], y[idx_train])
+    accuracy = float((modelo.predict(X[idx_test]) == y[idx_test]).mean())
+    latencia_ms, tamano_mb = costo_servicio(modelo, X[idx_test])
+    return {
+        'accuracy': accuracy,
+        'latencia_ms': latencia_ms,
+        'tamano_mb': tamano_mb,
+        'segundos': time.perf_counter() - inicio
+    }
+
+
+def muestrear_configuraciones(n: int, rng: np.random.Generator) -> List[dict]:
+    """n configuraciones distintas, mitad de cada familia, incluidas las de partida"""
+    configuraciones = list(CONFIGURACIONES_POR_DEFECTO.values())[:n]
+    vistas = {json.dumps(c, sort_keys=True) for c in configuraciones}
+    familias = list(ESPACIO_BUSQUEDA)
+    intentos = 0
+    while len(configuraciones) < n and intentos < 100 * n:
+        intentos += 1
+        familia = familias[len(configuraciones) % len(familias)]
+        params = {
+            clave: valores[int(rng.integers(len(valores)))]
+            for clave, valores in ESPACIO_BUSQUEDA[familia].items()
+        }
+        config = {'modelo': familia, 'params': params}
+        clave = json.dumps(config, sort_keys=True)
+        if clave not in vistas:
+            vistas.add(clave)
+            configuraciones.append(config)
+    return configuraciones
+
+
+def buscar(X, y, n_candidatos: int = 24, eta: int = 3, n_folds: int = 3,
+           peso_latencia: float = PESO_LATENCIA, peso_tamano: float = PESO_TAMANO,
+           n_procesos: Optional[int] = None, random_state: int = 42,
+           leaderboard_path: Optional[str] = LEADERBOARD_PATH,
+           folds: Optional[np.ndarray] = None) -> dict:
+    """
+    Successive halving sobre configuraciones de RF y HistGradientBoosting.
+
+    Args:
+        X: Features
+        y: Target codificado
+        n_candidatos: Configuraciones de la primera ronda
+        eta: Factor de reducción entre rondas
+        n_folds: Folds de CV por evaluación (ignorado si se pasa `folds`)
+        peso_latencia: Accuracy descontada por ms de latencia de un punto
+        peso_tamano: Accuracy descontada por MB de modelo
+        n_procesos: Procesos en paralelo (default: núcleos disponibles)
+        leaderboard_path: Dónde escribir el leaderboard (None = no escribir)
+        folds: Fold de cada muestra (p.ej. espaciales); default: estratificados
+
+    Returns:
+        Resultado de la mejor configuración de la última ronda
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.int64)
+    rng = np.random.default_rng(random_state)
+
+    rondas = max(0, int(math.floor(math.log(n_candidatos, eta))))
+    configuraciones = muestrear_configuraciones(n_candidatos, rng)
+    if folds is None:
+        fold = np.empty(len(y), dtype=np.int64)
+        for k, (_, idx_test) in enumerate(
+            StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state).split(X, y)
+        ):
+            fold[idx_test] = k
+    else:
+        fold = np.ascontiguousarray(folds, dtype=np.int64)
+        n_folds = int(fold.max()) + 1
+    orden = rng.permutation(len(y))
+    n_procesos = max(1, n_procesos or nucleos_disponibles())
+
+    resultados = []
+    vivos = list(range(len(configuraciones)))
+    inicio = time.perf_counter()
+
+    with DatosCompartidos({'X': X, 'y': y, 'fold': fold, 'orden': orden}) as datos:
+        pool = (
+            ProcessPoolExecutor(max_workers=n_procesos, initializer=_adjuntar, initargs=(datos.descriptor,))
+            if n_procesos > 1 else None
+        )
+        if pool is None:
+            _adjuntar(datos.descriptor)
+
+        try:
+            for ronda in range(rondas + 1):
+                n_muestras = max(n_folds * 20, int(len(y) * eta ** (ronda - rondas)))
+                n_muestras = min(n_muestras, len(y))
+                # Solo folds con muestras de test y de entrenamiento en el subconjunto
+                # (un fold vacío daría accuracy NaN)
+                por_fold = np.bincount(fold[orden[:n_muestras]], minlength=n_folds)
+                folds_ronda = [k for k in range(n_folds) if 0 < por_fold[k] < n_muestras]
+                if not folds_ronda:
+                    raise ValueError(f"Ningún fold tiene datos de test y de entrenamiento en {n_muestras} muestras")
+                tareas = [(configuraciones[i], n_muestras, k) for i in vivos for k in folds_ronda]
+                if pool is None:
+                    salidas = [_evaluar_tarea(*t) for t in tareas]
+                else:
+                    salidas = list(pool.map(_evaluar_tarea, *zip(*tareas)))
+
+                ronda_resultados = []
+                for j, i in enumerate(vivos):
+                    resultados_fold = salidas[j * len(folds_ronda):(j + 1) * len(folds_ronda)]
+                    accuracy = np.array([f['accuracy'] for f in resultados_fold])
+                    latencia = float(np.median([f['latencia_ms'] for f in resultados_fold]))
+                    tamano = float(np.mean([f['tamano_mb'] for f in resultados_fold]))
+                    ronda_resultados.append({
+                        'id': i,
+                        'modelo': configuraciones[i]['modelo'],
+                        'params': configuraciones[i]['params'],
+                        'ronda': ronda,
+                        'muestras': n_muestras,
+                        'folds': len(folds_ronda),
+                        'accuracy': float(accuracy.mean()),
+                        'accuracy_std': float(accuracy.std()),
+                        'latencia_ms': latencia,
+                        'tamano_mb': tamano,
+                        'objetivo': float(accuracy.mean() - peso_latencia * latencia - peso_tamano * tamano),
+                        'segundos': float(sum(f['segundos'] for f in resultados_fold))
+                    })
+
+                ronda_resultados.sort(key=lambda r: r['objetivo'], reverse=True)
+                resultados.extend(ronda_resultados)
+                mejor = ronda_resultados[0]
+                print(f"   🔎 Ronda {ronda}: {len(vivos)} configuraciones con {n_muestras} muestras | "
+                      f"mejor {mejor['modelo']} objetivo {mejor['objetivo']:.4f} "
+                      f"(acc {mejor['accuracy']:.2%}, {mejor['latencia_ms']:.2f} ms, {mejor['tamano_mb']:.1f} MB)")
+
+                vivos = [r['id'] for r in ronda_resultados[:max(1, math.ceil(len(vivos) / eta))]]
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            else:
+                _DATOS.clear()
+                for shm in _SEGMENTOS:
+                    shm.close()
+                _SEGMENTOS.clear()
+
+    ganador = dict(mejor)
+    ganador['busqueda'] = {
+        'candidatos': len(configuraciones),
+        'rondas': rondas + 1,
+        'eta': eta,
+        'folds': n_folds,
+        'peso_latencia': peso_latencia,
+        'peso_tamano': peso_tamano,
+        'procesos': n_procesos,
+        'segundos': time.perf_counter() - inicio
+    }
+
+    if leaderboard_path:
+        os.makedirs(os.path.dirname(leaderboard_path) or '.', exist_ok=True)
+        # Cada configuración con su ronda más alta, ordenadas por ronda y objetivo
+        mejor_por_id = {}
+        for r in resultados:
+            mejor_por_id[r['id']] = r
+        leaderboard = sorted(mejor_por_id.values(), key=lambda r: (-r['ronda'], -r['objetivo']))
+        with open(leaderboard_path, 'w', encoding='utf-8') as f:
+            json.dump({'ganador': ganador, 'leaderboard': leaderboard}, f, indent=2, ensure_ascii=False)
+        print(f"   📄 Leaderboard: {leaderboard_path}")
+
+    return ganador
@@ -0,0 +1,176 @@
+"""
+Riesgo agregado por municipio.
+
+Cada MultiPolygon de geo.municipios se muestrea con una malla regular
+(centros de celda de ST_SquareGrid que caen dentro del polígono; los
+municipios más pequeños que una celda usan ST_PointOnSurface). Todos los
+puntos se evalúan en un solo lote y las probabilidades se agregan por
+municipio (media y máximo por clase).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from pg_copy import conectar
+
+# Tamaño de celda del muestreo en grados (0.01° ≈ 1.1 km)
+MUNICIPIOS_PASO = float(os.getenv('MUNICIPIOS_PASO', '0.01'))
+
+# Pasos permitidos: el pedido se redondea al más cercano, así la caché tiene
+# pocas claves posibles y ninguna malla es más fina que el paso por defecto
+MUNICIPIOS_PASOS = tuple(sorted({0.01, 0.02, 0.05, 0.1, MUNICIPIOS_PASO}))
+
+# Resultados (versión, mes, paso) que se conservan en memoria
+MUNICIPIOS_CACHE_MAX = int(os.getenv('MUNICIPIOS_CACHE_MAX', '64'))
+
+SQL_MUESTRAS = """
+    WITH m AS (
+        SELECT id, codigo_dane, nombre, geom FROM geo.municipios
+    ),
+    celdas AS (
+        SELECT m.id, ST_Centroid(g.geom) AS punto
+        FROM m, LATERAL ST_SquareGrid(%(paso)s, m.geom) AS g
+        WHERE ST_Intersects(m.geom, ST_Centroid(g.geom))
+    ),
+    puntos AS (
+        SELECT id, punto FROM celdas
+        UNION ALL
+        SELECT id, ST_PointOnSurface(geom) FROM m
+        WHERE id NOT IN (SELECT id FROM celdas)
+    )
+    SELECT m.codigo_dane, m.nombre, ST_Y(p.punto), ST_X(p.punto)
+    FROM puntos p JOIN m ON m.id = p.id
+    ORDER BY m.codigo_dane
+"""
+
+
+def cuantizar_paso(paso: float) -> float:
+    """Paso permitido más cercano (en escala logarítmica)"""
+    return min(MUNICIPIOS_PASOS, key=lambda p: abs(np.log(p / paso)))
+
+
+class MuestrasMunicipios:
+    """Puntos de muestreo de todos los municipios, agrupados por índice."""
+
+    def __init__(self, codigos: list, nombres: list, indice: np.ndarray,
+                 latitud: np.ndarray, longitud: np.ndarray, paso: float):
+        self.codigos = codigos
+        self.nombres = nombres
+        self.indice = indice
+        self.latitud = latitud
+        self.longitud = longitud
+        self.paso = paso
+
+
+def muestrear_municipios(paso: float = MUNICIPIOS_PASO) -> MuestrasMunicipios:
+    """Genera en PostGIS los puntos de muestreo de cada municipio."""
+    conn = conectar()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_MUESTRAS, {'paso': paso})
+            filas = cur.fetchall()
+    finally:
+        conn.close()
+
+    codigos, nombres, indice = [], [], np.empty(len(filas), dtype=np.int64)
+    for i, (codigo, nombre, _, _) in enumerate(filas):
+        if not codigos or codigos[-1] != codigo:
+            codigos.append(codigo)
+            nombres.append(nombre)
+        indice[i] = len(codigos) - 1
+
+    return MuestrasMunicipios(
+        codigos, nombres, indice,
+        np.array([f[2] for f in filas], dtype=np.float64),
+        np.array([f[3] for f in filas], dtype=np.float64),
+        paso
+    )
+
+
+def agregar_por_municipio(indice: np.ndarray, probs: np.ndarray, validos: np.ndarray,
+                          n_municipios: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Media y máximo de probabilidades por municipio.
+
+    Args:
+        indice: Municipio de cada punto
+        probs: Probabilidades (n_puntos, n_clases); las filas no válidas se ignoran
+        validos: Puntos que el modelo pudo evaluar
+        n_municipios: Total de municipios
+
+    Returns:
+        (media, maximo, puntos): media y máximo tienen NaN en municipios sin puntos válidos
+    """
+    indice, probs = indice[validos], probs[validos]
+    puntos = np.bincount(indice, minlength=n_municipios)
+    n_clases = probs.shape[1]
+
+    suma = np.zeros((n_municipios, n_clases))
+    maximo = np.full((n_municipios, n_clases), -np.inf)
+    for c in range(n_clases):
+        suma[:, c] = np.bincount(indice, weights=probs[:, c], minlength=n_municipios)
+        np.maximum.at(maximo[:, c], indice, probs[:, c])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = suma / puntos[:, None]
+    media[puntos == 0] = np.nan
+    maximo[puntos == 0] = np.nan
+    return media, maximo, puntos
+
+
+class CacheMunicipios:
+    """
+    Resultados por (versión del modelo, mes, paso).
+
+    Las muestras solo dependen de los polígonos, así que se consultan una vez
+    por paso (solo pasos de MUNICIPIOS_PASOS). La consulta a PostGIS corre
+    fuera del lock general: los requests del mismo paso esperan a la primera,
+    los demás no se bloquean. Los resultados de una versión anterior se
+    descartan al cambiar de modelo y los más viejos salen al pasar de
+    `max_resultados` (LRU).
+    """
+
+    def __init__(self, muestrear: Callable[[float], MuestrasMunicipios] = muestrear_municipios,
+                 max_resultados: int = MUNICIPIOS_CACHE_MAX):
+        self.muestrear = muestrear
+        self.max_resultados = max_resultados
+        self._muestras: Dict[float, MuestrasMunicipios] = {}
+        self._locks_paso: Dict[float, threading.Lock] = {}
+        self._resultados: 'OrderedDict[tuple, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def muestras(self, paso: float) -> MuestrasMunicipios:
+        if paso not in MUNICIPIOS_PASOS:
+            raise ValueError(f"Paso no permitido: {paso} (use {list(MUNICIPIOS_PASOS)})")
+        with self._lock:
+            if paso in self._muestras:
+                return self._muestras[paso]
+            lock_paso = self._locks_paso.setdefault(paso, threading.Lock())
+        with lock_paso:
+            muestras = self._muestras.get(paso)
+            if muestras is None:
+                muestras = self.muestrear(paso)
+                with self._lock:
+                    self._muestras[paso] = muestras
+            return muestras
+
+    def obtener(self, version: str, mes: int, paso: float, calcular: Callable[[], dict]) -> dict:
+        clave = (version, mes, paso)
+        with self._lock:
+            resultado = self._resultados.get(clave)
+            if resultado is not None:
+                self._resultados.move_to_end(clave)
+                return resultado
+        resultado = calcular()
+        with self._lock:
+            # Solo se conserva la versión vigente
+            for k in [k for k in self._resultados if k[0] != version]:
+                del self._resultados[k]
+            self._resultados[clave] = resultado
+            while len(self._resultados) > self.max_resultados:
+                self._resultados.popitem(last=False)
+        return resultado
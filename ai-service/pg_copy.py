@@ -0,0 +1,237 @@
+"""
+Lectura de PostgreSQL con COPY ... TO STDOUT (FORMAT binary).
+
+El resultado llega por bloques a través de psycopg2 (copy_expert) y cada
+bloque se decodifica directamente en columnas tipadas: los valores numéricos
+van a buffers array.array que terminan como arrays de NumPy sin copia, y el
+texto se guarda como códigos de categoría. La memoria usada es del orden de
+las columnas numéricas, no del CSV completo.
+
+La conexión usa las mismas variables DB_* que los loaders del ETL; no hace
+falta Docker en la máquina que entrena.
+"""
+
+import os
+import struct
+from array import array
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+FIRMA_COPY = b'PGCOPY\n\xff\r\n\x00'
+
+# Tipo de columna -> (formato struct big-endian, ancho en bytes, typecode de array.array)
+TIPOS_FIJOS = {
+    'float8': ('>d', 8, 'd'),
+    'float4': ('>f', 4, 'f'),
+    'int2': ('>h', 2, 'h'),
+    'int4': ('>i', 4, 'i'),
+    'int8': ('>q', 8, 'q'),
+    'date': ('>i', 4, 'i'),
+    'bool': ('>?', 1, 'b')
+}
+TIPOS = tuple(TIPOS_FIJOS) + ('text',)
+
+# Las fechas binarias son días desde 2000-01-01
+EPOCA_POSTGRES = np.datetime64('2000-01-01', 'D')
+
+_CAMPOS = struct.Struct('>h')
+_LARGO = struct.Struct('>i')
+
+
+def conectar():
+    """Conexión a PostgreSQL con las variables DB_* (etl/db_config.env o .env)"""
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl', 'db_config.env'))
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=os.getenv('DB_PORT', '5435'),
+        database=os.getenv('DB_NAME', 'ecoguard'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'postgres')
+    )
+
+
+class LectorCopyBinario:
+    """
+    Decodificador incremental del formato binario de COPY.
+
+    Se usa como archivo de destino de cursor.copy_expert: cada write() recibe
+    un bloque, se decodifican las filas completas y el resto queda pendiente
+    para el siguiente bloque.
+
+    Args:
+        tipos: Nombre de columna -> tipo (ver TIPOS), en el orden del SELECT
+        progreso: Función que recibe el número de filas leídas
+        cada_filas: Frecuencia de llamada a progreso
+    """
+
+    def __init__(self, tipos: Dict[str, str], progreso: Optional[Callable[[int], None]] = None,
+                 cada_filas: int = 50000):
+        desconocidos = {t for t in tipos.values() if t not in TIPOS}
+        if desconocidos:
+            raise ValueError(f"Tipos no soportados: {sorted(desconocidos)} (opciones: {TIPOS})")
+
+        self.nombres = list(tipos)
+        self.tipos = list(tipos.values())
+        self.progreso = progreso
+        self.cada_filas = cada_filas
+        self.filas = 0
+        self.terminado = False
+
+        self._pendiente = b''
+        self._cabecera_leida = False
+        self._valores = [array(TIPOS_FIJOS[t][2]) if t != 'text' else array('i') for t in self.tipos]
+        self._categorias = [{} if t == 'text' else None for t in self.tipos]
+        self._decodificadores = [
+            (struct.Struct(TIPOS_FIJOS[t][0]), TIPOS_FIJOS[t][1]) if t != 'text' else None
+            for t in self.tipos
+        ]
+
+    def write(self, datos) -> int:
+        self._pendiente = self._pendiente + bytes(datos) if self._pendiente else bytes(datos)
+        consumido = self._decodificar(memoryview(self._pendiente))
+        self._pendiente = self._pendiente[consumido:]
+        return len(datos)
+
+    def _leer_cabecera(self, buf: memoryview) -> int:
+        if len(buf) < 19:
+            return 0
+        if bytes(buf[:11]) != FIRMA_COPY:
+            raise ValueError("Respuesta de COPY sin la firma del formato binario")
+        extension = _LARGO.unpack_from(buf, 15)[0]
+        if len(buf) < 19 + extension:
+            return 0
+        self._cabecera_leida = True
+        return 19 + extension
+
+    def _decodificar(self, buf: memoryview) -> int:
+        pos = 0
+        if not self._cabecera_leida:
+            pos = self._leer_cabecera(buf)
+            if not self._cabecera_leida:
+                return 0
+
+        n_columnas = len(self.tipos)
+        total = len(buf)
+        while pos + 2 <= total:
+            n_campos = _CAMPOS.unpack_from(buf, pos)[0]
+            if n_campos == -1:
+                self.terminado = True
+                return total
+            if n_campos != n_columnas:
+                raise ValueError(f"La consulta devuelve {n_campos} columnas, se declararon {n_columnas}")
+
+            # Primero se valida que la fila esté completa en el bloque
+            inicio = pos
+            pos += 2
+            completa = True
+            for _ in range(n_columnas):
+                if pos + 4 > total:
+                    completa = False
+                    break
+                largo = _LARGO.unpack_from(buf, pos)[0]
+                pos += 4 + max(largo, 0)
+                if pos > total:
+                    completa = False
+                    break
+            if not completa:
+                return inicio
+
+            self._agregar_fila(buf, inicio + 2)
+
+        return pos
+
+    def _agregar_fila(self, buf: memoryview, pos: int):
+        for c in range(len(self.tipos)):
+            largo = _LARGO.unpack_from(buf, pos)[0]
+            pos += 4
+            decodificador = self._decodificadores[c]
+
+            if decodificador is None:
+                if largo == -1:
+                    self._valores[c].append(-1)
+                    continue
+                texto = bytes(buf[pos:pos + largo]).decode('utf-8')
+                categorias = self._categorias[c]
+                codigo = categorias.get(texto)
+                if codigo is None:
+                    codigo = categorias[texto] = len(categorias)
+                self._valores[c].append(codigo)
+            elif largo == -1:
+                if self.tipos[c] not in ('float8', 'float4'):
+                    raise ValueError(f"NULL en la columna {self.nombres[c]} ({self.tipos[c]})")
+                self._valores[c].append(float('nan'))
+            else:
+                fmt, ancho = decodificador
+                if largo != ancho:
+                    raise ValueError(
+                        f"La columna {self.nombres[c]} llega con {largo} bytes y se declaró {self.tipos[c]} "
+                        f"({ancho} bytes); agregue un cast en la consulta (p.ej. ::float8)"
+                    )
+                self._valores[c].append(fmt.unpack_from(buf, pos)[0])
+            pos += max(largo, 0)
+
+        self.filas += 1
+        if self.progreso is not None and self.filas % self.cada_filas == 0:
+            self.progreso(self.filas)
+
+    def columnas(self) -> Dict[str, object]:
+        """
+        Columnas decodificadas: arrays de NumPy para los tipos numéricos y
+        fechas (datetime64[D]); pd.Categorical para el texto.
+        """
+        if self._pendiente:
+            raise ValueError("COPY incompleto: quedaron bytes sin decodificar")
+
+        resultado = {}
+        for nombre, tipo, valores, categorias in zip(self.nombres, self.tipos, self._valores, self._categorias):
+            arr = np.frombuffer(valores, dtype=valores.typecode) if len(valores) else np.array([], dtype=valores.typecode)
+            if tipo == 'text':
+                resultado[nombre] = pd.Categorical.from_codes(arr, list(categorias))
+            elif tipo == 'date':
+                resultado[nombre] = EPOCA_POSTGRES + arr.astype('timedelta64[D]')
+            elif tipo == 'bool':
+                resultado[nombre] = arr.astype(bool)
+            else:
+                resultado[nombre] = arr
+        return resultado
+
+
+def leer_copy(consulta: str, tipos: Dict[str, str], conn=None,
+              progreso: Optional[Callable[[int], None]] = None, cada_filas: int = 50000,
+              tamano_bloque: int = 1 << 16) -> pd.DataFrame:
+    """
+    Ejecuta un SELECT con COPY binario y lo devuelve como DataFrame tipado.
+
+    Args:
+        consulta: SELECT cuyas columnas coinciden en orden y tipo con `tipos`
+                  (NUMERIC debe convertirse, p.ej. latitud::float8)
+        tipos: Nombre de columna -> tipo de PostgreSQL (ver TIPOS)
+        conn: Conexión psycopg2; si es None se abre una con las variables DB_*
+        progreso: Función que recibe el número de filas leídas
+        cada_filas: Frecuencia de llamada a progreso
+        tamano_bloque: Bytes por lectura de copy_expert
+
+    Returns:
+        DataFrame con una columna por entrada de `tipos`
+    """
+    lector = LectorCopyBinario(tipos, progreso, cada_filas)
+    propia = conn is None
+    conn = conectar() if propia else conn
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT binary)", lector, size=tamano_bloque)
+    finally:
+        if propia:
+            conn.close()
+
+    if not lector.terminado:
+        raise ValueError("COPY incompleto: no se recibió el final del flujo binario")
+    if progreso is not None and lector.filas % cada_filas:
+        progreso(lector.filas)
+    return pd.DataFrame(lector.columnas(), copy=False)
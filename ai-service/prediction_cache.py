@@ -0,0 +1,122 @@
+"""
+Cache LRU de respuestas de /predict.
+
+El frontend repite los mismos puntos (centroides de municipio) para el mismo
+mes, así que la respuesta completa se guarda por (versión del modelo,
+latitud y longitud redondeadas, mes). La cache tiene un tope en bytes (tamaño
+aproximado de cada respuesta serializada), un TTL por entrada, y se vacía
+sola la primera vez que se consulta con otra versión del modelo. El k del
+top-k forma parte de la clave porque cambia la respuesta.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Tope de memoria en MB (0 = desactivada), TTL en segundos y decimales de
+# redondeo de las coordenadas (4 decimales ≈ 11 m)
+PREDICT_CACHE_MB = float(os.getenv('PREDICT_CACHE_MB', '32'))
+PREDICT_CACHE_TTL = float(os.getenv('PREDICT_CACHE_TTL', '3600'))
+PREDICT_CACHE_DECIMALES = int(os.getenv('PREDICT_CACHE_DECIMALES', '4'))
+
+# Bytes por entrada además de la respuesta (clave, nodo del OrderedDict, tupla)
+OVERHEAD_ENTRADA = 256
+
+
+class PredictionCache:
+    """LRU con TTL y tope en bytes, invalidada al cambiar la versión del modelo."""
+
+    def __init__(self, max_bytes: int = int(PREDICT_CACHE_MB * 1024 * 1024),
+                 ttl: float = PREDICT_CACHE_TTL, decimales: int = PREDICT_CACHE_DECIMALES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.decimales = decimales
+        self._entradas: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.expirados = 0
+        self.invalidaciones = 0
+
+    @property
+    def activa(self) -> bool:
+        return self.max_bytes > 0
+
+    def _clave(self, latitud: float, longitud: float, mes: int, k: int) -> tuple:
+        return round(latitud, self.decimales), round(longitud, self.decimales), mes, k
+
+    def _verificar_version(self, version: str):
+        # Llamar con el lock tomado
+        if version != self._version:
+            if self._entradas:
+                self.invalidaciones += 1
+            self._entradas.clear()
+            self.bytes = 0
+            self._version = version
+
+    def obtener(self, version: str, latitud: float, longitud: float, mes: int, k: int) -> Optional[dict]:
+        """Respuesta guardada para el punto, o None"""
+        if not self.activa:
+            return None
+        clave = self._clave(latitud, longitud, mes, k)
+        with self._lock:
+            self._verificar_version(version)
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            valor, tamano, expira = entrada
+            if time.monotonic() >= expira:
+                del self._entradas[clave]
+                self.bytes -= tamano
+                self.expirados += 1
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, version: str, latitud: float, longitud: float, mes: int, k: int, valor: dict):
+        """Guarda una respuesta; se ignora si la versión ya no es la vigente"""
+        if not self.activa:
+            return
+        tamano = len(json.dumps(valor, default=str)) + OVERHEAD_ENTRADA
+        if tamano > self.max_bytes:
+            return
+        clave = self._clave(latitud, longitud, mes, k)
+        with self._lock:
+            if self._version is not None and version != self._version:
+                return
+            self._version = version
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= anterior[1]
+            self._entradas[clave] = (valor, tamano, time.monotonic() + self.ttl)
+            self.bytes += tamano
+            while self.bytes > self.max_bytes:
+                _, (_, tamano_viejo, _) = self._entradas.popitem(last=False)
+                self.bytes -= tamano_viejo
+                self.desalojos += 1
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "activa": self.activa,
+            "version": self._version,
+            "entradas": len(self._entradas),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "desalojos": self.desalojos,
+            "expirados": self.expirados,
+            "invalidaciones": self.invalidaciones
+        }
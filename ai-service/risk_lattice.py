@@ -0,0 +1,230 @@
+"""
+Malla precalculada de riesgo para Nariño.
+
+El modelo solo depende de (latitud, longitud, mes), así que todas las
+respuestas dentro del bbox de Nariño se pueden calcular una vez. Este módulo
+evalúa el modelo sobre una malla regular para los 12 meses y guarda las
+probabilidades por clase en un .npy que el servicio abre con mmap_mode='r'.
+
+Uso (desde ai-service/):
+    python risk_lattice.py --paso 0.005
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# Bbox de Nariño (mismo rango que valida el ETL)
+LON_MIN, LON_MAX = -79.5, -76.5
+LAT_MIN, LAT_MAX = 0.5, 2.5
+
+MALLA_PATH = 'models/risk_lattice.npy'
+MALLA_META_PATH = 'models/risk_lattice.json'
+
+# Modos de consulta:
+#   exacto   -> solo puntos que caen sobre un nodo; el resto va al modelo (default)
+#   cercano  -> nodo más cercano (aproximado, opcional)
+#   bilineal -> interpolación bilineal entre los 4 nodos vecinos (aproximado, opcional)
+MODOS = ('exacto', 'cercano', 'bilineal')
+MODO_POR_DEFECTO = 'exacto'
+
+
+def firma_archivo(path: str) -> str:
+    """SHA-256 de un archivo, para detectar mallas desactualizadas."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def construir_malla(
+    puntuar: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+    puntos_validos: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    n_clases: int,
+    paso: float = 0.005,
+    dtype=np.float32,
+    filas_por_lote: int = 50
+) -> np.ndarray:
+    """
+    Evalúa el modelo sobre la malla completa.
+
+    Args:
+        puntuar: función (lat, lon, mes) -> probabilidades (n, n_clases)
+        puntos_validos: función (lat, lon) -> máscara de puntos que el modelo
+                        puede evaluar (p.ej. zonas conocidas por el encoder)
+        n_clases: número de clases del modelo
+        paso: resolución de la malla en grados
+        dtype: tipo de las probabilidades almacenadas
+        filas_por_lote: filas de latitud evaluadas por llamada al modelo
+
+    Returns:
+        Array (12, n_lat, n_lon, n_clases); NaN donde el modelo no aplica
+    """
+    lats = LAT_MIN + paso * np.arange(int(round((LAT_MAX - LAT_MIN) / paso)) + 1)
+    lons = LON_MIN + paso * np.arange(int(round((LON_MAX - LON_MIN) / paso)) + 1)
+    malla = np.full((12, len(lats), len(lons), n_clases), np.nan, dtype=dtype)
+
+    for mes in range(1, 13):
+        for inicio in range(0, len(lats), filas_por_lote):
+            bloque_lat = lats[inicio:inicio + filas_por_lote]
+            lat_g, lon_g = np.meshgrid(bloque_lat, lons, indexing='ij')
+            lat_f, lon_f = lat_g.ravel(), lon_g.ravel()
+
+            validos = puntos_validos(lat_f, lon_f)
+            if not validos.any():
+                continue
+
+            probs = np.full((len(lat_f), n_clases), np.nan)
+            probs[validos] = puntuar(
+                lat_f[validos], lon_f[validos],
+                np.full(int(validos.sum()), mes)
+            )
+            malla[mes - 1, inicio:inicio + len(bloque_lat)] = probs.reshape(
+                len(bloque_lat), len(lons), n_clases
+            )
+        print(f"   📅 Mes {mes:2d}/12 listo")
+
+    return malla
+
+
+def guardar_malla(malla: np.ndarray, paso: float, classes: list, modelo_sha256: str,
+                  path: str = MALLA_PATH, meta_path: str = MALLA_META_PATH):
+    """Guarda la malla sin comprimir (apta para mmap) y su manifiesto JSON."""
+    np.save(path, malla)
+    meta = {
+        'paso': paso,
+        'lon_min': LON_MIN,
+        'lat_min': LAT_MIN,
+        'shape': list(malla.shape),
+        'dtype': str(malla.dtype),
+        'classes': list(classes),
+        'modelo_sha256': modelo_sha256,
+        'creado': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+class RiskLattice:
+    """
+    Consulta O(1) sobre la malla precalculada.
+
+    Las consultas devuelven las probabilidades y una máscara con los puntos
+    resueltos; los que quedan fuera (fuera del bbox, celdas sin valor o fuera
+    de nodo en modo 'exacto') deben evaluarse con el modelo.
+    """
+
+    def __init__(self, malla: np.ndarray, meta: dict, modo: str = MODO_POR_DEFECTO):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de malla inválido: {modo} (opciones: {MODOS})")
+        self.malla = malla
+        self.meta = meta
+        self.modo = modo
+        self.paso = float(meta['paso'])
+        self.lat_min = float(meta['lat_min'])
+        self.lon_min = float(meta['lon_min'])
+        self.n_lat = malla.shape[1]
+        self.n_lon = malla.shape[2]
+
+    @classmethod
+    def cargar(cls, modelo_firma: str, modo: str = MODO_POR_DEFECTO,
+               path: str = MALLA_PATH, meta_path: str = MALLA_META_PATH) -> Optional['RiskLattice']:
+        """
+        Abre la malla en modo mmap. Devuelve None si no existe o si fue
+        calculada con otro modelo (modelo_firma: checksum del bundle o
+        SHA-256 del pickle).
+        """
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+
+        if meta.get('modelo_sha256') != modelo_firma:
+            print("⚠️ Malla de riesgo desactualizada respecto al modelo, se ignora")
+            return None
+
+        return cls(np.load(path, mmap_mode='r'), meta, modo)
+
+    def consultar(self, latitud, longitud, mes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca probabilidades para arrays de puntos.
+
+        Returns:
+            (probs, resueltos): probs tiene NaN en las filas no resueltas
+        """
+        latitud = np.asarray(latitud, dtype=np.float64)
+        longitud = np.asarray(longitud, dtype=np.float64)
+        m = np.asarray(mes, dtype=np.int64) - 1
+
+        fi = (latitud - self.lat_min) / self.paso
+        fj = (longitud - self.lon_min) / self.paso
+        dentro = (
+            (fi >= 0) & (fi <= self.n_lat - 1) &
+            (fj >= 0) & (fj <= self.n_lon - 1) &
+            (m >= 0) & (m < 12)
+        )
+        probs = np.full((len(latitud), self.malla.shape[3]), np.nan)
+        if not dentro.any():
+            return probs, dentro
+
+        fi, fj, m = fi[dentro], fj[dentro], m[dentro]
+
+        if self.modo == 'bilineal':
+            i0 = np.minimum(np.floor(fi).astype(np.int64), self.n_lat - 2)
+            j0 = np.minimum(np.floor(fj).astype(np.int64), self.n_lon - 2)
+            di = (fi - i0)[:, None]
+            dj = (fj - j0)[:, None]
+            valores = (
+                self.malla[m, i0, j0] * (1 - di) * (1 - dj) +
+                self.malla[m, i0 + 1, j0] * di * (1 - dj) +
+                self.malla[m, i0, j0 + 1] * (1 - di) * dj +
+                self.malla[m, i0 + 1, j0 + 1] * di * dj
+            )
+        else:
+            i = np.rint(fi).astype(np.int64)
+            j = np.rint(fj).astype(np.int64)
+            valores = self.malla[m, i, j].astype(np.float64)
+            if self.modo == 'exacto':
+                # Tolerancia de redondeo decimal en las coordenadas del cliente
+                sobre_nodo = (np.abs(fi - i) < 1e-6) & (np.abs(fj - j) < 1e-6)
+                valores[~sobre_nodo] = np.nan
+
+        probs[dentro] = valores
+        resueltos = ~np.isnan(probs).any(axis=1)
+        return probs, resueltos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula la malla de riesgo de Nariño")
+    parser.add_argument('--paso', type=float, default=0.005, help="Resolución en grados (default: 0.005)")
+    parser.add_argument('--float16', action='store_true',
+                        help="Guardar en float16 (mitad de tamaño, ~3 decimales de precisión) en lugar de float32")
+    args = parser.parse_args()
+
+    from functools import partial
+
+    import main
+
+    modelo = main.registry.activo
+    if modelo is None:
+        raise SystemExit("❌ Modelo no disponible")
+
+    print(f"🔄 Construyendo malla de riesgo (paso {args.paso}°)...")
+    inicio = time.time()
+    malla = construir_malla(
+        partial(main.puntuar_puntos, modelo),
+        partial(main.puntos_con_zona_conocida, modelo),
+        modelo.metadata['n_classes'],
+        paso=args.paso,
+        dtype=np.float16 if args.float16 else np.float32
+    )
+    guardar_malla(malla, args.paso, modelo.metadata['classes'], modelo.firma)
+    print(f"✅ Malla {malla.shape} guardada en {MALLA_PATH} "
+          f"({malla.nbytes / 1e6:.1f} MB, {time.time() - inicio:.1f}s)")
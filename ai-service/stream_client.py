@@ -0,0 +1,157 @@
+"""
+Cliente de POST /predict/stream para archivos CSV grandes.
+
+Envía el CSV (con cabecera latitud,longitud,mes y opcionalmente id) por
+chunks sin cargarlo en memoria y recorre la respuesta NDJSON línea por línea
+mientras el envío sigue en curso: un hilo escribe el cuerpo (chunked) y el
+hilo principal lee la respuesta por el mismo socket. El servicio responde
+cada bloque apenas lo evalúa y no lee más entrada hasta que el bloque se
+envió, así que un cliente que mandara todo el cuerpo antes de leer (httpx,
+requests) se bloquearía con los buffers llenos.
+
+Uso (desde la raíz del repo):
+    python ai-service/stream_client.py puntos.csv --salida predicciones.ndjson
+    python ai-service/stream_client.py puntos.csv --url http://localhost:8001 --k 5
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from typing import Iterator, Optional
+from urllib.parse import urlencode, urlsplit
+
+AI_SERVICE_URL = os.getenv('AI_SERVICE_URL', 'http://localhost:8001')
+
+# Bytes por chunk enviado
+TAMANO_CHUNK = 1 << 20
+
+
+def leer_chunks(path: str, tamano: int = TAMANO_CHUNK) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(tamano)
+            if not chunk:
+                break
+            yield chunk
+
+
+def enviar_cuerpo(sock: socket.socket, chunks: Iterator[bytes], estado: dict):
+    """Escribe el cuerpo con Transfer-Encoding chunked; los errores quedan en estado['error']"""
+    try:
+        for chunk in chunks:
+            if chunk:
+                sock.sendall(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        sock.sendall(b'0\r\n\r\n')
+    except OSError as e:
+        # El servicio cerró antes de recibir todo (p.ej. respondió un error)
+        estado['error'] = e
+
+
+def lineas_prediccion(csv_path: str, url: str = AI_SERVICE_URL, k: int = 3, bloque: Optional[int] = None,
+                      timeout: Optional[float] = None, info: Optional[dict] = None) -> Iterator[bytes]:
+    """
+    Envía el CSV a /predict/stream y devuelve cada línea NDJSON de la respuesta (bytes, sin salto).
+
+    Args:
+        csv_path: CSV con cabecera latitud,longitud,mes[,id]
+        url: URL base del servicio de IA (http://)
+        k: Clases del top-k por fila
+        bloque: Filas por bloque evaluado en el servidor (default del servidor)
+        timeout: Segundos de espera por operación de red (None = sin límite)
+        info: Dict opcional que se completa con la versión del modelo y los totales
+
+    Raises:
+        RuntimeError: Si el servicio responde un error o corta la respuesta
+    """
+    destino = urlsplit(url)
+    if destino.scheme != 'http':
+        raise ValueError(f"URL no soportada: {url} (use http://host:puerto)")
+    params = {'k': k}
+    if bloque is not None:
+        params['bloque'] = bloque
+    ruta = f"{destino.path.rstrip('/')}/predict/stream?{urlencode(params)}"
+    host = destino.hostname
+    puerto = destino.port or 80
+
+    sock = socket.create_connection((host, puerto), timeout=timeout)
+    estado = {}
+    try:
+        sock.sendall(
+            f"POST {ruta} HTTP/1.1\r\n"
+            f"Host: {destino.netloc}\r\n"
+            "Content-Type: text/csv\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "Accept: application/x-ndjson\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1')
+        )
+        emisor = threading.Thread(
+            target=enviar_cuerpo, args=(sock, leer_chunks(csv_path), estado), name='stream-envio', daemon=True
+        )
+        emisor.start()
+
+        respuesta = http.client.HTTPResponse(sock)
+        respuesta.begin()
+        if respuesta.status != 200:
+            raise RuntimeError(f"/predict/stream respondió {respuesta.status}: "
+                               f"{respuesta.read().decode('utf-8', 'replace')}")
+        if info is not None:
+            info.update({'modelo_version': respuesta.getheader('x-model-version'), 'total': 0, 'errores': 0})
+
+        try:
+            for linea in iter(respuesta.readline, b''):
+                linea = linea.rstrip(b'\n')
+                if not linea:
+                    continue
+                if info is not None:
+                    info['total'] += 1
+                    info['errores'] += b',"error":' in linea
+                yield linea
+        except http.client.IncompleteRead:
+            raise RuntimeError("/predict/stream cortó la respuesta antes de terminar")
+        emisor.join()
+        if 'error' in estado:
+            raise RuntimeError(f"Error enviando el CSV: {estado['error']}")
+    finally:
+        sock.close()
+
+
+def predecir_csv(csv_path: str, url: str = AI_SERVICE_URL, k: int = 3, bloque: Optional[int] = None,
+                 timeout: Optional[float] = None) -> Iterator[dict]:
+    """Como lineas_prediccion, pero devuelve cada fila ya decodificada"""
+    for linea in lineas_prediccion(csv_path, url, k, bloque, timeout):
+        yield json.loads(linea)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predicción de un CSV grande con /predict/stream")
+    parser.add_argument('csv', help="CSV con cabecera latitud,longitud,mes[,id]")
+    parser.add_argument('--url', default=AI_SERVICE_URL, help=f"URL del servicio (default: {AI_SERVICE_URL})")
+    parser.add_argument('--k', type=int, default=3, help="Clases del top-k (default: 3)")
+    parser.add_argument('--bloque', type=int, default=None, help="Filas por bloque en el servidor")
+    parser.add_argument('--salida', default=None, help="Archivo NDJSON de salida (default: stdout)")
+    args = parser.parse_args()
+
+    info = {}
+    inicio = time.perf_counter()
+    filas = 0
+    destino = open(args.salida, 'wb') if args.salida else None
+    try:
+        for linea in lineas_prediccion(args.csv, args.url, args.k, args.bloque, info=info):
+            if destino is not None:
+                destino.write(linea + b'\n')
+            else:
+                print(linea.decode('utf-8'))
+            filas += 1
+    finally:
+        if destino is not None:
+            destino.close()
+
+    if destino is not None:
+        segundos = time.perf_counter() - inicio
+        print(f"✅ {filas} filas en {segundos:.1f}s ({filas / segundos:.0f} filas/s), "
+              f"{info.get('errores', 0)} con error, modelo {info.get('modelo_version')}")
+        print(f"💾 Predicciones: {args.salida}")
@@ -0,0 +1,191 @@
+"""
+Lectura y escritura por bloques para POST /predict/stream.
+
+La entrada (NDJSON o CSV) llega en chunks de tamaño arbitrario; LectorPuntos
+los corta en líneas completas y entrega bloques de `tamano_bloque` filas. Cada
+bloque se parsea, se evalúa vectorizado y se convierte en líneas NDJSON sin
+pasar por json.dumps fila por fila (los nombres de clase se serializan una
+sola vez).
+
+Las filas que no se pueden evaluar (línea mal formada, mes fuera de rango o
+zona no vista en el entrenamiento) producen una línea con "error" en lugar de
+cortar todo el trabajo.
+
+Si la entrada trae id (columna "id" en la cabecera CSV, o clave "id" en la
+primera fila NDJSON) todas las líneas de salida llevan "id", nulo en las
+filas que no lo tengan; si no, ninguna.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Filas por bloque evaluado (y por escritura de la respuesta)
+STREAM_BLOQUE = int(os.getenv('STREAM_BLOQUE', '5000'))
+
+FORMATOS_ENTRADA = {
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv'
+}
+
+COLUMNAS_REQUERIDAS = ('latitud', 'longitud', 'mes')
+
+
+def formato_entrada(content_type: Optional[str]) -> str:
+    """ndjson o csv según el Content-Type (sin Content-Type se asume NDJSON)"""
+    tipo = (content_type or 'application/x-ndjson').split(';')[0].strip().lower()
+    if tipo not in FORMATOS_ENTRADA:
+        raise ValueError(f"Content-Type no soportado: {tipo} (use {sorted(FORMATOS_ENTRADA)})")
+    return FORMATOS_ENTRADA[tipo]
+
+
+class LectorPuntos:
+    """Corta la entrada en bloques de líneas completas, con su índice de fila."""
+
+    def __init__(self, formato: str, tamano_bloque: int = STREAM_BLOQUE):
+        self.formato = formato
+        self.tamano_bloque = tamano_bloque
+        self.columnas: Optional[Dict[str, int]] = None
+        # Se decide una vez por trabajo, antes de entregar el primer bloque
+        self.con_id: Optional[bool] = None
+        self.filas = 0
+        self._resto = b''
+        self._lineas: List[bytes] = []
+
+    def _leer_cabecera(self, linea: bytes):
+        nombres = [c.strip().strip('"').lower() for c in linea.decode('utf-8-sig').split(',')]
+        faltantes = [c for c in COLUMNAS_REQUERIDAS if c not in nombres]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en la cabecera CSV: {faltantes}")
+        self.columnas = {nombre: i for i, nombre in enumerate(nombres)}
+        self.con_id = 'id' in self.columnas
+
+    def _detectar_id(self, linea: bytes):
+        """NDJSON: la primera fila que sea un objeto JSON decide si el trabajo trae id"""
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            return
+        if isinstance(fila, dict):
+            self.con_id = 'id' in fila
+
+    def _agregar(self, lineas: List[bytes]) -> List[Tuple[int, List[bytes]]]:
+        for linea in lineas:
+            if not linea.strip():
+                continue
+            if self.formato == 'csv' and self.columnas is None:
+                self._leer_cabecera(linea)
+                continue
+            if self.con_id is None:
+                self._detectar_id(linea)
+            self._lineas.append(linea)
+
+        bloques = []
+        if self.con_id is None and len(self._lineas) >= self.tamano_bloque:
+            # Un bloque completo sin ninguna fila válida: sin id
+            self.con_id = False
+        while len(self._lineas) >= self.tamano_bloque:
+            bloques.append((self.filas, self._lineas[:self.tamano_bloque]))
+            self._lineas = self._lineas[self.tamano_bloque:]
+            self.filas += self.tamano_bloque
+        return bloques
+
+    def alimentar(self, chunk: bytes) -> List[Tuple[int, List[bytes]]]:
+        """Bloques completos disponibles después de este chunk: [(indice_inicial, lineas)]"""
+        lineas = (self._resto + chunk).split(b'\n')
+        self._resto = lineas.pop()
+        return self._agregar(lineas)
+
+    def terminar(self) -> List[Tuple[int, List[bytes]]]:
+        """Bloques restantes al terminar la entrada (incluida la última línea sin salto)"""
+        bloques = self._agregar([self._resto])
+        self._resto = b''
+        if self.con_id is None:
+            self.con_id = False
+        if self._lineas:
+            bloques.append((self.filas, self._lineas))
+            self.filas += len(self._lineas)
+            self._lineas = []
+        return bloques
+
+
+def parsear_lineas(lineas: List[bytes], formato: str, columnas: Optional[Dict[str, int]] = None):
+    """
+    Parsea un bloque de líneas.
+
+    Returns:
+        (latitud, longitud, mes, ids, errores): arrays del tamaño del bloque,
+        ids (None en las filas sin id) y errores {posición: mensaje}
+    """
+    n = len(lineas)
+    latitud = np.full(n, np.nan)
+    longitud = np.full(n, np.nan)
+    mes = np.zeros(n, dtype=np.int64)
+    ids: List[object] = [None] * n
+    errores: Dict[int, str] = {}
+
+    for i, linea in enumerate(lineas):
+        try:
+            if formato == 'ndjson':
+                fila = json.loads(linea)
+                ids[i] = fila.get('id')
+                latitud[i], longitud[i], valor_mes = float(fila['latitud']), float(fila['longitud']), fila['mes']
+            else:
+                campos = linea.decode('utf-8').rstrip('\r').split(',')
+                if 'id' in columnas and columnas['id'] < len(campos):
+                    ids[i] = campos[columnas['id']].strip().strip('"')
+                latitud[i] = float(campos[columnas['latitud']])
+                longitud[i] = float(campos[columnas['longitud']])
+                valor_mes = campos[columnas['mes']]
+            # Como /predict: 5 o 5.0 son mayo, 5.7 es un error (no se trunca)
+            numero_mes = float(valor_mes)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            errores[i] = f"Fila inválida: {type(e).__name__}: {e}"
+            continue
+        if isinstance(valor_mes, bool) or not numero_mes.is_integer():
+            errores[i] = "mes debe ser un número entero"
+            continue
+        if not 1 <= numero_mes <= 12:
+            errores[i] = "mes debe estar entre 1 y 12"
+            continue
+        mes[i] = int(numero_mes)
+        if not (np.isfinite(latitud[i]) and np.isfinite(longitud[i])):
+            errores[i] = "latitud y longitud deben ser números finitos"
+
+    return latitud, longitud, mes, ids, errores
+
+
+def lineas_ndjson(inicio: int, validos: np.ndarray, top_idx: np.ndarray, top_probs: np.ndarray,
+                  nombres_json: List[str], k: int, ids: Optional[list], errores: Dict[int, str]) -> bytes:
+    """
+    Una línea NDJSON por fila del bloque, en el orden de entrada.
+
+    Args:
+        inicio: Índice global de la primera fila del bloque
+        validos: Posiciones del bloque que se evaluaron (en orden)
+        top_idx: Índices de clase top-k de las filas válidas
+        top_probs: Probabilidades top-k de las filas válidas
+        nombres_json: Nombre de cada clase ya serializado en JSON
+        k: Tamaño del top-k (define la clave top_{k}_predicciones)
+        ids: Id de cada fila del bloque (None si el trabajo no trae id)
+        errores: Posición -> mensaje de las filas no evaluadas
+    """
+    n = len(validos) + len(errores)
+    salida: List[Optional[str]] = [None] * n
+    clave = f'"top_{k}_predicciones"'
+
+    for fila, clases, probs in zip(validos.tolist(), top_idx.tolist(), top_probs.tolist()):
+        top = ','.join(f'{{"riesgo":{nombres_json[c]},"probabilidad":{p!r}}}' for c, p in zip(clases, probs))
+        salida[fila] = f'"riesgo":{nombres_json[clases[0]]},"probabilidad":{probs[0]!r},{clave}:[{top}]'
+    for fila, mensaje in errores.items():
+        salida[fila] = f'"error":{json.dumps(mensaje, ensure_ascii=False)}'
+
+    lineas = []
+    for fila, cuerpo in enumerate(salida):
+        id_json = '' if ids is None else f'"id":{json.dumps(ids[fila], ensure_ascii=False)},'
+        lineas.append(f'{{"indice":{inicio + fila},{id_json}{cuerpo}}}\n')
+    return ''.join(lineas).encode('utf-8')
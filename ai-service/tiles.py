@@ -0,0 +1,299 @@
+"""
+Tiles raster de riesgo (XYZ, Web Mercator) para las capas del mapa.
+
+Cada tile es una malla de 256x256 píxeles que se evalúa como un solo lote
+(malla precalculada + modelo). Se sirve como PNG coloreado o como .npy con
+la probabilidad float32 de la clase pedida; los píxeles fuera de Nariño o en
+zonas que el modelo no conoce quedan transparentes / NaN.
+
+Los tiles se guardan en memoria (LRU) y en disco bajo TILES_DIR/<versión del
+modelo>/, así que un modelo nuevo nunca sirve tiles viejos. Al activar una
+versión, el registro borra los directorios de versiones anteriores a ella
+(creados antes que sus artefactos): los de versiones más nuevas, de otro
+worker o pre-generados, se conservan.
+
+Pre-generar tiles (desde ai-service/):
+    python tiles.py --zoom 6 12
+"""
+
+import argparse
+import io
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterator, Sequence, Tuple
+
+import numpy as np
+
+from risk_lattice import LAT_MAX, LAT_MIN, LON_MAX, LON_MIN
+
+TAMANO_TILE = 256
+TILES_DIR = os.getenv('TILES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tiles'))
+TILES_CACHE_SIZE = int(os.getenv('TILES_CACHE_SIZE', '512'))
+TILES_MAX_ZOOM = 16
+FORMATOS = {'png': 'image/png', 'npy': 'application/octet-stream'}
+
+# Rampa verde -> amarillo -> naranja -> rojo para probabilidades 0..1
+RAMPA_POSICIONES = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+RAMPA_COLORES = np.array([
+    [26, 152, 80],
+    [166, 217, 106],
+    [254, 224, 139],
+    [244, 109, 67],
+    [165, 0, 38]
+], dtype=np.float64)
+ALPHA = 180
+
+
+def limites_tile(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(lon_min, lat_min, lon_max, lat_max) del tile"""
+    n = 2 ** z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def tile_en_narino(z: int, x: int, y: int) -> bool:
+    lon_min, lat_min, lon_max, lat_max = limites_tile(z, x, y)
+    return lon_max > LON_MIN and lon_min < LON_MAX and lat_max > LAT_MIN and lat_min < LAT_MAX
+
+
+def coordenadas_pixeles(z: int, x: int, y: int, tamano: int = TAMANO_TILE) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitud y longitud del centro de cada píxel, arrays (tamano, tamano)"""
+    n = 2 ** z
+    desplazamiento = (np.arange(tamano) + 0.5) / tamano
+    lon = (x + desplazamiento) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + desplazamiento) / n))))
+    lat_g, lon_g = np.meshgrid(lat, lon, indexing='ij')
+    return lat_g, lon_g
+
+
+def calcular_tile_clases(
+    probabilidades: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+    puntos_validos: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    z: int, x: int, y: int, mes: int, clases_idx: Sequence[int]
+) -> np.ndarray:
+    """
+    Probabilidad de varias clases para cada píxel del tile, con una sola
+    evaluación del modelo.
+
+    Args:
+        probabilidades: función (lat, lon, mes) -> probabilidades (n, n_clases)
+        puntos_validos: función (lat, lon) -> máscara de puntos evaluables
+        clases_idx: columnas de las clases en las probabilidades
+
+    Returns:
+        Array float32 (len(clases_idx), 256, 256) con NaN donde no hay valor
+    """
+    valores = np.full((len(clases_idx), TAMANO_TILE * TAMANO_TILE), np.nan, dtype=np.float32)
+    if tile_en_narino(z, x, y):
+        lat, lon = coordenadas_pixeles(z, x, y)
+        lat, lon = lat.ravel(), lon.ravel()
+        validos = (lat >= LAT_MIN) & (lat <= LAT_MAX) & (lon >= LON_MIN) & (lon <= LON_MAX)
+        validos[validos] = puntos_validos(lat[validos], lon[validos])
+        if validos.any():
+            probs = probabilidades(lat[validos], lon[validos], np.full(int(validos.sum()), mes))
+            valores[:, validos] = probs[:, list(clases_idx)].T
+    return valores.reshape(len(clases_idx), TAMANO_TILE, TAMANO_TILE)
+
+
+def calcular_tile(
+    probabilidades: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+    puntos_validos: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    z: int, x: int, y: int, mes: int, clase_idx: int
+) -> np.ndarray:
+    """Probabilidad de una clase para cada píxel del tile: array float32 (256, 256)"""
+    return calcular_tile_clases(probabilidades, puntos_validos, z, x, y, mes, [clase_idx])[0]
+
+
+def colorear(valores: np.ndarray) -> np.ndarray:
+    """Probabilidades -> RGBA uint8; NaN queda transparente"""
+    rgba = np.zeros(valores.shape + (4,), dtype=np.uint8)
+    validos = ~np.isnan(valores)
+    v = np.clip(valores[validos], 0.0, 1.0)
+    for canal in range(3):
+        rgba[..., canal][validos] = np.interp(v, RAMPA_POSICIONES, RAMPA_COLORES[:, canal]).round()
+    rgba[..., 3][validos] = ALPHA
+    return rgba
+
+
+def _chunk_png(tipo: bytes, datos: bytes) -> bytes:
+    return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos) & 0xffffffff)
+
+
+def codificar_png(rgba: np.ndarray) -> bytes:
+    """PNG RGBA de 8 bits con zlib (sin dependencias de imagen)"""
+    alto, ancho, _ = rgba.shape
+    # Cada fila empieza con el byte de filtro 0 (sin filtro)
+    crudo = np.zeros((alto, ancho * 4 + 1), dtype=np.uint8)
+    crudo[:, 1:] = rgba.reshape(alto, -1)
+    return (
+        b'\x89PNG\r\n\x1a\n' +
+        _chunk_png(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 6, 0, 0, 0)) +
+        _chunk_png(b'IDAT', zlib.compress(crudo.tobytes(), 6)) +
+        _chunk_png(b'IEND', b'')
+    )
+
+
+def codificar_tile(valores: np.ndarray, formato: str) -> bytes:
+    if formato == 'png':
+        return codificar_png(colorear(valores))
+    buffer = io.BytesIO()
+    np.save(buffer, valores)
+    return buffer.getvalue()
+
+
+class TileCache:
+    """Cache LRU en memoria respaldada por disco, con la versión del modelo en la clave."""
+
+    def __init__(self, directorio: str = TILES_DIR, max_tiles: int = TILES_CACHE_SIZE):
+        self.directorio = directorio
+        self.max_tiles = max_tiles
+        self._memoria: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.generados = 0
+
+    def ruta(self, clave: tuple) -> str:
+        version, mes, clase, z, x, y, formato = clave
+        return os.path.join(self.directorio, version, f"{mes:02d}", clase, str(z), str(x), f"{y}.{formato}")
+
+    def podar(self, conservar: str, anteriores_a: float) -> int:
+        """
+        Borra los tiles de las versiones anteriores a `conservar`: las que no
+        son `conservar` y cuyo directorio es anterior a `anteriores_a` (mtime
+        de los artefactos de esa versión). Devuelve cuántas versiones borró.
+        """
+        with self._lock:
+            for clave in [c for c in self._memoria if c[0] != conservar]:
+                del self._memoria[clave]
+        if not os.path.isdir(self.directorio):
+            return 0
+        viejas = []
+        for version in os.listdir(self.directorio):
+            path = os.path.join(self.directorio, version)
+            try:
+                if version != conservar and os.path.isdir(path) and os.path.getmtime(path) < anteriores_a:
+                    viejas.append(path)
+            except OSError:
+                continue
+        for path in viejas:
+            shutil.rmtree(path, ignore_errors=True)
+        if viejas:
+            print(f"🧹 Tiles de {len(viejas)} versiones anteriores borrados de {self.directorio}")
+        return len(viejas)
+
+    def obtener(self, clave: tuple, generar: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return self._memoria[clave]
+
+        ruta = self.ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                contenido = f.read()
+            self.aciertos_disco += 1
+        except OSError:
+            contenido = generar()
+            self.generados += 1
+            self.guardar_disco(ruta, contenido)
+
+        with self._lock:
+            self._memoria[clave] = contenido
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_tiles:
+                self._memoria.popitem(last=False)
+        return contenido
+
+    @staticmethod
+    def guardar_disco(ruta: str, contenido: bytes):
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            tmp = f"{ruta}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(contenido)
+            os.replace(tmp, ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el tile {ruta}: {e}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "tiles_memoria": len(self._memoria),
+            "max_tiles": self.max_tiles,
+            "aciertos_memoria": self.aciertos_memoria,
+            "aciertos_disco": self.aciertos_disco,
+            "generados": self.generados
+        }
+
+
+def tiles_narino(z: int) -> Iterator[Tuple[int, int]]:
+    """(x, y) de los tiles del nivel z que cubren el bbox de Nariño"""
+    n = 2 ** z
+
+    def tile_x(lon):
+        return min(n - 1, int((lon + 180.0) / 360.0 * n))
+
+    def tile_y(lat):
+        lat_rad = math.radians(lat)
+        return min(n - 1, int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n))
+
+    for x in range(tile_x(LON_MIN), tile_x(LON_MAX) + 1):
+        for y in range(tile_y(LAT_MAX), tile_y(LAT_MIN) + 1):
+            yield x, y
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-genera tiles de riesgo para Nariño")
+    parser.add_argument('--zoom', type=int, nargs=2, default=[6, 12], metavar=('MIN', 'MAX'),
+                        help="Rango de zoom (default: 6 12)")
+    parser.add_argument('--meses', type=int, nargs='+', default=list(range(1, 13)), help="Meses (default: 1-12)")
+    parser.add_argument('--clases', nargs='+', default=None, help="Clases (default: todas)")
+    parser.add_argument('--formato', choices=sorted(FORMATOS), default='png')
+    args = parser.parse_args()
+
+    from functools import partial
+
+    import main
+
+    modelo = main.registry.activo
+    if modelo is None:
+        raise SystemExit("❌ Modelo no disponible")
+
+    clases = list(modelo.label_encoder.classes_)
+    seleccion = args.clases or clases
+    desconocidas = set(seleccion) - set(clases)
+    if desconocidas:
+        raise SystemExit(f"❌ Clases desconocidas: {sorted(desconocidas)} (opciones: {clases})")
+
+    probabilidades = partial(main.probabilidades_puntos, modelo)
+    validos = partial(main.puntos_con_zona_conocida, modelo)
+    clases_idx = [clases.index(clase) for clase in seleccion]
+    cache = TileCache()
+    cache.podar(modelo.version, modelo.creado)
+    inicio = time.time()
+    total = 0
+
+    print(f"🔄 Generando tiles del modelo {modelo.version} en {TILES_DIR}/ ...")
+    for z in range(args.zoom[0], args.zoom[1] + 1):
+        coordenadas = list(tiles_narino(z))
+        for mes in args.meses:
+            for x, y in coordenadas:
+                # Una evaluación por tile; cada clase es una rebanada
+                valores = calcular_tile_clases(probabilidades, validos, z, x, y, mes, clases_idx)
+                for clase, valores_clase in zip(seleccion, valores):
+                    clave = (modelo.version, mes, clase, z, x, y, args.formato)
+                    cache.guardar_disco(cache.ruta(clave), codificar_tile(valores_clase, args.formato))
+                    total += 1
+        print(f"   🗺️ Zoom {z:2d}: {len(coordenadas)} tiles x {len(args.meses)} meses x {len(seleccion)} clases")
+
+    print(f"✅ {total} tiles generados ({time.time() - inicio:.1f}s)")
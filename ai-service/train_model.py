@@ -1,101 +1,85 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.inspection import permutation_importance
+from sklearn.preprocessing import LabelEncoder
 import joblib
-import subprocess
-import io
+from forest_engine import exportar_modelo
+from model_bundle import guardar_bundle
+from training_cache import datos_entrenamiento
+from evaluation import BLOQUE_GRADOS, bloques_grilla, bloques_municipio, evaluar_cv, folds_espaciales
+from model_search import CONFIGURACIONES_POR_DEFECTO, PESO_LATENCIA, PESO_TAMANO, buscar, crear_modelo
+from features import FEATURE_COLUMNS, calcular_features, especificacion, mes_desde_fecha, zona_geografica
 import os
+import argparse
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
-def agrupar_fenomenos(tipo):
-    """
-    Agrupa tipos de fenómenos similares en categorías principales.
-    Esto reduce el número de clases y aumenta muestras por clase.
-    """
-    tipo_upper = str(tipo).upper()
-    
+# Grupos de fenómenos, evaluados en orden (la primera coincidencia gana)
+GRUPOS_FENOMENOS = [
     # Deslizamientos y movimientos de tierra
-    if any(word in tipo_upper for word in ['DESLIZAMIENTO', 'REMOCION', 'MASA', 'DERRUMBE', 'SOCAVACION']):
-        return 'DESLIZAMIENTO'
-    
+    ('DESLIZAMIENTO', ['DESLIZAMIENTO', 'REMOCION', 'MASA', 'DERRUMBE', 'SOCAVACION']),
     # Inundaciones y avenidas
-    elif any(word in tipo_upper for word in ['INUNDACION', 'AVENIDA', 'TORRENCIAL', 'CRECIENTE']):
-        return 'INUNDACION'
-    
+    ('INUNDACION', ['INUNDACION', 'AVENIDA', 'TORRENCIAL', 'CRECIENTE']),
     # Vendavales y vientos
-    elif any(word in tipo_upper for word in ['VENDAVAL', 'VIENTO', 'HURACAN', 'TORNADO']):
-        return 'VENDAVAL'
-    
+    ('VENDAVAL', ['VENDAVAL', 'VIENTO', 'HURACAN', 'TORNADO']),
     # Incendios
-    elif any(word in tipo_upper for word in ['INCENDIO', 'FUEGO']):
-        return 'INCENDIO'
-    
+    ('INCENDIO', ['INCENDIO', 'FUEGO']),
     # Sequías
-    elif any(word in tipo_upper for word in ['SEQUIA', 'DESERTIFICACION']):
-        return 'SEQUIA'
-    
+    ('SEQUIA', ['SEQUIA', 'DESERTIFICACION']),
     # Sismos
-    elif any(word in tipo_upper for word in ['SISMO', 'TERREMOTO', 'TEMBLOR']):
-        return 'SISMO'
-    
-    # Otros (categoría catch-all)
-    else:
-        return 'OTRO'
+    ('SISMO', ['SISMO', 'TERREMOTO', 'TEMBLOR'])
+]
+# Categoría catch-all
+GRUPO_POR_DEFECTO = 'OTRO'
 
-def get_data_from_docker():
-    """Extrae datos con features optimizadas"""
-    print("🔄 Extrayendo datos desde PostgreSQL...")
-    
-    query = """
-    COPY (
-        WITH centro AS (
-            SELECT 1.2 as lat_centro, -77.3 as lon_centro
-        )
-        SELECT 
-            f.latitud, 
-            f.longitud, 
-            EXTRACT(MONTH FROM f.fecha)::int as mes,
-            EXTRACT(QUARTER FROM f.fecha)::int as trimestre,
-            SQRT(POW(f.latitud - c.lat_centro, 2) + POW(f.longitud - c.lon_centro, 2)) as distancia_centro,
-            CASE
-                WHEN f.longitud < -78.0 THEN 'COSTA_PACIFICA'
-                WHEN f.latitud > 1.5 THEN 'NORTE'
-                WHEN f.latitud < 0.8 THEN 'SUR'
-                ELSE 'CENTRO'
-            END as zona,
-            f.latitud * EXTRACT(MONTH FROM f.fecha) as lat_mes,
-            f.longitud * EXTRACT(MONTH FROM f.fecha) as lon_mes,
-            f.tipo_fenomeno_normalizado
-        FROM public.fenomenos_naturales f
-        CROSS JOIN centro c
-        WHERE f.latitud IS NOT NULL AND f.longitud IS NOT NULL
-    ) TO STDOUT WITH CSV HEADER
+def agrupar_fenomenos(tipos):
     """
-    
-    cmd = [
-        "docker", "exec", "-i", "ecoguard_postgres",
-        "psql", "-U", "postgres", "-d", "ecoguard", "-c", query
-    ]
-    
-    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
-    
-    if result.returncode != 0:
-        raise Exception(f"Error: {result.stderr}")
-        
-    return pd.read_csv(io.StringIO(result.stdout))
+    Agrupa tipos de fenómenos similares en categorías principales.
+    Esto reduce el número de clases y aumenta muestras por clase.
+
+    Las reglas se evalúan una vez por tipo distinto (como categóricas) y el
+    resultado se reparte a las filas con los códigos; los nulos van a OTRO.
+    """
+    categorias = pd.Categorical(tipos)
+    valores = pd.Series(categorias.categories.astype(str)).str.upper()
+    grupos = np.select(
+        [valores.str.contains('|'.join(palabras), regex=True).to_numpy() for _, palabras in GRUPOS_FENOMENOS],
+        [grupo for grupo, _ in GRUPOS_FENOMENOS],
+        default=GRUPO_POR_DEFECTO
+    )
+    # El código -1 (nulo) toma el último elemento: GRUPO_POR_DEFECTO
+    return np.append(grupos, GRUPO_POR_DEFECTO)[categorias.codes]
 
-def train():
+def mostrar_progreso(filas):
+    print(f"   ... {filas:,} filas leídas", end='\r', flush=True)
+
+def get_data_from_db(progreso=mostrar_progreso, refrescar=False):
+    """Extrae las columnas crudas (COPY binario, con snapshot Parquet local)"""
+    print("🔄 Extrayendo datos desde PostgreSQL...")
+    return datos_entrenamiento(progreso=progreso, refrescar=refrescar)
+
+NOMBRES_MODELO = {
+    'random_forest': 'Random Forest optimizado',
+    'hist_gradient_boosting': 'HistGradientBoosting'
+}
+
+def configuracion_anterior():
+    """Hiperparámetros guardados por la última búsqueda, si existen"""
+    try:
+        return joblib.load('ai-service/models/metadata.pkl').get('hiperparametros')
+    except Exception:
+        return None
+
+def train(search=False, opciones_busqueda=None, modelo=None, refrescar_datos=False,
+          cv='espacial', bloques='grilla', tamano_bloque=BLOQUE_GRADOS):
     print("=" * 70)
     print("MODELO OPTIMIZADO - AGRUPACIÓN DE CLASES + FEATURES MEJORADAS")
     print("=" * 70)
     
     try:
-        df = get_data_from_docker()
+        df = get_data_from_db(refrescar=refrescar_datos)
         print(f"\n✅ Datos extraídos: {len(df)} registros")
         
         if len(df) == 0:
@@ -107,7 +91,7 @@ def train():
 
     # AGRUPACIÓN DE CLASES
     print(f"\n🔄 Agrupando fenómenos similares...")
-    df['fenomeno_agrupado'] = df['tipo_fenomeno_normalizado'].apply(agrupar_fenomenos)
+    df['fenomeno_agrupado'] = agrupar_fenomenos(df['tipo_fenomeno_normalizado'])
     
     print(f"\n📊 Clases ANTES de agrupar: {df['tipo_fenomeno_normalizado'].nunique()}")
     print(f"📊 Clases DESPUÉS de agrupar: {df['fenomeno_agrupado'].nunique()}")
@@ -117,63 +101,98 @@ def train():
     # Preprocesamiento
     print(f"\n🔧 Preprocesando...")
     
+    df['mes'] = mes_desde_fecha(df['fecha'])
+    
     le_zona = LabelEncoder()
-    df['zona_encoded'] = le_zona.fit_transform(df['zona'])
+    le_zona.fit(zona_geografica(df['latitud'], df['longitud']))
     
     le_target = LabelEncoder()
     df['target'] = le_target.fit_transform(df['fenomeno_agrupado'])
     
-    # Features seleccionadas (las 8 mejores del análisis anterior)
-    feature_columns = [
-        'latitud', 'longitud', 'mes', 'trimestre',
-        'distancia_centro', 'zona_encoded',
-        'lat_mes', 'lon_mes'
-    ]
-    
-    X = df[feature_columns]
+    # Features compartidas con el servicio (features.py)
+    feature_columns = list(FEATURE_COLUMNS)
+    X = calcular_features(df['latitud'], df['longitud'], df['mes'], le_zona, feature_columns)
     y = df['target']
     
     print(f"   ✅ Features: {len(feature_columns)}")
     print(f"   ✅ Clases: {len(le_target.classes_)} - {list(le_target.classes_)}")
     
-    # Split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
-    
-    # Entrenar con hiperparámetros optimizados
-    print(f"\n🤖 Entrenando Random Forest optimizado...")
-    
-    clf = RandomForestClassifier(
-        n_estimators=200,
-        max_depth=12,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1,
-        class_weight='balanced'  # Importante para clases desbalanceadas
-    )
-    
-    clf.fit(X_train, y_train)
-    
-    # Evaluar
-    train_score = clf.score(X_train, y_train)
-    test_score = clf.score(X_test, y_test)
-    cv_scores = cross_val_score(clf, X, y, cv=5, scoring='accuracy')
+    # Bloques espaciales: cada celda (o municipio) completa en un solo fold,
+    # para que los puntos vecinos no se repartan entre train y test
+    if cv == 'espacial':
+        if bloques == 'municipio':
+            bloque = bloques_municipio(df['codigo_dane'], df['latitud'], df['longitud'], tamano_bloque)
+        else:
+            bloque = bloques_grilla(df['latitud'], df['longitud'], tamano_bloque)
+        folds = folds_espaciales(bloque, n_folds=5)
+        print(f"   ✅ Bloques de CV: {len(np.unique(bloque))} ({bloques}, {tamano_bloque}°)")
+    else:
+        bloque = folds = None
+    
+    # Hiperparámetros: búsqueda nueva, los de la última búsqueda (si son de la
+    # familia pedida) o los de partida de la familia
+    if search:
+        print(f"\n🔎 Buscando hiperparámetros (successive halving)...")
+        opciones = dict(opciones_busqueda or {})
+        if bloque is not None:
+            opciones['folds'] = folds_espaciales(bloque, n_folds=opciones.pop('n_folds', 3))
+        hiperparametros = buscar(X, y, **opciones)
+    else:
+        anterior = configuracion_anterior()
+        familia = modelo or (anterior['modelo'] if anterior else 'random_forest')
+        if anterior and anterior['modelo'] == familia:
+            hiperparametros = anterior
+        else:
+            hiperparametros = dict(CONFIGURACIONES_POR_DEFECTO[familia])
+    config = {'modelo': hiperparametros['modelo'], 'params': hiperparametros['params']}
+    print(f"\n⚙️ Configuración: {config['modelo']} {config['params']}")
+    
+    clf = crear_modelo(config)
+    
+    # Evaluar: CV en paralelo (un proceso por fold) con probabilidades out-of-fold
+    print(f"\n🧪 Validación cruzada {cv} (5 folds en paralelo)...")
+    resultado_cv = evaluar_cv(clf, X, y, le_target.classes_.tolist(), n_folds=5, folds=folds, bloques=bloque)
+    cv_metrics = resultado_cv.metricas()
+    print(f"   ✅ {len(resultado_cv.scores)} folds en {resultado_cv.segundos:.1f}s con {resultado_cv.n_procesos} procesos")
+    if bloque is not None:
+        cv_metrics['bloques'] = {'tipo': bloques, 'tamano_grados': tamano_bloque}
+        accuracy_bloques = [b['accuracy'] for b in cv_metrics['por_bloque'].values() if b['muestras'] >= 20]
+        if accuracy_bloques:
+            print(f"   ✅ Accuracy por bloque (≥20 muestras): mediana {np.median(accuracy_bloques):.2%}, "
+                  f"mínima {np.min(accuracy_bloques):.2%} en {len(accuracy_bloques)} bloques")
+    
+    # Modelo final: una sola vez con todos los datos
+    print(f"\n🤖 Entrenando {NOMBRES_MODELO[config['modelo']]}...")
+    clf.fit(X, y)
+    
+    train_score = clf.score(X, y)
+    test_score = resultado_cv.oof_accuracy  # Accuracy out-of-fold: cada muestra evaluada sin haberla visto
+    cv_scores = resultado_cv.scores
     
     print(f"\n🎯 RESULTADOS:")
     print(f"   - Accuracy ENTRENAMIENTO: {train_score:.2%}")
-    print(f"   - Accuracy PRUEBA: {test_score:.2%}")
+    print(f"   - Accuracy OUT-OF-FOLD: {test_score:.2%}")
     print(f"   - Accuracy CV (5-fold): {cv_scores.mean():.2%} (+/- {cv_scores.std():.2%})")
     print(f"   - Diferencia train-test: {(train_score - test_score):.2%}")
     
     if train_score - test_score < 0.15:
         print(f"   ✅ Modelo bien balanceado")
     
+    print(f"\n📋 Métricas por clase (out-of-fold):")
+    for clase, m in cv_metrics['por_clase'].items():
+        print(f"   - {clase:<15} precision {m['precision']:.2%} | recall {m['recall']:.2%} | f1 {m['f1']:.2%} | n={m['soporte']}")
+    
     # Importancia
+    if hasattr(clf, 'feature_importances_'):
+        importancias = clf.feature_importances_
+    else:
+        # HistGradientBoosting no tiene importancias por impureza
+        importancias = permutation_importance(
+            clf, X, y, n_repeats=3, random_state=42, max_samples=min(len(X), 5000)
+        ).importances_mean
     feature_importance = pd.DataFrame({
         'feature': feature_columns,
-        'importance': clf.feature_importances_
+        'importance': importancias
     }).sort_values('importance', ascending=False)
     
     print(f"\n🏆 Importancia de Features:")
@@ -188,10 +207,6 @@ def train():
     joblib.dump(le_target, 'ai-service/models/label_encoder.pkl')
     joblib.dump(le_zona, 'ai-service/models/zona_encoder.pkl')
     
-    # Guardar scaler vacío para compatibilidad
-    scaler = StandardScaler()
-    joblib.dump(scaler, 'ai-service/models/scaler.pkl')
-    
     metadata = {
         'feature_columns': feature_columns,
         'feature_importance': feature_importance.to_dict('records'),
@@ -202,12 +217,38 @@ def train():
         'cv_score_mean': float(cv_scores.mean()),
         'cv_score_std': float(cv_scores.std()),
         'n_samples': len(df),
-        'grouped_classes': True
+        'grouped_classes': True,
+        'feature_spec': especificacion(),
+        'cv_metrics': cv_metrics,
+        'hiperparametros': hiperparametros
     }
     joblib.dump(metadata, 'ai-service/models/metadata.pkl')
     
+    # Probabilidades out-of-fold para calibración
+    np.savez_compressed(
+        'ai-service/models/oof_probabilidades.npz',
+        probabilidades=resultado_cv.oof_probs,
+        y=resultado_cv.y,
+        clases=np.array(resultado_cv.clases),
+        folds=resultado_cv.folds
+    )
+    
     print(f"   ✅ Modelo: {os.path.getsize('ai-service/models/model_riesgo.pkl')} bytes")
     
+    # Bundle único que carga el servicio (arrays del modelo + encoders + metadata)
+    bundle_path = 'ai-service/models/model_riesgo.bundle'
+    tipo, arrays = exportar_modelo(clf)
+    checksum = guardar_bundle(
+        arrays,
+        le_target.classes_.tolist(),
+        le_zona.classes_.tolist(),
+        metadata,
+        bundle_path,
+        tipo,
+        estimador='ai-service/models/model_riesgo.pkl'
+    )
+    print(f"   ✅ Bundle ({tipo}): {os.path.getsize(bundle_path)} bytes ({checksum[:12]})")
+    
     print(f"\n" + "=" * 70)
     if test_score >= 0.65:
         print(f"✅ ÉXITO: {test_score:.2%} >= 65% con {len(feature_columns)} features")
@@ -216,4 +257,33 @@ def train():
     print(f"=" * 70)
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Entrena el modelo de riesgo de EcoGuard")
+    parser.add_argument('--search', action='store_true',
+                        help="Buscar hiperparámetros (RF y HistGradientBoosting) antes de entrenar")
+    parser.add_argument('--modelo', choices=sorted(CONFIGURACIONES_POR_DEFECTO), default=None,
+                        help="Tipo de modelo sin --search (default: el del último entrenamiento, o random_forest)")
+    parser.add_argument('--candidatos', type=int, default=24, help="Configuraciones de la primera ronda (default: 24)")
+    parser.add_argument('--eta', type=int, default=3, help="Factor de reducción entre rondas (default: 3)")
+    parser.add_argument('--peso-latencia', type=float, default=PESO_LATENCIA,
+                        help=f"Accuracy descontada por ms de latencia (default: {PESO_LATENCIA})")
+    parser.add_argument('--peso-tamano', type=float, default=PESO_TAMANO,
+                        help=f"Accuracy descontada por MB de modelo (default: {PESO_TAMANO})")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (default: núcleos)")
+    parser.add_argument('--cv', choices=['espacial', 'estratificada'], default='espacial',
+                        help="Folds por bloques espaciales o estratificados por clase (default: espacial)")
+    parser.add_argument('--bloques', choices=['grilla', 'municipio'], default='grilla',
+                        help="Bloques de la CV espacial: celdas de grilla o municipios de geo.municipios")
+    parser.add_argument('--tamano-bloque', type=float, default=BLOQUE_GRADOS,
+                        help=f"Lado de las celdas de la grilla en grados (default: {BLOQUE_GRADOS})")
+    parser.add_argument('--refrescar-datos', action='store_true',
+                        help="Ignorar el snapshot local y extraer la tabla completa")
+    args = parser.parse_args()
+    
+    train(search=args.search, opciones_busqueda={
+        'n_candidatos': args.candidatos,
+        'eta': args.eta,
+        'peso_latencia': args.peso_latencia,
+        'peso_tamano': args.peso_tamano,
+        'n_procesos': args.procesos
+    }, modelo=args.modelo, refrescar_datos=args.refrescar_datos,
+       cv=args.cv, bloques=args.bloques, tamano_bloque=args.tamano_bloque)
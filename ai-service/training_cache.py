@@ -0,0 +1,175 @@
+"""
+Caché local del extract de entrenamiento (Parquet con detección de cambios).
+
+El snapshot se guarda en Parquet junto a un estado con el número de filas,
+el máximo updated_at de public.fenomenos_naturales y una firma de ambos.
+En cada corrida solo se consulta ese par en PostgreSQL:
+
+- Firma igual: se lee el Parquet sin tocar la tabla.
+- Firma distinta: se extraen las filas con updated_at >= al del snapshot y
+  se combinan por id. Si después de combinar el número de filas no coincide
+  (filas borradas), se descartan los ids que ya no existen; si aun así no
+  coincide, se hace la extracción completa.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+from pg_copy import conectar, leer_copy
+
+CACHE_DIR = os.getenv('TRAINING_CACHE_DIR', 'ai-service/cache/entrenamiento')
+
+# Columnas del extract y su tipo en el COPY binario; id permite combinar cambios
+COLUMNAS_EXTRACT = {
+    'id': 'int4',
+    'latitud': 'float8',
+    'longitud': 'float8',
+    'fecha': 'date',
+    'tipo_fenomeno_normalizado': 'text',
+    'codigo_dane': 'text'
+}
+
+FILTRO = "f.latitud IS NOT NULL AND f.longitud IS NOT NULL"
+
+SQL_EXTRACT = f"""
+    SELECT
+        f.id::int4,
+        f.latitud::float8,
+        f.longitud::float8,
+        f.fecha,
+        f.tipo_fenomeno_normalizado::text,
+        m.codigo_dane::text
+    FROM public.fenomenos_naturales f
+    -- Municipio que contiene el punto (bloques de la CV espacial)
+    LEFT JOIN LATERAL (
+        SELECT codigo_dane FROM geo.municipios
+        WHERE ST_Contains(geom, ST_SetSRID(ST_MakePoint(f.longitud::float8, f.latitud::float8), 4326))
+        LIMIT 1
+    ) m ON true
+    WHERE {FILTRO}
+"""
+
+SQL_ESTADO = f"""
+    SELECT count(*), max(f.updated_at)::text
+    FROM public.fenomenos_naturales f
+    WHERE {FILTRO}
+"""
+
+
+def firma(filas: int, max_updated_at: Optional[str]) -> str:
+    """Firma del estado de la tabla: (filas, máximo updated_at)"""
+    return hashlib.sha256(f"{filas}|{max_updated_at}".encode()).hexdigest()[:16]
+
+
+class SnapshotEntrenamiento:
+    """Parquet del extract y su estado en disco."""
+
+    def __init__(self, directorio: str = CACHE_DIR):
+        self.directorio = directorio
+        self.datos_path = os.path.join(directorio, 'fenomenos.parquet')
+        self.estado_path = os.path.join(directorio, 'estado.json')
+
+    def estado(self) -> Optional[dict]:
+        if not (os.path.exists(self.estado_path) and os.path.exists(self.datos_path)):
+            return None
+        with open(self.estado_path) as f:
+            return json.load(f)
+
+    def leer(self) -> pd.DataFrame:
+        return pd.read_parquet(self.datos_path)
+
+    def guardar(self, df: pd.DataFrame, filas: int, max_updated_at: Optional[str]):
+        # Escritura atómica: primero el Parquet, al final el estado que lo valida
+        os.makedirs(self.directorio, exist_ok=True)
+        tmp = self.datos_path + '.tmp'
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, self.datos_path)
+
+        estado = {
+            'filas': filas,
+            'max_updated_at': max_updated_at,
+            'firma': firma(filas, max_updated_at),
+            'columnas': list(COLUMNAS_EXTRACT)
+        }
+        tmp = self.estado_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(estado, f, indent=2)
+        os.replace(tmp, self.estado_path)
+
+
+def combinar_cambios(snapshot: pd.DataFrame, cambios: pd.DataFrame) -> pd.DataFrame:
+    """Reemplaza por id las filas modificadas y agrega las nuevas"""
+    df = pd.concat([snapshot[~snapshot['id'].isin(cambios['id'])], cambios], ignore_index=True)
+    # concat de categóricas con categorías distintas devuelve object
+    for columna, tipo in COLUMNAS_EXTRACT.items():
+        if tipo == 'text':
+            df[columna] = df[columna].astype('category')
+    return df
+
+
+def datos_entrenamiento(progreso: Optional[Callable[[int], None]] = None, refrescar: bool = False,
+                        directorio: str = CACHE_DIR) -> pd.DataFrame:
+    """
+    Extract de entrenamiento usando el snapshot local cuando está vigente.
+
+    Args:
+        progreso: Función que recibe el número de filas leídas en la extracción completa
+        refrescar: Ignorar el snapshot y extraer la tabla completa
+        directorio: Carpeta del snapshot
+
+    Returns:
+        DataFrame con las columnas de COLUMNAS_EXTRACT
+    """
+    snapshot = SnapshotEntrenamiento(directorio)
+    estado = None if refrescar else snapshot.estado()
+    # Un snapshot con otras columnas no sirve ni como base del merge
+    if estado is not None and estado.get('columnas') != list(COLUMNAS_EXTRACT):
+        estado = None
+    inicio = time.perf_counter()
+
+    conn = conectar()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_ESTADO)
+            filas, max_updated_at = cur.fetchone()
+
+        if estado is not None and estado['firma'] == firma(filas, max_updated_at):
+            df = snapshot.leer()
+            print(f"   ⚡ Caché vigente: {len(df):,} filas ({time.perf_counter() - inicio:.2f} s)")
+            return df
+
+        df = None
+        if estado is not None and estado['max_updated_at'] is not None:
+            # >= y no >: filas actualizadas en el mismo instante que el snapshot
+            with conn.cursor() as cur:
+                consulta = cur.mogrify(
+                    SQL_EXTRACT + " AND f.updated_at >= %s::timestamp", (estado['max_updated_at'],)
+                ).decode()
+            cambios = leer_copy(consulta, COLUMNAS_EXTRACT, conn=conn)
+            df = combinar_cambios(snapshot.leer(), cambios)
+
+            if len(df) != filas:
+                ids = leer_copy(f"SELECT f.id::int4 FROM public.fenomenos_naturales f WHERE {FILTRO}",
+                                {'id': 'int4'}, conn=conn)
+                df = df[df['id'].isin(ids['id'])].reset_index(drop=True)
+            if len(df) == filas:
+                print(f"   🔄 Caché actualizada: {len(cambios):,} filas nuevas o modificadas")
+            else:
+                df = None
+
+        if df is None:
+            df = leer_copy(SQL_EXTRACT, COLUMNAS_EXTRACT, conn=conn, progreso=progreso)
+            if progreso is not None:
+                print()
+            print(f"   📥 Extracción completa: {len(df):,} filas")
+    finally:
+        conn.close()
+
+    snapshot.guardar(df, filas, max_updated_at)
+    print(f"   💾 Snapshot: {snapshot.datos_path} ({time.perf_counter() - inicio:.2f} s)")
+    return df
@@ -4,13 +4,18 @@ Dataset ID: 57sv-p2fu
 Fuente: datos.gov.co (Socrata SODA API)
 """
 
-import requests
 import pandas as pd
-from typing import Optional, List, Dict
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Tuple
 import os
 from dotenv import load_dotenv
 import logging
 
+from socrata_client import SocrataClient, SocrataError
+from soql import SOQL_LIMITE_AGREGADO, ConsultaSoQL, condicion
+from watermarks import MODO_INCREMENTAL, WatermarkStore, guardar_csv
+from parquet_sink import RAW_DIR, TIPOS_ESTACIONES, extraer_a_parquet
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -21,6 +26,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Columnas que describen la estación (el resto son de cada observación)
+COLUMNAS_ESTACION = [
+    'codigoestacion', 'nombreestacion', 'departamento', 'municipio',
+    'zonahidrografica', 'latitud', 'longitud', 'entidad'
+]
+
+# Días sin observaciones después de los cuales una estación se considera inactiva
+ESTACIONES_DIAS_ACTIVA = int(os.getenv('ESTACIONES_DIAS_ACTIVA', '30'))
+
 
 class EstacionesIDEAMExtractor:
     """
@@ -31,99 +45,90 @@ class EstacionesIDEAMExtractor:
     - Filtrado por tipo de estación
     - Filtrado por estado (activa/inactiva)
     - Validación de coordenadas geográficas
+    - Extracción incremental de observaciones por fechaobservacion (marca de agua)
+    - Extracción por páginas directo a Parquet con columnas tipadas
+    - Estadísticas por municipio agregadas en el servidor (SoQL $group) con caché local
     - Exportación a CSV y GeoJSON
     """
     
-    def __init__(self, app_token: Optional[str] = None):
+    def __init__(
+        self,
+        app_token: Optional[str] = None,
+        client: Optional[SocrataClient] = None,
+        watermarks: Optional[WatermarkStore] = None
+    ):
         """
         Inicializa el extractor.
         
         Args:
             app_token: Token de aplicación de Socrata (opcional)
+            client: Cliente Socrata a compartir con otros extractores (opcional)
+            watermarks: Estado de extracción incremental (default: datasets/raw/watermarks.json)
         """
         # Configuración
-        self.base_url = os.getenv('SOCRATA_BASE_URL', 'https://www.datos.gov.co/resource')
         self.dataset_id = os.getenv('ESTACIONES_DATASET_ID', '57sv-p2fu')
-        self.endpoint = f"{self.base_url}/{self.dataset_id}.json"
-        
-        # Token de autenticación
-        self.app_token = app_token or os.getenv('SOCRATA_APP_TOKEN')
         
-        # Headers
-        self.headers = {}
-        if self.app_token:
-            self.headers['X-App-Token'] = self.app_token
-            logger.info("✅ Usando App Token para autenticación")
-        else:
-            logger.warning("⚠️  No se encontró App Token. Límite: 100 requests/hora")
-        
-        # Estadísticas
-        self.total_requests = 0
-        self.total_records = 0
+        # Cliente compartido: sesión con pool de conexiones, reintentos con
+        # backoff y contadores de requests/registros/tiempos
+        self.client = client or SocrataClient(app_token)
+        self.app_token = self.client.app_token
+        self.endpoint = self.client.endpoint(self.dataset_id)
+        self.watermarks = watermarks or WatermarkStore()
     
     def _make_request(self, params: Dict) -> Optional[List[Dict]]:
         """
-        Realiza una petición a la API con manejo de errores.
+        Realiza una petición a la API con reintentos (ver SocrataClient).
         
         Args:
             params: Parámetros de la consulta
             
         Returns:
-            Lista de registros o None si hay error
+            Lista de registros o None si falla después de los reintentos
         """
         try:
-            self.total_requests += 1
-            
-            response = requests.get(
-                self.endpoint,
-                params=params,
-                headers=self.headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.total_records += len(data)
-                return data
-            else:
-                logger.error(f"❌ Error API: Status {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return None
-                
-        except requests.exceptions.Timeout:
-            logger.error("❌ Timeout en la petición")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Error de conexión: {e}")
+            return self.client.get(self.dataset_id, params)
+        except (SocrataError, ValueError) as e:
+            logger.error(f"❌ {e}")
             return None
-        except Exception as e:
-            logger.error(f"❌ Error inesperado: {e}")
+    
+    def _fetch_all(self, params: Dict, **opciones) -> Optional[List[Dict]]:
+        """
+        Extrae todos los registros de la consulta con paginación concurrente
+        (count(*) primero, páginas en paralelo y orden estable).
+        
+        Args:
+            params: Parámetros de la consulta ($where, $order)
+            **opciones: page_size, max_workers, max_records (ver SocrataClient.iter_pages)
+            
+        Returns:
+            Lista de registros o None si falla después de los reintentos
+        """
+        try:
+            return self.client.get_all(self.dataset_id, params, **opciones)
+        except (SocrataError, ValueError) as e:
+            logger.error(f"❌ {e}")
             return None
     
     def extract_by_departamento(
         self, 
         departamento: str = 'NARIÑO',
-        limit: int = 10000
+        limit: Optional[int] = None
     ) -> pd.DataFrame:
         """
-        Extrae estaciones de un departamento específico.
+        Extrae estaciones de un departamento específico (todas las páginas).
         
         Args:
             departamento: Nombre del departamento
-            limit: Número máximo de registros
+            limit: Número máximo de registros (None = todos)
             
         Returns:
             DataFrame con las estaciones
         """
         logger.info(f"🔄 Extrayendo estaciones de {departamento}...")
         
-        params = {
-            '$where': f"departamento='{departamento.upper()}'",
-            '$limit': limit,
-            '$order': 'municipio'
-        }
+        params = ConsultaSoQL().igual('departamento', departamento.upper()).order('municipio').params()
         
-        data = self._make_request(params)
+        data = self._fetch_all(params, max_records=limit)
         
         if data:
             df = pd.DataFrame(data)
@@ -132,35 +137,75 @@ class EstacionesIDEAMExtractor:
         else:
             return pd.DataFrame()
     
+    def extract_stations(
+        self,
+        departamento: str = 'NARIÑO',
+        sensor: Optional[str] = None,
+        desde: Optional[date] = None,
+        ttl: Optional[float] = None
+    ) -> pd.DataFrame:
+        """
+        Extrae una fila por estación, agrupada en el servidor ($group por las
+        columnas de estación): no descarga las observaciones.
+        
+        Args:
+            departamento: Nombre del departamento
+            sensor: Texto a buscar en descripcionsensor (ej: 'PRECIPITACION')
+            desde: Considerar solo observaciones desde esta fecha
+            ttl: Segundos de validez de la caché (None = SOQL_CACHE_TTL, 0 = sin caché)
+            
+        Returns:
+            DataFrame con las columnas de estación, observaciones y
+            primera/última observación
+        """
+        consulta = (ConsultaSoQL()
+                    .select(*COLUMNAS_ESTACION)
+                    .contar('observaciones')
+                    .minimo('fechaobservacion', 'primera_observacion')
+                    .maximo('fechaobservacion', 'ultima_observacion')
+                    .igual('departamento', departamento.upper()))
+        if sensor:
+            consulta.contiene('descripcionsensor', sensor.upper())
+        if desde is not None:
+            consulta.where('fechaobservacion', '>=', desde)
+        consulta.group(*COLUMNAS_ESTACION).order('codigoestacion').limit(SOQL_LIMITE_AGREGADO)
+        
+        try:
+            data = self.client.get_cached(self.dataset_id, consulta.params(), ttl)
+        except SocrataError as e:
+            logger.error(f"❌ {e}")
+            return pd.DataFrame()
+        
+        if not data:
+            return pd.DataFrame()
+        
+        # Una estación con atributos distintos entre registros sale en varias filas
+        df = pd.DataFrame(data).drop_duplicates(subset=['codigoestacion']).reset_index(drop=True)
+        df['observaciones'] = pd.to_numeric(df['observaciones']).astype('int64')
+        return df
+    
     def extract_active_stations(
         self, 
-        departamento: str = 'NARIÑO'
+        departamento: str = 'NARIÑO',
+        dias: int = ESTACIONES_DIAS_ACTIVA
     ) -> pd.DataFrame:
         """
-        Extrae solo estaciones activas de un departamento.
+        Extrae solo estaciones activas de un departamento: las que tienen
+        observaciones en los últimos `dias` días (filtrado en el servidor).
         
         Args:
             departamento: Nombre del departamento
+            dias: Días hacia atrás desde hoy
             
         Returns:
             DataFrame con estaciones activas
         """
         logger.info(f"🔄 Extrayendo estaciones activas de {departamento}...")
         
-        # Primero extraer todas
-        df_all = self.extract_by_departamento(departamento)
-        
-        if df_all.empty:
-            return pd.DataFrame()
-        
-        # Filtrar por estado si existe la columna
-        if 'estado' in df_all.columns:
-            df_active = df_all[df_all['estado'].str.upper() == 'ACTIVA']
-            logger.info(f"✅ {len(df_active)} estaciones activas encontradas")
-            return df_active
-        else:
-            logger.warning("⚠️  Columna 'estado' no encontrada, retornando todas")
-            return df_all
+        # Corte redondeado al día: la consulta (y su caché) no cambia en el día
+        df_active = self.extract_stations(departamento, desde=date.today() - timedelta(days=dias))
+        logger.info(f"✅ {len(df_active)} estaciones activas encontradas")
+        return df_active
     
     def extract_by_municipio(
         self, 
@@ -179,12 +224,13 @@ class EstacionesIDEAMExtractor:
         """
         logger.info(f"🔄 Extrayendo estaciones de {municipio}, {departamento}...")
         
-        params = {
-            '$where': f"departamento='{departamento.upper()}' AND municipio='{municipio.upper()}'",
-            '$order': 'nombreestacion'
-        }
+        params = (ConsultaSoQL()
+                  .igual('departamento', departamento.upper())
+                  .igual('municipio', municipio.upper())
+                  .order('nombreestacion')
+                  .params())
         
-        data = self._make_request(params)
+        data = self._fetch_all(params)
         
         if data:
             df = pd.DataFrame(data)
@@ -199,10 +245,13 @@ class EstacionesIDEAMExtractor:
         departamento: str = 'NARIÑO'
     ) -> pd.DataFrame:
         """
-        Extrae estaciones por tipo.
+        Extrae estaciones por tipo de sensor.
+        
+        El dataset de observaciones no tiene columna de tipo de estación: se
+        filtra en el servidor por descripcionsensor y se agrupa por estación.
         
         Args:
-            tipo_estacion: Tipo de estación (ej: 'METEOROLOGICA', 'HIDROMETRICA')
+            tipo_estacion: Texto del sensor (ej: 'PRECIPITACION', 'NIVEL', 'TEMPERATURA')
             departamento: Nombre del departamento
             
         Returns:
@@ -210,20 +259,9 @@ class EstacionesIDEAMExtractor:
         """
         logger.info(f"🔄 Extrayendo estaciones tipo {tipo_estacion}...")
         
-        # Extraer todas del departamento
-        df_all = self.extract_by_departamento(departamento)
-        
-        if df_all.empty:
-            return pd.DataFrame()
-        
-        # Filtrar por tipo si existe la columna
-        if 'tipo' in df_all.columns:
-            df_tipo = df_all[df_all['tipo'].str.upper().str.contains(tipo_estacion.upper(), na=False)]
-            logger.info(f"✅ {len(df_tipo)} estaciones tipo {tipo_estacion}")
-            return df_tipo
-        else:
-            logger.warning("⚠️  Columna 'tipo' no encontrada")
-            return pd.DataFrame()
+        df_tipo = self.extract_stations(departamento, sensor=tipo_estacion)
+        logger.info(f"✅ {len(df_tipo)} estaciones tipo {tipo_estacion}")
+        return df_tipo
     
     def validate_coordinates(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -269,32 +307,171 @@ class EstacionesIDEAMExtractor:
     
     def get_estadisticas_por_municipio(
         self, 
-        departamento: str = 'NARIÑO'
+        departamento: str = 'NARIÑO',
+        ttl: Optional[float] = None
     ) -> pd.DataFrame:
         """
         Obtiene estadísticas de estaciones por municipio.
         
+        El servidor agrupa por municipio y estación (count, min y max de
+        fechaobservacion); solo esas filas, una por estación, se descargan.
+        
         Args:
             departamento: Nombre del departamento
+            ttl: Segundos de validez de la caché (None = SOQL_CACHE_TTL, 0 = sin caché)
             
         Returns:
-            DataFrame con conteo por municipio
+            DataFrame con estaciones, observaciones y primera/última
+            observación por municipio
         """
         logger.info("🔄 Obteniendo estadísticas por municipio...")
         
-        df = self.extract_by_departamento(departamento)
+        consulta = (ConsultaSoQL()
+                    .select('municipio', 'codigoestacion')
+                    .contar('observaciones')
+                    .minimo('fechaobservacion', 'primera_observacion')
+                    .maximo('fechaobservacion', 'ultima_observacion')
+                    .igual('departamento', departamento.upper())
+                    .group('municipio', 'codigoestacion')
+                    .limit(SOQL_LIMITE_AGREGADO))
+        try:
+            data = self.client.get_cached(self.dataset_id, consulta.params(), ttl)
+        except SocrataError as e:
+            logger.error(f"❌ {e}")
+            return pd.DataFrame()
         
-        if df.empty:
+        if not data:
             return pd.DataFrame()
         
-        # Agrupar por municipio
-        stats = df.groupby('municipio').size().reset_index(name='total_estaciones')
+        por_estacion = pd.DataFrame(data)
+        por_estacion['observaciones'] = pd.to_numeric(por_estacion['observaciones']).astype('int64')
+        
+        stats = por_estacion.groupby('municipio').agg(
+            total_estaciones=('codigoestacion', 'nunique'),
+            total_observaciones=('observaciones', 'sum'),
+            primera_observacion=('primera_observacion', 'min'),
+            ultima_observacion=('ultima_observacion', 'max')
+        ).reset_index()
+        for columna in ('primera_observacion', 'ultima_observacion'):
+            stats[columna] = pd.to_datetime(stats[columna], errors='coerce', format='ISO8601')
         stats = stats.sort_values('total_estaciones', ascending=False)
         
         logger.info(f"✅ Estadísticas de {len(stats)} municipios")
         
         return stats
     
+    def _clave_marca(self, departamento: str) -> str:
+        return f"{self.dataset_id}:{departamento.upper()}"
+    
+    def extract_incremental(
+        self,
+        departamento: str = 'NARIÑO',
+        full_reconcile: bool = False
+    ) -> Tuple[pd.DataFrame, str]:
+        """
+        Extrae solo las observaciones nuevas desde la última carga
+        (fechaobservacion) de un departamento.
+        
+        Sin marca de agua, con full_reconcile o cada ETL_RECONCILIACION_DIAS
+        días hace una extracción completa para recoger ediciones tardías.
+        
+        Args:
+            departamento: Nombre del departamento
+            full_reconcile: Forzar extracción completa
+            
+        Returns:
+            (DataFrame con los registros nuevos, modo 'completa' o 'incremental')
+            
+        Raises:
+            SocrataError: Si la extracción falla (la marca no avanza)
+        """
+        clave = self._clave_marca(departamento)
+        modo = self.watermarks.modo(clave, full_reconcile)
+        where = condicion('departamento', '=', departamento.upper())
+        if modo == MODO_INCREMENTAL:
+            where = self.watermarks.filtro(clave, where)
+        logger.info(f"🔄 Extracción {modo} de observaciones de {departamento} ({where})...")
+        
+        df = pd.DataFrame(self.client.get_all(self.dataset_id, {'$where': where, '$order': 'fechaobservacion'}))
+        if modo == MODO_INCREMENTAL:
+            df = self.watermarks.filtrar_nuevos(clave, df)
+        
+        logger.info(f"✅ {len(df)} observaciones nuevas ({modo})")
+        return df, modo
+    
+    def save_incremental(
+        self,
+        df: pd.DataFrame,
+        filename: str,
+        modo: str,
+        departamento: str = 'NARIÑO',
+        extraido: Optional[pd.DataFrame] = None
+    ) -> str:
+        """
+        Guarda el resultado de extract_incremental y avanza la marca de agua.
+        
+        Args:
+            df: Registros a guardar (p.ej. ya validados)
+            filename: Nombre del archivo (sin extensión)
+            modo: 'completa' reemplaza el CSV, 'incremental' agrega filas
+            departamento: Departamento de la extracción
+            extraido: Registros tal como llegaron de la API, sin filtrar ni convertir
+                      (para la marca; default: df)
+            
+        Returns:
+            Ruta del archivo guardado
+        """
+        output_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw')
+        filepath = guardar_csv(df, os.path.join(output_dir, f"{filename}.csv"), modo)
+        self.watermarks.actualizar(
+            self._clave_marca(departamento), 'fechaobservacion',
+            df if extraido is None else extraido, modo
+        )
+        
+        logger.info(f"💾 Guardado en: {filepath}")
+        return filepath
+    
+    @staticmethod
+    def nombre_salida(departamento: str) -> str:
+        """Nombre base de los archivos del departamento (ej: estaciones_ideam_narino)"""
+        return f"estaciones_ideam_{departamento.lower().replace('ñ', 'n').replace(' ', '_')}"
+    
+    def extract_to_parquet(
+        self,
+        departamento: str = 'NARIÑO',
+        directorio: Optional[str] = None,
+        full_reconcile: bool = False,
+        batch_size: Optional[int] = None
+    ) -> Dict:
+        """
+        Extrae las observaciones página a página directo a un dataset Parquet
+        (incremental por fechaobservacion, como extract_incremental). La
+        memoria queda acotada a las páginas en vuelo.
+        
+        Args:
+            departamento: Nombre del departamento
+            directorio: Directorio del dataset (default: datasets/raw/estaciones_ideam_<departamento>)
+            full_reconcile: Forzar extracción completa
+            batch_size: Registros por página (default: SOCRATA_PAGINA)
+            
+        Returns:
+            Diccionario con modo, registros, archivos y directorio
+        """
+        directorio = directorio or os.path.join(RAW_DIR, self.nombre_salida(departamento))
+        # Marca propia del dataset Parquet (independiente de la del CSV)
+        clave = f"{self._clave_marca(departamento)}@parquet"
+        modo = self.watermarks.modo(clave, full_reconcile)
+        where = condicion('departamento', '=', departamento.upper())
+        if modo == MODO_INCREMENTAL:
+            where = self.watermarks.filtro(clave, where)
+        logger.info(f"🔄 Extracción {modo} de observaciones de {departamento} a Parquet ({where})...")
+        
+        opciones = {'page_size': batch_size} if batch_size else {}
+        return extraer_a_parquet(
+            self.client, self.dataset_id, {'$where': where, '$order': 'fechaobservacion'}, directorio,
+            TIPOS_ESTACIONES, modo, self.watermarks, clave, 'fechaobservacion', **opciones
+        )
+    
     def save_to_csv(self, df: pd.DataFrame, filename: str) -> str:
         """
         Guarda DataFrame a CSV.
@@ -363,50 +540,69 @@ class EstacionesIDEAMExtractor:
         Obtiene estadísticas del extractor.
         
         Returns:
-            Diccionario con estadísticas
+            Diccionario con estadísticas del cliente Socrata (compartidas si el
+            cliente se comparte entre extractores)
         """
-        return {
-            'total_requests': self.total_requests,
-            'total_records': self.total_records,
-            'using_token': bool(self.app_token)
-        }
+        return self.client.get_stats()
 
 
 # Ejemplo de uso
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Extracción incremental de observaciones de estaciones IDEAM")
+    parser.add_argument('--departamento', default='NARIÑO')
+    parser.add_argument('--completa', action='store_true',
+                        help="Extracción completa (reconciliación) aunque exista marca de agua")
+    parser.add_argument('--parquet', action='store_true',
+                        help="Escribir cada página a un dataset Parquet en lugar del CSV")
+    args = parser.parse_args()
+    
     # Crear extractor
     extractor = EstacionesIDEAMExtractor()
     
-    # Extraer estaciones de Nariño
-    df_narino = extractor.extract_by_departamento('NARIÑO')
+    if args.parquet:
+        resultado = extractor.extract_to_parquet(args.departamento, full_reconcile=args.completa)
+        print(f"\n✅ {resultado['registros']} registros ({resultado['modo']}) en {resultado['archivos']} archivos")
+        print(f"📁 {resultado['directorio']}")
+        raise SystemExit(0)
+    
+    # Extraer las observaciones nuevas (o todas si toca reconciliar)
+    df_extraido, modo = extractor.extract_incremental(args.departamento, full_reconcile=args.completa)
+    nombre = extractor.nombre_salida(args.departamento)
     
-    if not df_narino.empty:
-        print("\n" + "="*60)
-        print("📊 RESUMEN DE DATOS EXTRAÍDOS")
-        print("="*60)
-        print(f"\nTotal de estaciones: {len(df_narino)}")
+    print("\n" + "="*60)
+    print(f"📊 RESUMEN DE DATOS EXTRAÍDOS ({modo.upper()})")
+    print("="*60)
+    print(f"\nTotal de registros: {len(df_extraido)}")
+    if not df_extraido.empty:
         print(f"\nColumnas disponibles:")
-        for col in df_narino.columns:
+        for col in df_extraido.columns:
             print(f"  - {col}")
-        
-        # Validar coordenadas
-        df_valid = extractor.validate_coordinates(df_narino)
-        print(f"\n📍 Estaciones con coordenadas válidas: {len(df_valid)}")
-        
+    
+    # Validar coordenadas (sobre una copia: la marca usa los registros tal como llegaron)
+    df_valid = extractor.validate_coordinates(df_extraido.copy())
+    print(f"\n📍 Registros con coordenadas válidas: {len(df_valid)}")
+    
+    # Guardar a CSV (reemplaza o agrega según el modo) y avanzar la marca de agua
+    extractor.save_incremental(df_valid, nombre, modo, args.departamento, extraido=df_extraido)
+    
+    if modo != MODO_INCREMENTAL and not df_valid.empty:
         # Estadísticas por municipio
-        stats = extractor.get_estadisticas_por_municipio()
-        print(f"\n📊 Top 10 municipios con más estaciones:")
+        stats = df_valid.groupby('municipio').size().reset_index(name='total_estaciones')
+        stats = stats.sort_values('total_estaciones', ascending=False)
+        print(f"\n📊 Top 10 municipios con más registros:")
         print(stats.head(10).to_string(index=False))
         
-        # Guardar a CSV
-        extractor.save_to_csv(df_valid, 'estaciones_ideam_narino')
-        
-        # Intentar guardar GeoJSON
-        extractor.save_to_geojson(df_valid, 'estaciones_ideam_narino')
-        
-        # Estadísticas del extractor
-        stats_extractor = extractor.get_stats()
-        print(f"\n📈 Estadísticas del extractor:")
-        print(f"  - Requests realizados: {stats_extractor['total_requests']}")
-        print(f"  - Registros obtenidos: {stats_extractor['total_records']}")
-        print(f"  - Usando token: {'✅ Sí' if stats_extractor['using_token'] else '❌ No'}")
+        # Intentar guardar GeoJSON (solo con el conjunto completo)
+        extractor.save_to_geojson(df_valid, nombre)
+    
+    # Estadísticas del extractor
+    stats_extractor = extractor.get_stats()
+    print(f"\n📈 Estadísticas del extractor:")
+    print(f"  - Requests realizados: {stats_extractor['total_requests']}")
+    print(f"  - Reintentos: {stats_extractor['total_reintentos']} (espera {stats_extractor['segundos_espera']}s)")
+    print(f"  - Registros obtenidos: {stats_extractor['total_records']}")
+    print(f"  - Bytes descargados: {stats_extractor['total_bytes']}")
+    print(f"  - Tiempo en requests: {stats_extractor['segundos_requests']}s (máx {stats_extractor['segundos_max']}s)")
+    print(f"  - Usando token: {'✅ Sí' if stats_extractor['using_token'] else '❌ No'}")
@@ -4,14 +4,18 @@ Dataset ID: i8ar-8tth
 Fuente: datos.gov.co (Socrata SODA API)
 """
 
-import requests
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 import os
 from dotenv import load_dotenv
 import logging
 
+from socrata_client import SocrataClient, SocrataError
+from soql import SOQL_LIMITE_AGREGADO, ConsultaSoQL
+from watermarks import MODO_INCREMENTAL, WatermarkStore, guardar_csv
+from parquet_sink import RAW_DIR, TIPOS_FENOMENOS, extraer_a_parquet
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -30,76 +34,71 @@ class FenomenosNaturalesExtractor:
     Funcionalidades:
     - Extracción completa de fenómenos históricos
     - Filtrado por municipio, tipo de fenómeno, fechas
-    - Paginación automática para datasets grandes
+    - Paginación concurrente para datasets grandes
+    - Extracción incremental por fecha_reporte (marca de agua)
+    - Extracción por páginas directo a Parquet con columnas tipadas
+    - Estadísticas agregadas en el servidor (SoQL $group) con caché local
     - Manejo de errores y reintentos
     - Validación de datos
     """
     
-    def __init__(self, app_token: Optional[str] = None):
+    def __init__(
+        self,
+        app_token: Optional[str] = None,
+        client: Optional[SocrataClient] = None,
+        watermarks: Optional[WatermarkStore] = None
+    ):
         """
         Inicializa el extractor.
         
         Args:
             app_token: Token de aplicación de Socrata (opcional)
                       Si no se proporciona, se intenta leer de .env
+            client: Cliente Socrata a compartir con otros extractores (opcional)
+            watermarks: Estado de extracción incremental (default: datasets/raw/watermarks.json)
         """
         # Configuración
-        self.base_url = os.getenv('SOCRATA_BASE_URL', 'https://www.datos.gov.co/resource')
         self.dataset_id = os.getenv('FENOMENOS_DATASET_ID', 'i8ar-8tth')
-        self.endpoint = f"{self.base_url}/{self.dataset_id}.json"
-        
-        # Token de autenticación
-        self.app_token = app_token or os.getenv('SOCRATA_APP_TOKEN')
-        
-        # Headers
-        self.headers = {}
-        if self.app_token:
-            self.headers['X-App-Token'] = self.app_token
-            logger.info("✅ Usando App Token para autenticación")
-        else:
-            logger.warning("⚠️  No se encontró App Token. Límite: 100 requests/hora")
         
-        # Estadísticas
-        self.total_requests = 0
-        self.total_records = 0
+        # Cliente compartido: sesión con pool de conexiones, reintentos con
+        # backoff y contadores de requests/registros/tiempos
+        self.client = client or SocrataClient(app_token)
+        self.app_token = self.client.app_token
+        self.endpoint = self.client.endpoint(self.dataset_id)
+        self.watermarks = watermarks or WatermarkStore()
     
     def _make_request(self, params: Dict) -> Optional[List[Dict]]:
         """
-        Realiza una petición a la API con manejo de errores.
+        Realiza una petición a la API con reintentos (ver SocrataClient).
         
         Args:
             params: Parámetros de la consulta
             
         Returns:
-            Lista de registros o None si hay error
+            Lista de registros o None si falla después de los reintentos
         """
         try:
-            self.total_requests += 1
-            
-            response = requests.get(
-                self.endpoint,
-                params=params,
-                headers=self.headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.total_records += len(data)
-                return data
-            else:
-                logger.error(f"❌ Error API: Status {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return None
-                
-        except requests.exceptions.Timeout:
-            logger.error("❌ Timeout en la petición")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Error de conexión: {e}")
+            return self.client.get(self.dataset_id, params)
+        except (SocrataError, ValueError) as e:
+            logger.error(f"❌ {e}")
             return None
-        except Exception as e:
-            logger.error(f"❌ Error inesperado: {e}")
+    
+    def _fetch_all(self, params: Dict, **opciones) -> Optional[List[Dict]]:
+        """
+        Extrae todos los registros de la consulta con paginación concurrente
+        (count(*) primero, páginas en paralelo y orden estable).
+        
+        Args:
+            params: Parámetros de la consulta ($where, $order)
+            **opciones: page_size, max_workers, max_records (ver SocrataClient.iter_pages)
+            
+        Returns:
+            Lista de registros o None si falla después de los reintentos
+        """
+        try:
+            return self.client.get_all(self.dataset_id, params, **opciones)
+        except (SocrataError, ValueError) as e:
+            logger.error(f"❌ {e}")
             return None
     
     def extract_all(self, limit: int = 10000) -> pd.DataFrame:
@@ -141,12 +140,9 @@ class FenomenosNaturalesExtractor:
         """
         logger.info(f"🔄 Extrayendo fenómenos de {municipio}...")
         
-        params = {
-            '$where': f"municipio='{municipio.upper()}'",
-            '$order': 'fecha_reporte DESC'
-        }
+        params = ConsultaSoQL().igual('municipio', municipio.upper()).order('fecha_reporte', desc=True).params()
         
-        data = self._make_request(params)
+        data = self._fetch_all(params)
         
         if data:
             df = pd.DataFrame(data)
@@ -168,12 +164,9 @@ class FenomenosNaturalesExtractor:
         """
         logger.info(f"🔄 Extrayendo fenómenos tipo: {tipo_fenomeno}...")
         
-        params = {
-            '$where': f"fen_meno_natural LIKE '%{tipo_fenomeno}%'",
-            '$order': 'fecha_reporte DESC'
-        }
+        params = ConsultaSoQL().contiene('fen_meno_natural', tipo_fenomeno).order('fecha_reporte', desc=True).params()
         
-        data = self._make_request(params)
+        data = self._fetch_all(params)
         
         if data:
             df = pd.DataFrame(data)
@@ -199,12 +192,12 @@ class FenomenosNaturalesExtractor:
         """
         logger.info(f"🔄 Extrayendo fenómenos entre {fecha_inicio} y {fecha_fin}...")
         
-        params = {
-            '$where': f"fecha_reporte >= '{fecha_inicio}T00:00:00' AND fecha_reporte <= '{fecha_fin}T23:59:59'",
-            '$order': 'fecha_reporte DESC'
-        }
+        params = (ConsultaSoQL()
+                  .entre('fecha_reporte', f"{fecha_inicio}T00:00:00", f"{fecha_fin}T23:59:59")
+                  .order('fecha_reporte', desc=True)
+                  .params())
         
-        data = self._make_request(params)
+        data = self._fetch_all(params)
         
         if data:
             df = pd.DataFrame(data)
@@ -231,93 +224,95 @@ class FenomenosNaturalesExtractor:
             fecha_fin.strftime('%Y-%m-%d')
         )
     
-    def get_estadisticas_por_municipio(self) -> pd.DataFrame:
+    def _estadisticas_por(self, campo: str, ttl: Optional[float] = None) -> pd.DataFrame:
         """
-        Obtiene estadísticas agregadas por municipio.
+        Conteo y rango de fechas por `campo`, agrupado en el servidor.
         
+        Args:
+            campo: Columna de agrupación
+            ttl: Segundos de validez de la caché (None = SOQL_CACHE_TTL, 0 = sin caché)
+            
         Returns:
-            DataFrame con conteo de fenómenos por municipio
+            DataFrame con campo, total, primera_fecha y ultima_fecha
         """
-        logger.info("🔄 Obteniendo estadísticas por municipio...")
+        consulta = (ConsultaSoQL()
+                    .select(campo)
+                    .contar('total')
+                    .minimo('fecha_reporte', 'primera_fecha')
+                    .maximo('fecha_reporte', 'ultima_fecha')
+                    .group(campo)
+                    .order('total', desc=True)
+                    .limit(SOQL_LIMITE_AGREGADO))
+        try:
+            data = self.client.get_cached(self.dataset_id, consulta.params(), ttl)
+        except SocrataError as e:
+            logger.error(f"❌ {e}")
+            return pd.DataFrame()
         
-        params = {
-            '$select': 'municipio, count(*) as total',
-            '$group': 'municipio',
-            '$order': 'total DESC'
-        }
+        df = pd.DataFrame(data, columns=[campo, 'total', 'primera_fecha', 'ultima_fecha'])
+        df['total'] = pd.to_numeric(df['total']).astype('int64')
+        for columna in ('primera_fecha', 'ultima_fecha'):
+            df[columna] = pd.to_datetime(df[columna], errors='coerce', format='ISO8601')
+        return df
+    
+    def get_estadisticas_por_municipio(self, ttl: Optional[float] = None) -> pd.DataFrame:
+        """
+        Obtiene estadísticas agregadas por municipio (en el servidor).
         
-        data = self._make_request(params)
+        Args:
+            ttl: Segundos de validez de la caché (None = SOQL_CACHE_TTL, 0 = sin caché)
+            
+        Returns:
+            DataFrame con conteo y primera/última fecha de fenómenos por municipio
+        """
+        logger.info("🔄 Obteniendo estadísticas por municipio...")
         
-        if data:
-            df = pd.DataFrame(data)
+        df = self._estadisticas_por('municipio', ttl)
+        if not df.empty:
             logger.info(f"✅ Estadísticas de {len(df)} municipios")
-            return df
-        else:
-            return pd.DataFrame()
+        return df
     
-    def get_estadisticas_por_tipo(self) -> pd.DataFrame:
+    def get_estadisticas_por_tipo(self, ttl: Optional[float] = None) -> pd.DataFrame:
         """
-        Obtiene estadísticas agregadas por tipo de fenómeno.
+        Obtiene estadísticas agregadas por tipo de fenómeno (en el servidor).
         
+        Args:
+            ttl: Segundos de validez de la caché (None = SOQL_CACHE_TTL, 0 = sin caché)
+            
         Returns:
-            DataFrame con conteo de fenómenos por tipo
+            DataFrame con conteo y primera/última fecha de fenómenos por tipo
         """
         logger.info("🔄 Obteniendo estadísticas por tipo de fenómeno...")
         
-        params = {
-            '$select': 'fen_meno_natural, count(*) as total',
-            '$group': 'fen_meno_natural',
-            '$order': 'total DESC'
-        }
-        
-        data = self._make_request(params)
-        
-        if data:
-            df = pd.DataFrame(data)
+        df = self._estadisticas_por('fen_meno_natural', ttl)
+        if not df.empty:
             logger.info(f"✅ Estadísticas de {len(df)} tipos de fenómenos")
-            return df
-        else:
-            return pd.DataFrame()
+        return df
     
     def extract_with_pagination(
         self, 
         batch_size: int = 1000,
-        max_records: int = 10000
+        max_records: Optional[int] = None,
+        max_workers: Optional[int] = None
     ) -> pd.DataFrame:
         """
-        Extrae datos con paginación para datasets grandes.
+        Extrae datos con paginación concurrente para datasets grandes.
         
         Args:
             batch_size: Tamaño de cada lote
-            max_records: Máximo de registros a extraer
+            max_records: Máximo de registros a extraer (None = todos)
+            max_workers: Lotes descargándose a la vez (default: SOCRATA_CONCURRENCIA)
             
         Returns:
-            DataFrame con todos los registros
+            DataFrame con todos los registros, en orden estable
         """
         logger.info(f"🔄 Extrayendo con paginación (lotes de {batch_size})...")
         
-        all_data = []
-        offset = 0
+        opciones = {'page_size': batch_size, 'max_records': max_records}
+        if max_workers is not None:
+            opciones['max_workers'] = max_workers
         
-        while offset < max_records:
-            params = {
-                '$limit': batch_size,
-                '$offset': offset,
-                '$order': 'fecha_reporte DESC'
-            }
-            
-            data = self._make_request(params)
-            
-            if not data or len(data) == 0:
-                break
-            
-            all_data.extend(data)
-            offset += batch_size
-            
-            logger.info(f"  📦 Lote {offset // batch_size}: {len(data)} registros")
-            
-            if len(data) < batch_size:
-                break
+        all_data = self._fetch_all({'$order': 'fecha_reporte DESC'}, **opciones)
         
         if all_data:
             df = pd.DataFrame(all_data)
@@ -326,6 +321,87 @@ class FenomenosNaturalesExtractor:
         else:
             return pd.DataFrame()
     
+    def extract_incremental(self, full_reconcile: bool = False) -> Tuple[pd.DataFrame, str]:
+        """
+        Extrae solo los fenómenos nuevos desde la última carga (fecha_reporte).
+        
+        Sin marca de agua, con full_reconcile o cada ETL_RECONCILIACION_DIAS
+        días hace una extracción completa para recoger ediciones tardías.
+        
+        Args:
+            full_reconcile: Forzar extracción completa
+            
+        Returns:
+            (DataFrame con los registros nuevos, modo 'completa' o 'incremental')
+            
+        Raises:
+            SocrataError: Si la extracción falla (la marca no avanza)
+        """
+        modo = self.watermarks.modo(self.dataset_id, full_reconcile)
+        params = {'$order': 'fecha_reporte'}
+        if modo == MODO_INCREMENTAL:
+            params['$where'] = self.watermarks.filtro(self.dataset_id)
+        logger.info(f"🔄 Extracción {modo} de fenómenos ({params.get('$where', 'todo el histórico')})...")
+        
+        df = pd.DataFrame(self.client.get_all(self.dataset_id, params))
+        if modo == MODO_INCREMENTAL:
+            df = self.watermarks.filtrar_nuevos(self.dataset_id, df)
+        
+        logger.info(f"✅ {len(df)} fenómenos nuevos ({modo})")
+        return df, modo
+    
+    def save_incremental(self, df: pd.DataFrame, filename: str, modo: str) -> str:
+        """
+        Guarda el resultado de extract_incremental y avanza la marca de agua.
+        
+        Args:
+            df: Registros extraídos
+            filename: Nombre del archivo (sin extensión)
+            modo: 'completa' reemplaza el CSV, 'incremental' agrega filas
+            
+        Returns:
+            Ruta del archivo guardado
+        """
+        output_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw')
+        filepath = guardar_csv(df, os.path.join(output_dir, f"{filename}.csv"), modo)
+        self.watermarks.actualizar(self.dataset_id, 'fecha_reporte', df, modo)
+        
+        logger.info(f"💾 Guardado en: {filepath}")
+        return filepath
+    
+    def extract_to_parquet(
+        self,
+        directorio: Optional[str] = None,
+        full_reconcile: bool = False,
+        batch_size: Optional[int] = None
+    ) -> Dict:
+        """
+        Extrae los fenómenos página a página directo a un dataset Parquet
+        (incremental por fecha_reporte, como extract_incremental).
+        
+        Args:
+            directorio: Directorio del dataset (default: datasets/raw/fenomenos_naturales_narino)
+            full_reconcile: Forzar extracción completa
+            batch_size: Registros por página (default: SOCRATA_PAGINA)
+            
+        Returns:
+            Diccionario con modo, registros, archivos y directorio
+        """
+        directorio = directorio or os.path.join(RAW_DIR, 'fenomenos_naturales_narino')
+        # Marca propia del dataset Parquet (independiente de la del CSV)
+        clave = f"{self.dataset_id}@parquet"
+        modo = self.watermarks.modo(clave, full_reconcile)
+        params = {'$order': 'fecha_reporte'}
+        if modo == MODO_INCREMENTAL:
+            params['$where'] = self.watermarks.filtro(clave)
+        logger.info(f"🔄 Extracción {modo} de fenómenos a Parquet ({params.get('$where', 'todo el histórico')})...")
+        
+        opciones = {'page_size': batch_size} if batch_size else {}
+        return extraer_a_parquet(
+            self.client, self.dataset_id, params, directorio, TIPOS_FENOMENOS, modo,
+            self.watermarks, clave, 'fecha_reporte', **opciones
+        )
+    
     def save_to_csv(self, df: pd.DataFrame, filename: str) -> str:
         """
         Guarda DataFrame a CSV.
@@ -351,41 +427,56 @@ class FenomenosNaturalesExtractor:
         Obtiene estadísticas del extractor.
         
         Returns:
-            Diccionario con estadísticas
+            Diccionario con estadísticas del cliente Socrata (compartidas si el
+            cliente se comparte entre extractores)
         """
-        return {
-            'total_requests': self.total_requests,
-            'total_records': self.total_records,
-            'using_token': bool(self.app_token)
-        }
+        return self.client.get_stats()
 
 
 # Ejemplo de uso
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Extracción incremental de fenómenos naturales")
+    parser.add_argument('--completa', action='store_true',
+                        help="Extracción completa (reconciliación) aunque exista marca de agua")
+    parser.add_argument('--parquet', action='store_true',
+                        help="Escribir cada página a un dataset Parquet en lugar del CSV")
+    args = parser.parse_args()
+    
     # Crear extractor
     extractor = FenomenosNaturalesExtractor()
     
-    # Extraer todos los fenómenos
-    df_all = extractor.extract_all()
+    if args.parquet:
+        resultado = extractor.extract_to_parquet(full_reconcile=args.completa)
+        print(f"\n✅ {resultado['registros']} registros ({resultado['modo']}) en {resultado['archivos']} archivos")
+        print(f"📁 {resultado['directorio']}")
+        raise SystemExit(0)
+    
+    # Extraer los fenómenos nuevos (o todos si toca reconciliar)
+    df_all, modo = extractor.extract_incremental(full_reconcile=args.completa)
     
+    print("\n" + "="*60)
+    print(f"📊 RESUMEN DE DATOS EXTRAÍDOS ({modo.upper()})")
+    print("="*60)
+    print(f"\nTotal de registros: {len(df_all)}")
     if not df_all.empty:
-        print("\n" + "="*60)
-        print("📊 RESUMEN DE DATOS EXTRAÍDOS")
-        print("="*60)
-        print(f"\nTotal de registros: {len(df_all)}")
         print(f"\nColumnas disponibles:")
         for col in df_all.columns:
             print(f"  - {col}")
         
         print(f"\n📍 Primeros 5 registros:")
         print(df_all.head())
-        
-        # Guardar a CSV
-        extractor.save_to_csv(df_all, 'fenomenos_naturales_narino')
-        
-        # Estadísticas
-        stats = extractor.get_stats()
-        print(f"\n📈 Estadísticas del extractor:")
-        print(f"  - Requests realizados: {stats['total_requests']}")
-        print(f"  - Registros obtenidos: {stats['total_records']}")
-        print(f"  - Usando token: {'✅ Sí' if stats['using_token'] else '❌ No'}")
+    
+    # Guardar a CSV y avanzar la marca de agua
+    extractor.save_incremental(df_all, 'fenomenos_naturales_narino', modo)
+    
+    # Estadísticas
+    stats = extractor.get_stats()
+    print(f"\n📈 Estadísticas del extractor:")
+    print(f"  - Requests realizados: {stats['total_requests']}")
+    print(f"  - Reintentos: {stats['total_reintentos']} (espera {stats['segundos_espera']}s)")
+    print(f"  - Registros obtenidos: {stats['total_records']}")
+    print(f"  - Bytes descargados: {stats['total_bytes']}")
+    print(f"  - Tiempo en requests: {stats['segundos_requests']}s (máx {stats['segundos_max']}s)")
+    print(f"  - Usando token: {'✅ Sí' if stats['using_token'] else '❌ No'}")
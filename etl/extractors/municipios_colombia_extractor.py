@@ -4,7 +4,6 @@ Dataset ID: gdxc-w37w (Municipios de Colombia)
 Fuente: datos.gov.co (Socrata SODA API)
 """
 
-import requests
 import json
 from pathlib import Path
 import logging
@@ -12,6 +11,8 @@ from typing import Optional, List, Dict
 import os
 from dotenv import load_dotenv
 
+from socrata_client import SocrataClient, SocrataError
+
 load_dotenv()
 
 logging.basicConfig(
@@ -27,56 +28,27 @@ class MunicipiosColombiaExtractor:
     Compatible con la estructura existente de la BD.
     """
     
-    def __init__(self, app_token: Optional[str] = None):
+    def __init__(self, app_token: Optional[str] = None, client: Optional[SocrataClient] = None):
         self.output_dir = Path(__file__).parent.parent.parent / 'datasets' / 'raw' / 'municipios'
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Configuración API
-        self.base_url = os.getenv('SOCRATA_BASE_URL', 'https://www.datos.gov.co/resource')
+        # Configuración
         self.dataset_id = 'gdxc-w37w'  # Municipios de Colombia
-        self.endpoint = f"{self.base_url}/{self.dataset_id}.json"
-        
-        # Token de autenticación
-        self.app_token = app_token or os.getenv('SOCRATA_APP_TOKEN')
-        
-        # Headers
-        self.headers = {}
-        if self.app_token:
-            self.headers['X-App-Token'] = self.app_token
-            logger.info("✅ Usando App Token para autenticación")
-        else:
-            logger.warning("⚠️  Sin App Token. Límite: 100 requests/hora")
         
-        self.total_requests = 0
-        self.total_records = 0
+        # Cliente compartido: sesión con pool de conexiones, reintentos con
+        # backoff y contadores de requests/registros/tiempos
+        self.client = client or SocrataClient(app_token)
+        self.app_token = self.client.app_token
+        self.endpoint = self.client.endpoint(self.dataset_id)
     
     def _make_request(self, params: Dict) -> Optional[List[Dict]]:
         """
-        Realiza petición a la API con manejo de errores.
+        Realiza petición a la API con reintentos (ver SocrataClient).
         """
         try:
-            self.total_requests += 1
-            
-            response = requests.get(
-                self.endpoint,
-                params=params,
-                headers=self.headers,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.total_records += len(data)
-                return data
-            else:
-                logger.error(f"❌ Error HTTP {response.status_code}: {response.text}")
-                return None
-                
-        except requests.exceptions.Timeout:
-            logger.error("❌ Timeout en la petición")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Error en petición: {e}")
+            return self.client.get(self.dataset_id, params, timeout=60)
+        except (SocrataError, ValueError) as e:
+            logger.error(f"❌ {e}")
             return None
     
     def extract_municipios_narino(self) -> bool:
@@ -132,8 +104,9 @@ class MunicipiosColombiaExtractor:
             logger.info("=" * 70)
             logger.info("✅ EXTRACCIÓN COMPLETADA")
             logger.info("=" * 70)
-            logger.info(f"📊 Total requests: {self.total_requests}")
-            logger.info(f"📊 Total registros: {self.total_records}")
+            stats = self.client.get_stats()
+            logger.info(f"📊 Total requests: {stats['total_requests']} ({stats['total_reintentos']} reintentos)")
+            logger.info(f"📊 Total registros: {stats['total_records']}")
             logger.info(f"📁 Archivo: {output_file.name}")
             logger.info("\n📋 Próximo paso:")
             logger.info("   cd ..")
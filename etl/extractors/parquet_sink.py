@@ -0,0 +1,248 @@
+"""
+Extracción de Socrata directo a disco en Parquet
+
+Cada página de la API se convierte a una tabla Arrow con tipos (float para
+coordenadas y valores, timestamp para fechas, texto para códigos) y se
+escribe como un archivo de un dataset Parquet. La memoria queda acotada a las
+páginas en vuelo, sin importar el tamaño del dataset (las observaciones de
+estaciones crecen a decenas de millones de filas).
+
+Estructura en disco (un directorio por dataset):
+    datasets/raw/estaciones_ideam_narino/part-<lote>-00000.parquet
+    datasets/raw/estaciones_ideam_narino/part-<lote>-00001.parquet
+    ...
+
+Socrata omite en cada registro los campos nulos, así que una columna puede
+no aparecer en las primeras páginas: el esquema se amplía (como texto) cuando
+llega una columna nueva y los archivos anteriores la leen como nula (los
+lectores unifican el esquema de todos los archivos, ver esquema_dataset).
+
+Una extracción completa escribe en un directorio temporal y lo reemplaza al
+terminar; una incremental agrega archivos del nuevo lote. Si la extracción
+falla, se borran los archivos del lote y la marca de agua no avanza.
+"""
+
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from socrata_client import SocrataClient
+from watermarks import MODO_COMPLETO, MODO_INCREMENTAL, WatermarkStore, filas_en_maximo
+
+logger = logging.getLogger(__name__)
+
+RAW_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw')
+
+PARQUET_COMPRESION = os.getenv('PARQUET_COMPRESION', 'zstd')
+
+# Tipos por columna; las que no aparecen se guardan como texto (así los
+# códigos con ceros a la izquierda, como codigoestacion, no se pierden)
+TIPOS_FENOMENOS = {
+    'latitud': pa.float64(),
+    'longitud': pa.float64(),
+    'altura': pa.float64(),
+    'coordenada_x': pa.float64(),
+    'coordenada_y': pa.float64(),
+    'fecha_reporte': pa.timestamp('ms'),
+    'enlace_a_reporte': pa.struct([('url', pa.string()), ('description', pa.string())])
+}
+
+TIPOS_ESTACIONES = {
+    'fechaobservacion': pa.timestamp('ms'),
+    'valorobservado': pa.float64(),
+    'latitud': pa.float64(),
+    'longitud': pa.float64()
+}
+
+
+def esquema(columnas: Iterable[str], tipos: Dict[str, pa.DataType]) -> pa.Schema:
+    """Esquema con las columnas tipadas primero y el resto como texto, en orden estable"""
+    columnas = list(columnas)
+    return pa.schema(
+        [pa.field(c, t) for c, t in tipos.items()]
+        + [pa.field(c, pa.string()) for c in sorted(columnas) if c not in tipos]
+    )
+
+
+def ampliar_esquema(schema: pa.Schema, columnas: Iterable[str]) -> pa.Schema:
+    """Agrega al final (como texto, en orden estable) las columnas que el esquema no tiene"""
+    nuevas = sorted(set(columnas) - set(schema.names))
+    return pa.schema(list(schema) + [pa.field(c, pa.string()) for c in nuevas])
+
+
+def esquema_dataset(directorio: str) -> Optional[pa.Schema]:
+    """Esquema unificado de los archivos Parquet del directorio (None si no hay)"""
+    archivos = sorted(f for f in os.listdir(directorio) if f.endswith('.parquet')) \
+        if os.path.isdir(directorio) else []
+    if not archivos:
+        return None
+    return pa.unify_schemas([pq.read_schema(os.path.join(directorio, f)) for f in archivos])
+
+
+def columna_arrow(valores: pd.Series, tipo: pa.DataType) -> pa.Array:
+    """Convierte una columna de la API (texto) al tipo Arrow; los valores inválidos quedan nulos"""
+    if pa.types.is_floating(tipo):
+        return pa.array(pd.to_numeric(valores, errors='coerce'), type=tipo, from_pandas=True)
+    if pa.types.is_timestamp(tipo):
+        fechas = pd.to_datetime(valores, errors='coerce', format='ISO8601')
+        return pa.array(fechas, type=tipo, from_pandas=True)
+    if pa.types.is_struct(tipo):
+        return pa.array([v if isinstance(v, dict) else None for v in valores], type=tipo)
+    try:
+        return pa.array(valores, type=tipo, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Objetos anidados que no están en TIPOS: se guardan como JSON
+        return pa.array(
+            [json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else
+             (None if v is None or (isinstance(v, float) and pd.isna(v)) else str(v)) for v in valores],
+            type=tipo
+        )
+
+
+def tabla_pagina(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """Tabla Arrow de una página con el esquema del dataset (columnas faltantes en nulo)"""
+    return pa.Table.from_arrays(
+        [columna_arrow(df[f.name], f.type) if f.name in df.columns else pa.nulls(len(df), f.type)
+         for f in schema],
+        schema=schema
+    )
+
+
+class EscritorParquet:
+    """
+    Escribe páginas como archivos de un dataset Parquet.
+
+        with EscritorParquet(directorio, TIPOS_ESTACIONES, modo) as escritor:
+            for pagina in ...:
+                escritor.escribir(pd.DataFrame(pagina))
+    """
+
+    def __init__(self, directorio: str, tipos: Dict[str, pa.DataType], modo: str = MODO_COMPLETO):
+        self.directorio = os.path.abspath(directorio)
+        self.tipos = tipos
+        self.modo = modo
+        self.lote = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        self.schema: Optional[pa.Schema] = None
+        self.archivos: List[str] = []
+        self.filas = 0
+
+        if modo == MODO_COMPLETO:
+            self._destino = f"{self.directorio}.tmp-{self.lote}"
+        else:
+            self._destino = self.directorio
+            # Los archivos nuevos parten del esquema de los existentes
+            self.schema = esquema_dataset(self.directorio)
+        os.makedirs(self._destino, exist_ok=True)
+
+    def escribir(self, df: pd.DataFrame) -> int:
+        """Escribe una página como un archivo; devuelve las filas escritas"""
+        if df.empty:
+            return 0
+        if self.schema is None:
+            self.schema = esquema(df.columns, self.tipos)
+        elif not set(df.columns) <= set(self.schema.names):
+            # Columna que no venía en las páginas anteriores (nula en ellas)
+            nuevas = sorted(set(df.columns) - set(self.schema.names))
+            self.schema = ampliar_esquema(self.schema, nuevas)
+            logger.info(f"➕ Columnas nuevas en el esquema: {nuevas}")
+
+        path = os.path.join(self._destino, f"part-{self.lote}-{len(self.archivos):05d}.parquet")
+        pq.write_table(tabla_pagina(df, self.schema), path, compression=PARQUET_COMPRESION)
+        self.archivos.append(path)
+        self.filas += len(df)
+        return len(df)
+
+    def cerrar(self):
+        """Confirma el lote (en modo completo reemplaza el dataset anterior)"""
+        if self.modo != MODO_COMPLETO:
+            return
+        anterior = f"{self.directorio}.old-{self.lote}"
+        if os.path.exists(self.directorio):
+            os.replace(self.directorio, anterior)
+        os.replace(self._destino, self.directorio)
+        shutil.rmtree(anterior, ignore_errors=True)
+        self.archivos = [os.path.join(self.directorio, os.path.basename(a)) for a in self.archivos]
+
+    def abortar(self):
+        """Descarta lo escrito en este lote"""
+        if self.modo == MODO_COMPLETO:
+            shutil.rmtree(self._destino, ignore_errors=True)
+        else:
+            for path in self.archivos:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.archivos = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self.abortar()
+        return False
+
+
+def extraer_a_parquet(
+    client: SocrataClient,
+    dataset_id: str,
+    params: Dict,
+    directorio: str,
+    tipos: Dict[str, pa.DataType],
+    modo: str = MODO_COMPLETO,
+    watermarks: Optional[WatermarkStore] = None,
+    clave: Optional[str] = None,
+    campo: Optional[str] = None,
+    **opciones
+) -> Dict:
+    """
+    Extrae un dataset página a página directo a Parquet.
+
+    Args:
+        client: Cliente Socrata
+        dataset_id: Identificador del dataset
+        params: Parámetros SoQL ($where, $order)
+        directorio: Directorio del dataset Parquet
+        tipos: Tipos Arrow por columna (TIPOS_FENOMENOS, TIPOS_ESTACIONES)
+        modo: 'completa' reemplaza el dataset, 'incremental' agrega archivos
+        watermarks: Estado de extracción incremental (opcional)
+        clave: Clave de la marca de agua
+        campo: Campo de fecha de la marca de agua
+        **opciones: page_size, max_workers (ver SocrataClient.iter_pages)
+
+    Returns:
+        Diccionario con modo, registros, archivos y directorio
+
+    Raises:
+        SocrataError: Si la extracción falla (no queda nada del lote)
+    """
+    frontera = None
+    with EscritorParquet(directorio, tipos, modo) as escritor:
+        for pagina in client.iter_pages(dataset_id, params, **opciones):
+            df = pd.DataFrame(pagina)
+            if watermarks is not None and modo == MODO_INCREMENTAL:
+                df = watermarks.filtrar_nuevos(clave, df)
+            if campo:
+                frontera = filas_en_maximo(frontera, df, campo)
+            escritor.escribir(df)
+
+    if watermarks is not None:
+        watermarks.actualizar(clave, campo, frontera if frontera is not None else pd.DataFrame(),
+                              modo, registros=escritor.filas)
+
+    logger.info(f"💾 {escritor.filas} registros en {len(escritor.archivos)} archivos Parquet ({modo}): "
+                f"{escritor.directorio}")
+    return {
+        'modo': modo,
+        'registros': escritor.filas,
+        'archivos': len(escritor.archivos),
+        'directorio': escritor.directorio
+    }
@@ -0,0 +1,418 @@
+"""
+Cliente compartido de la API SODA de Socrata (datos.gov.co)
+
+Todos los extractores de Socrata usan este cliente:
+- Una sola requests.Session con pool de conexiones (keep-alive, TLS reutilizado)
+- Reintentos con backoff exponencial con jitter ante 429, 5xx, timeouts y
+  errores de conexión, respetando la cabecera Retry-After
+- Contadores de requests, reintentos, registros, bytes y tiempos por request
+- Paginación concurrente: count(*) primero, luego páginas $offset en paralelo
+  con una ventana acotada, límite de requests por segundo y orden estable
+  (desempate por :id) para que el resultado sea determinista
+- Caché local con TTL para consultas pequeñas y repetidas (agregaciones,
+  ver soql.py)
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from soql import CacheConsultas
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SOCRATA_BASE_URL = os.getenv('SOCRATA_BASE_URL', 'https://www.datos.gov.co/resource')
+
+# Segundos por request, reintentos después del primer intento y backoff
+# (base * 2^intento con jitter, acotado por el máximo)
+SOCRATA_TIMEOUT = float(os.getenv('SOCRATA_TIMEOUT', '30'))
+SOCRATA_REINTENTOS = int(os.getenv('SOCRATA_REINTENTOS', '5'))
+SOCRATA_BACKOFF_BASE = float(os.getenv('SOCRATA_BACKOFF_BASE', '1'))
+SOCRATA_BACKOFF_MAX = float(os.getenv('SOCRATA_BACKOFF_MAX', '60'))
+
+# Conexiones abiertas por host en el pool de la sesión
+SOCRATA_POOL = int(os.getenv('SOCRATA_POOL', '8'))
+
+# Registros por página, páginas en vuelo y requests por segundo (0 = sin límite)
+SOCRATA_PAGINA = int(os.getenv('SOCRATA_PAGINA', '5000'))
+SOCRATA_CONCURRENCIA = int(os.getenv('SOCRATA_CONCURRENCIA', '4'))
+SOCRATA_MAX_RPS = float(os.getenv('SOCRATA_MAX_RPS', '10'))
+
+# Columna de sistema de Socrata, única por fila: desempate del orden de páginas
+CLAVE_ESTABLE = ':id'
+
+# Respuestas que vale la pena reintentar (límite de tasa y errores del servidor)
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+ERRORES_REINTENTABLES = (
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError
+)
+
+
+class SocrataError(Exception):
+    """Request a Socrata fallido después de agotar los reintentos (o no reintentable)."""
+
+    def __init__(self, mensaje: str, status: Optional[int] = None):
+        super().__init__(mensaje)
+        self.status = status
+
+
+def segundos_retry_after(valor: Optional[str]) -> Optional[float]:
+    """
+    Interpreta la cabecera Retry-After (segundos o fecha HTTP).
+
+    Returns:
+        Segundos a esperar, o None si no viene o no se puede interpretar
+    """
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def orden_estable(orden: Optional[str]) -> str:
+    """$order con desempate por :id, para que $offset no repita ni salte filas"""
+    if not orden:
+        return CLAVE_ESTABLE
+    columnas = [c.strip().split()[0] for c in orden.split(',')]
+    return orden if CLAVE_ESTABLE in columnas else f"{orden}, {CLAVE_ESTABLE}"
+
+
+class LimitadorTasa:
+    """Espacia los requests para no pasar de `por_segundo` (compartido entre hilos)."""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._siguiente = 0.0
+        self._lock = threading.Lock()
+
+    def esperar(self) -> float:
+        """Bloquea hasta el próximo turno; devuelve los segundos esperados"""
+        if not self.intervalo:
+            return 0.0
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        espera = turno - ahora
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+
+class SocrataClient:
+    """
+    Cliente de la API SODA con sesión compartida, reintentos y métricas.
+
+    Es seguro usarlo desde varios hilos: la sesión reutiliza hasta
+    `pool` conexiones y los contadores se actualizan bajo un lock.
+    """
+
+    def __init__(
+        self,
+        app_token: Optional[str] = None,
+        base_url: str = SOCRATA_BASE_URL,
+        timeout: float = SOCRATA_TIMEOUT,
+        reintentos: int = SOCRATA_REINTENTOS,
+        backoff_base: float = SOCRATA_BACKOFF_BASE,
+        backoff_max: float = SOCRATA_BACKOFF_MAX,
+        pool: int = SOCRATA_POOL,
+        max_rps: float = SOCRATA_MAX_RPS,
+        cache: Optional[CacheConsultas] = None
+    ):
+        """
+        Inicializa el cliente.
+
+        Args:
+            app_token: Token de aplicación de Socrata (si no se da, se lee de .env)
+            base_url: URL base de los recursos SODA
+            timeout: Segundos de espera por request
+            reintentos: Reintentos ante errores transitorios
+            backoff_base: Segundos del primer backoff
+            backoff_max: Tope en segundos de cada espera
+            pool: Conexiones reutilizables por host
+            max_rps: Requests por segundo, incluidos reintentos (0 = sin límite)
+            cache: Caché de get_cached (default: datasets/raw/.cache_soql, SOQL_CACHE_TTL)
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limitador = LimitadorTasa(max_rps)
+        self.cache = cache or CacheConsultas()
+
+        self.app_token = app_token or os.getenv('SOCRATA_APP_TOKEN')
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.session.mount('https://', adaptador)
+        self.session.mount('http://', adaptador)
+        self.session.headers['Accept'] = 'application/json'
+        if self.app_token:
+            self.session.headers['X-App-Token'] = self.app_token
+            logger.info("✅ Usando App Token para autenticación")
+        else:
+            logger.warning("⚠️  No se encontró App Token. Límite: 100 requests/hora")
+
+        self._lock = threading.Lock()
+        self._reiniciar_contadores()
+
+    def _reiniciar_contadores(self):
+        self.total_requests = 0
+        self.total_intentos = 0
+        self.total_reintentos = 0
+        self.total_errores = 0
+        self.total_records = 0
+        self.total_bytes = 0
+        self.segundos_requests = 0.0
+        self.segundos_max = 0.0
+        self.segundos_espera = 0.0
+        self.segundos_limite = 0.0
+        self.cache_aciertos = 0
+        self.cache_fallos = 0
+        self.por_estado: Dict[str, int] = {}
+
+    def endpoint(self, dataset_id: str) -> str:
+        return f"{self.base_url}/{dataset_id}.json"
+
+    def _espera(self, intento: int, retry_after: Optional[float]) -> float:
+        """Backoff exponencial con jitter completo; Retry-After manda si es mayor"""
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+        if retry_after is not None:
+            espera = max(espera, min(retry_after, self.backoff_max))
+        return espera
+
+    def _contar_intento(self, estado: str, segundos: float, n_bytes: int = 0):
+        with self._lock:
+            self.total_intentos += 1
+            self.por_estado[estado] = self.por_estado.get(estado, 0) + 1
+            self.segundos_requests += segundos
+            self.segundos_max = max(self.segundos_max, segundos)
+            self.total_bytes += n_bytes
+
+    def get(self, dataset_id: str, params: Dict, timeout: Optional[float] = None) -> List[Dict]:
+        """
+        Consulta un dataset y devuelve los registros.
+
+        Args:
+            dataset_id: Identificador del dataset (ej: 'i8ar-8tth')
+            params: Parámetros SoQL ($where, $limit, $order, ...)
+            timeout: Segundos de espera (default: el del cliente)
+
+        Returns:
+            Lista de registros
+
+        Raises:
+            SocrataError: Si la respuesta no es 200 después de los reintentos
+        """
+        url = self.endpoint(dataset_id)
+        timeout = timeout or self.timeout
+        with self._lock:
+            self.total_requests += 1
+
+        for intento in range(self.reintentos + 1):
+            esperado = self.limitador.esperar()
+            if esperado:
+                with self._lock:
+                    self.segundos_limite += esperado
+            inicio = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except ERRORES_REINTENTABLES as e:
+                self._contar_intento(type(e).__name__, time.perf_counter() - inicio)
+                motivo = f"{type(e).__name__}: {e}"
+            else:
+                self._contar_intento(str(response.status_code), time.perf_counter() - inicio,
+                                     len(response.content))
+                if response.status_code == 200:
+                    data = response.json()
+                    with self._lock:
+                        self.total_records += len(data)
+                    return data
+                if response.status_code not in ESTADOS_REINTENTABLES:
+                    with self._lock:
+                        self.total_errores += 1
+                    raise SocrataError(
+                        f"Error API {dataset_id}: Status {response.status_code}: {response.text[:500]}",
+                        response.status_code
+                    )
+                motivo = f"Status {response.status_code}"
+                retry_after = segundos_retry_after(response.headers.get('Retry-After'))
+
+            if intento == self.reintentos:
+                break
+            espera = self._espera(intento, retry_after)
+            with self._lock:
+                self.total_reintentos += 1
+                self.segundos_espera += espera
+            logger.warning(f"⚠️  {motivo} en {dataset_id}; reintento {intento + 1}/{self.reintentos} "
+                           f"en {espera:.1f}s")
+            time.sleep(espera)
+
+        with self._lock:
+            self.total_errores += 1
+        raise SocrataError(f"Error API {dataset_id}: {motivo} después de {self.reintentos} reintentos")
+
+    def get_cached(self, dataset_id: str, params: Dict, ttl: Optional[float] = None) -> List[Dict]:
+        """
+        Como get, pero reutiliza la respuesta guardada si tiene menos de `ttl`
+        segundos. Pensado para consultas agregadas pequeñas, no para páginas.
+
+        Args:
+            dataset_id: Identificador del dataset
+            params: Parámetros SoQL (ver ConsultaSoQL.params)
+            ttl: Segundos de validez (default: el de la caché; 0 = no usar caché)
+
+        Raises:
+            SocrataError: Si la consulta falla después de los reintentos
+        """
+        url = self.endpoint(dataset_id)
+        data = self.cache.obtener(url, params, ttl)
+        if data is not None:
+            with self._lock:
+                self.cache_aciertos += 1
+            logger.info(f"📦 {dataset_id}: {len(data)} registros desde la caché")
+            return data
+
+        with self._lock:
+            self.cache_fallos += 1
+        data = self.get(dataset_id, params)
+        if (self.cache.ttl if ttl is None else ttl) > 0:
+            self.cache.guardar(url, params, data)
+        return data
+
+    def count(self, dataset_id: str, where: Optional[str] = None) -> int:
+        """
+        Cuenta los registros de un dataset (con filtro $where opcional).
+
+        Raises:
+            SocrataError: Si la consulta falla después de los reintentos
+        """
+        params = {'$select': 'count(*) AS total'}
+        if where:
+            params['$where'] = where
+        data = self.get(dataset_id, params)
+        return int(data[0]['total']) if data else 0
+
+    def iter_pages(
+        self,
+        dataset_id: str,
+        params: Optional[Dict] = None,
+        page_size: int = SOCRATA_PAGINA,
+        max_workers: int = SOCRATA_CONCURRENCIA,
+        max_records: Optional[int] = None
+    ) -> Iterator[List[Dict]]:
+        """
+        Recorre un dataset por páginas, descargando varias a la vez.
+
+        Primero cuenta los registros que cumplen $where y luego pide las
+        páginas $offset con hasta `max_workers` en vuelo. Las páginas se
+        devuelven en orden y $order se completa con :id, así dos corridas
+        sobre los mismos datos dan el mismo resultado. La memoria queda
+        acotada a la ventana de páginas en vuelo.
+
+        Args:
+            dataset_id: Identificador del dataset
+            params: Parámetros SoQL ($where, $order, $select); $limit y $offset se ignoran
+            page_size: Registros por página
+            max_workers: Páginas descargándose a la vez
+            max_records: Máximo de registros a extraer (None = todos)
+
+        Yields:
+            Lista de registros de cada página, en orden
+
+        Raises:
+            SocrataError: Si alguna página falla después de los reintentos
+        """
+        params = {k: v for k, v in (params or {}).items() if k not in ('$limit', '$offset')}
+        params['$order'] = orden_estable(params.get('$order'))
+
+        total = self.count(dataset_id, params.get('$where'))
+        if max_records is not None:
+            total = min(total, max_records)
+        offsets = list(range(0, total, page_size))
+        logger.info(f"📊 {dataset_id}: {total} registros en {len(offsets)} páginas "
+                    f"(hasta {max_workers} en paralelo)")
+
+        def pagina(offset: int) -> List[Dict]:
+            limite = min(page_size, total - offset)
+            return self.get(dataset_id, {**params, '$limit': limite, '$offset': offset})
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='socrata') as executor:
+            pendientes = iter(offsets)
+            en_vuelo = deque()
+            try:
+                for offset in pendientes:
+                    en_vuelo.append(executor.submit(pagina, offset))
+                    if len(en_vuelo) >= max_workers:
+                        break
+                numero = 0
+                while en_vuelo:
+                    data = en_vuelo.popleft().result()
+                    siguiente = next(pendientes, None)
+                    if siguiente is not None:
+                        en_vuelo.append(executor.submit(pagina, siguiente))
+                    numero += 1
+                    logger.info(f"  📦 Página {numero}/{len(offsets)}: {len(data)} registros")
+                    yield data
+            finally:
+                for futuro in en_vuelo:
+                    futuro.cancel()
+
+    def get_all(self, dataset_id: str, params: Optional[Dict] = None, **kwargs) -> List[Dict]:
+        """Todos los registros de iter_pages en una lista (mismos argumentos)"""
+        registros = []
+        for data in self.iter_pages(dataset_id, params, **kwargs):
+            registros.extend(data)
+        return registros
+
+    def get_stats(self) -> Dict:
+        """
+        Obtiene estadísticas del cliente.
+
+        Returns:
+            Diccionario con contadores y tiempos de los requests
+        """
+        with self._lock:
+            return {
+                'total_requests': self.total_requests,
+                'total_intentos': self.total_intentos,
+                'total_reintentos': self.total_reintentos,
+                'total_errores': self.total_errores,
+                'total_records': self.total_records,
+                'total_bytes': self.total_bytes,
+                'por_estado': dict(self.por_estado),
+                'segundos_requests': round(self.segundos_requests, 3),
+                'segundos_media': round(self.segundos_requests / self.total_intentos, 3) if self.total_intentos else 0.0,
+                'segundos_max': round(self.segundos_max, 3),
+                'segundos_espera': round(self.segundos_espera, 3),
+                'segundos_limite': round(self.segundos_limite, 3),
+                'cache_aciertos': self.cache_aciertos,
+                'cache_fallos': self.cache_fallos,
+                'using_token': bool(self.app_token)
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,219 @@
+"""
+Constructor de consultas SoQL y caché local de respuestas
+
+Los valores nunca se interpolan a mano en $where: pasan por literal_soql
+(comillas simples duplicadas, fechas ISO, números tal cual) y los nombres de
+columna se validan como identificadores. Así un municipio como "LA CRUZ'"
+o un texto de búsqueda con comillas no rompe ni altera la consulta.
+
+    consulta = (ConsultaSoQL()
+                .select('municipio').contar('total')
+                .minimo('fecha_reporte', 'primera_fecha')
+                .igual('departamento', 'NARIÑO')
+                .group('municipio')
+                .order('total', desc=True))
+    client.get_cached(dataset_id, consulta.params())
+
+Las agregaciones (count, min, max con $group) se resuelven en el servidor:
+la respuesta es de unos cientos de bytes en lugar del dataset completo.
+CacheConsultas guarda esas respuestas en disco con un TTL para que los
+tableros y auditorías no repitan la consulta en cada corrida.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import numbers
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SOQL_CACHE_DIR = os.getenv(
+    'SOQL_CACHE_DIR',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw', '.cache_soql')
+)
+
+# Segundos de validez de una respuesta en caché (0 = sin caché)
+SOQL_CACHE_TTL = float(os.getenv('SOQL_CACHE_TTL', '3600'))
+
+# Filas máximas de una consulta agregada (Socrata devuelve 1000 si no se indica)
+SOQL_LIMITE_AGREGADO = int(os.getenv('SOQL_LIMITE_AGREGADO', '50000'))
+
+OPERADORES = {'=', '!=', '<', '<=', '>', '>=', 'LIKE', 'NOT LIKE'}
+
+_IDENTIFICADOR = re.compile(r'^:?[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def identificador(nombre: str) -> str:
+    """Valida un nombre de columna o alias SoQL"""
+    if not isinstance(nombre, str) or not _IDENTIFICADOR.match(nombre):
+        raise ValueError(f"Identificador SoQL inválido: {nombre!r}")
+    return nombre
+
+
+def literal_soql(valor) -> str:
+    """
+    Literal SoQL de un valor de Python.
+
+    Texto entre comillas simples (duplicadas si aparecen), fechas como
+    timestamp ISO, números y booleanos tal cual, None como null. Los números
+    no finitos (nan, inf) lanzan ValueError.
+    """
+    if valor is None:
+        return 'null'
+    if isinstance(valor, bool):
+        return 'true' if valor else 'false'
+    if isinstance(valor, numbers.Integral):
+        return str(int(valor))
+    if isinstance(valor, numbers.Real):
+        # nan / inf no son literales SoQL (repr los dejaría como tokens sueltos)
+        if not math.isfinite(valor):
+            raise ValueError(f"Número no finito en consulta SoQL: {valor!r}")
+        return repr(float(valor))
+    if isinstance(valor, datetime):
+        valor = valor.strftime('%Y-%m-%dT%H:%M:%S')
+    elif isinstance(valor, date):
+        valor = valor.strftime('%Y-%m-%dT00:00:00')
+    return "'" + str(valor).replace("'", "''") + "'"
+
+
+def condicion(campo: str, operador: str, valor) -> str:
+    """`campo operador literal`, con el campo y el operador validados"""
+    operador = operador.upper()
+    if operador not in OPERADORES:
+        raise ValueError(f"Operador SoQL no soportado: {operador!r} (use {sorted(OPERADORES)})")
+    return f"{identificador(campo)} {operador} {literal_soql(valor)}"
+
+
+class ConsultaSoQL:
+    """Arma los parámetros $select/$where/$group/$order/$limit de una consulta."""
+
+    def __init__(self):
+        self._select: List[str] = []
+        self._where: List[str] = []
+        self._group: List[str] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+
+    # --- $select
+    def select(self, *columnas: str) -> 'ConsultaSoQL':
+        self._select.extend(identificador(c) for c in columnas)
+        return self
+
+    def _agregado(self, funcion: str, campo: str, alias: str) -> 'ConsultaSoQL':
+        self._select.append(f"{funcion}({campo}) AS {identificador(alias)}")
+        return self
+
+    def contar(self, alias: str = 'total') -> 'ConsultaSoQL':
+        return self._agregado('count', '*', alias)
+
+    def minimo(self, campo: str, alias: str) -> 'ConsultaSoQL':
+        return self._agregado('min', identificador(campo), alias)
+
+    def maximo(self, campo: str, alias: str) -> 'ConsultaSoQL':
+        return self._agregado('max', identificador(campo), alias)
+
+    # --- $where (las condiciones se combinan con AND)
+    def where(self, campo: str, operador: str, valor) -> 'ConsultaSoQL':
+        self._where.append(condicion(campo, operador, valor))
+        return self
+
+    def igual(self, campo: str, valor) -> 'ConsultaSoQL':
+        return self.where(campo, '=', valor)
+
+    def contiene(self, campo: str, texto: str) -> 'ConsultaSoQL':
+        return self.where(campo, 'LIKE', f"%{texto}%")
+
+    def entre(self, campo: str, desde, hasta) -> 'ConsultaSoQL':
+        """desde <= campo <= hasta (ambos incluidos)"""
+        return self.where(campo, '>=', desde).where(campo, '<=', hasta)
+
+    def where_soql(self, expresion: Optional[str]) -> 'ConsultaSoQL':
+        """Agrega una condición ya armada con este módulo (ej: WatermarkStore.filtro)"""
+        if expresion:
+            self._where.append(f"({expresion})")
+        return self
+
+    # --- $group, $order, $limit
+    def group(self, *columnas: str) -> 'ConsultaSoQL':
+        self._group.extend(identificador(c) for c in columnas)
+        return self
+
+    def order(self, campo: str, desc: bool = False) -> 'ConsultaSoQL':
+        self._order.append(f"{identificador(campo)}{' DESC' if desc else ''}")
+        return self
+
+    def limit(self, limite: int) -> 'ConsultaSoQL':
+        self._limit = int(limite)
+        return self
+
+    def where_clause(self) -> Optional[str]:
+        return ' AND '.join(self._where) or None
+
+    def params(self) -> Dict[str, str]:
+        """Parámetros para SocrataClient.get / get_all (solo los que se usaron)"""
+        params = {}
+        if self._select:
+            params['$select'] = ', '.join(self._select)
+        if self._where:
+            params['$where'] = self.where_clause()
+        if self._group:
+            params['$group'] = ', '.join(self._group)
+        if self._order:
+            params['$order'] = ', '.join(self._order)
+        if self._limit is not None:
+            params['$limit'] = self._limit
+        return params
+
+
+class CacheConsultas:
+    """
+    Respuestas de Socrata en disco, un archivo JSON por consulta
+    (dataset + parámetros), válidas durante `ttl` segundos.
+    """
+
+    def __init__(self, directorio: str = SOQL_CACHE_DIR, ttl: float = SOQL_CACHE_TTL):
+        self.directorio = directorio
+        self.ttl = ttl
+
+    def _path(self, url: str, params: Dict) -> str:
+        clave = json.dumps([url, sorted((k, str(v)) for k, v in params.items())], ensure_ascii=False)
+        return os.path.join(self.directorio, hashlib.sha1(clave.encode('utf-8')).hexdigest() + '.json')
+
+    def obtener(self, url: str, params: Dict, ttl: Optional[float] = None) -> Optional[List[Dict]]:
+        """Registros en caché, o None si no hay o ya vencieron"""
+        ttl = self.ttl if ttl is None else ttl
+        path = self._path(url, params)
+        if ttl <= 0 or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                entrada = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entrada['guardado'] > ttl:
+            return None
+        return entrada['data']
+
+    def guardar(self, url: str, params: Dict, data: List[Dict]):
+        os.makedirs(self.directorio, exist_ok=True)
+        path = self._path(url, params)
+        # Escritura atómica: una corrida cortada no deja un JSON a medias
+        temporal = f"{path}.tmp-{os.getpid()}"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'guardado': time.time(), 'url': url, 'params': params, 'data': data}, f, ensure_ascii=False)
+        os.replace(temporal, path)
+
+    def limpiar(self) -> int:
+        """Borra todas las respuestas guardadas; devuelve cuántas había"""
+        if not os.path.isdir(self.directorio):
+            return 0
+        archivos = [f for f in os.listdir(self.directorio) if f.endswith('.json')]
+        for nombre in archivos:
+            os.remove(os.path.join(self.directorio, nombre))
+        return len(archivos)
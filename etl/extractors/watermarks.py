@@ -0,0 +1,187 @@
+"""
+Marcas de agua (watermarks) para extracción incremental de Socrata
+
+Guarda en un archivo JSON local, por dataset, el máximo valor cargado del
+campo de fecha (fecha_reporte, fechaobservacion). La siguiente corrida pide
+solo `campo >= marca` y agrega los registros nuevos al CSV crudo (o como
+particiones nuevas del dataset Parquet, ver parquet_sink.py).
+
+La consulta usa >= porque varios registros pueden compartir la fecha de la
+marca (fecha_reporte tiene resolución de día): se guarda la huella de los
+registros que están justo en la marca y se descartan al volver a llegar.
+
+Cada `ETL_RECONCILIACION_DIAS` días se hace una extracción completa que
+reemplaza la salida, para recoger ediciones y borrados tardíos en la fuente.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import pandas as pd
+
+from soql import condicion
+
+logger = logging.getLogger(__name__)
+
+WATERMARKS_PATH = os.getenv(
+    'ETL_WATERMARKS_PATH',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw', 'watermarks.json')
+)
+
+# Días entre reconciliaciones completas (0 = siempre completa)
+ETL_RECONCILIACION_DIAS = float(os.getenv('ETL_RECONCILIACION_DIAS', '7'))
+
+MODO_COMPLETO = 'completa'
+MODO_INCREMENTAL = 'incremental'
+
+
+def huella(registro: Dict) -> str:
+    """Hash estable de un registro (los campos vacíos se ignoran, como en la API)"""
+    limpio = {k: v for k, v in registro.items() if not (v is None or (isinstance(v, float) and pd.isna(v)))}
+    return hashlib.sha1(json.dumps(limpio, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class WatermarkStore:
+    """
+    Estado de extracción incremental por dataset en un archivo JSON.
+
+    Cada entrada guarda: campo, marca (máximo cargado), huellas de los
+    registros en la marca, última reconciliación completa y contadores.
+    """
+
+    def __init__(self, path: str = WATERMARKS_PATH):
+        self.path = path
+        self.estado: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.estado = json.load(f)
+
+    def _guardar(self):
+        # Escritura atómica: un corte a mitad no deja el estado corrupto
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporal = f"{self.path}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.estado, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self.path)
+
+    def obtener(self, clave: str) -> Optional[Dict]:
+        return self.estado.get(clave)
+
+    def modo(self, clave: str, completa: bool = False,
+             reconciliar_dias: float = ETL_RECONCILIACION_DIAS) -> str:
+        """
+        Modo de la próxima extracción: completa si se pide, si no hay marca o
+        si la última reconciliación tiene más de `reconciliar_dias` días.
+        """
+        entrada = self.obtener(clave)
+        if completa or entrada is None or entrada.get('marca') is None:
+            return MODO_COMPLETO
+        ultima = datetime.fromisoformat(entrada['ultima_reconciliacion'])
+        if datetime.now() - ultima >= timedelta(days=reconciliar_dias):
+            return MODO_COMPLETO
+        return MODO_INCREMENTAL
+
+    def filtro(self, clave: str, where: Optional[str] = None) -> Optional[str]:
+        """$where con `campo >= marca` agregado (sin marca devuelve el original)"""
+        entrada = self.obtener(clave)
+        if entrada is None or entrada.get('marca') is None:
+            return where
+        desde_marca = condicion(entrada['campo'], '>=', entrada['marca'])
+        return f"({where}) AND {desde_marca}" if where else desde_marca
+
+    def filtrar_nuevos(self, clave: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Descarta los registros en la marca que ya se habían cargado"""
+        entrada = self.obtener(clave)
+        if df.empty or entrada is None or not entrada.get('huellas'):
+            return df
+        campo = entrada['campo']
+        en_marca = df[campo] == entrada['marca']
+        if not en_marca.any():
+            return df
+        vistos = set(entrada['huellas'])
+        repetidos = en_marca.copy()
+        repetidos[en_marca] = [huella(r) in vistos for r in df[en_marca].to_dict('records')]
+        return df[~repetidos].reset_index(drop=True)
+
+    def actualizar(self, clave: str, campo: str, df: pd.DataFrame, modo: str,
+                   registros: Optional[int] = None):
+        """
+        Avanza la marca con los registros ya guardados.
+
+        Llamar después de escribir los datos: si la escritura falla, la marca
+        no avanza y la próxima corrida vuelve a pedir los mismos registros.
+
+        Args:
+            df: Registros guardados (basta con los que están en la fecha máxima,
+                ver filas_en_maximo, si se escribieron por páginas)
+            registros: Total guardado si df no los contiene a todos
+        """
+        registros = int(len(df)) if registros is None else int(registros)
+        ahora = datetime.now().isoformat(timespec='seconds')
+        entrada = dict(self.obtener(clave) or {})
+        marca_anterior = entrada.get('marca') if modo == MODO_INCREMENTAL else None
+        huellas = set(entrada.get('huellas', [])) if modo == MODO_INCREMENTAL else set()
+
+        marca = marca_anterior
+        if not df.empty and campo in df.columns and df[campo].notna().any():
+            maximo = str(df[campo].dropna().max())
+            if marca is None or maximo > marca:
+                marca, huellas = maximo, set()
+            en_marca = df[df[campo] == marca]
+            huellas.update(huella(r) for r in en_marca.to_dict('records'))
+
+        entrada.update({
+            'campo': campo,
+            'marca': marca,
+            'huellas': sorted(huellas),
+            'ultima_extraccion': ahora,
+            'ultimo_modo': modo,
+            'registros_ultima': registros,
+            'registros_total': (registros if modo == MODO_COMPLETO
+                                else entrada.get('registros_total', 0) + registros)
+        })
+        if modo == MODO_COMPLETO:
+            entrada['ultima_reconciliacion'] = ahora
+        self.estado[clave] = entrada
+        self._guardar()
+        logger.info(f"🔖 Marca de {clave}: {campo} = {marca} ({modo}, {registros} registros)")
+
+
+def filas_en_maximo(actual: Optional[pd.DataFrame], df: pd.DataFrame, campo: str) -> Optional[pd.DataFrame]:
+    """
+    Acumula, página a página, las filas con el mayor valor de `campo` visto
+    (lo único que actualizar() necesita para la marca y sus huellas).
+    """
+    if df.empty or campo not in df.columns or not df[campo].notna().any():
+        return actual
+    maximo = df[campo].dropna().max()
+    nuevas = df[df[campo] == maximo]
+    if actual is None or actual.empty or maximo > actual[campo].iloc[0]:
+        return nuevas
+    if maximo == actual[campo].iloc[0]:
+        return pd.concat([actual, nuevas], ignore_index=True)
+    return actual
+
+
+def guardar_csv(df: pd.DataFrame, filepath: str, modo: str) -> str:
+    """
+    Escribe el CSV crudo: lo reemplaza en modo completo y agrega filas en modo
+    incremental (con las columnas del archivo existente, en su orden).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+
+    if modo == MODO_COMPLETO or not os.path.exists(filepath):
+        df.to_csv(filepath, index=False, encoding='utf-8')
+        return filepath
+
+    columnas = pd.read_csv(filepath, nrows=0).columns
+    nuevas = [c for c in df.columns if c not in columnas]
+    if nuevas:
+        logger.warning(f"⚠️  Columnas nuevas ignoradas hasta la próxima reconciliación: {nuevas}")
+    if not df.empty:
+        df.reindex(columns=columnas).to_csv(filepath, mode='a', header=False, index=False, encoding='utf-8')
+    return filepath
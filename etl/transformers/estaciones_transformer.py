@@ -7,10 +7,20 @@ import pandas as pd
 import numpy as np
 import logging
 
+from parquet_source import RAW_DIR, existe_dataset, leer_lotes
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Columnas de estación (no de observación)
+COLUMNAS_ESTACION = [
+    'codigoestacion', 'nombreestacion', 'departamento',
+    'municipio', 'zonahidrografica', 'latitud', 'longitud',
+    'entidad'
+]
+
+
 class EstacionesTransformer:
     """
     Transforma y limpia datos de estaciones IDEAM.
@@ -55,6 +65,38 @@ class EstacionesTransformer:
         
         return df_clean
     
+    def transform_dataset(self, directorio: str) -> pd.DataFrame:
+        """
+        Transforma un dataset Parquet de observaciones (ver extract_to_parquet)
+        sin cargarlo completo: lee solo las columnas de estación y conserva la
+        primera fila de cada estación, lote a lote.
+        
+        Args:
+            directorio: Directorio del dataset Parquet
+            
+        Returns:
+            DataFrame transformado con estaciones únicas
+        """
+        logger.info(f"📂 Leyendo observaciones por lotes desde {directorio}")
+        
+        vistas = set()
+        primeras = []
+        observaciones = 0
+        for lote in leer_lotes(directorio, COLUMNAS_ESTACION):
+            observaciones += len(lote)
+            lote = lote.drop_duplicates(subset=['codigoestacion'])
+            lote = lote[~lote['codigoestacion'].isin(vistas)]
+            vistas.update(lote['codigoestacion'])
+            primeras.append(lote)
+        
+        if not primeras:
+            logger.warning("⚠️  Dataset vacío")
+            return pd.DataFrame()
+        
+        df = pd.concat(primeras, ignore_index=True)
+        logger.info(f"  📊 {observaciones} observaciones leídas → {len(df)} filas de estación")
+        return self.transform(df)
+    
     def _clean_station_names(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpia nombres de estaciones."""
         logger.info("  🧹 Limpiando nombres de estaciones...")
@@ -97,12 +139,7 @@ class EstacionesTransformer:
         """
         logger.info("  🔄 Deduplicando estaciones...")
         
-        # Columnas de estación (no de observación)
-        station_cols = [
-            'codigoestacion', 'nombreestacion', 'departamento', 
-            'municipio', 'zonahidrografica', 'latitud', 'longitud',
-            'entidad', 'coordenadas_validas'
-        ]
+        station_cols = COLUMNAS_ESTACION + ['coordenadas_validas']
         
         # Filtrar solo columnas que existen
         available_cols = [col for col in station_cols if col in df.columns]
@@ -203,14 +240,16 @@ if __name__ == "__main__":
     import os
     
     # Leer datos crudos
-    raw_path = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw', 'estaciones_ideam_narino.csv')
+    raw_path = os.path.join(RAW_DIR, 'estaciones_ideam_narino.csv')
+    parquet_path = os.path.join(RAW_DIR, 'estaciones_ideam_narino')
     
-    if os.path.exists(raw_path):
-        df_raw = pd.read_csv(raw_path)
-        
-        # Transformar
+    if existe_dataset(parquet_path) or os.path.exists(raw_path):
+        # Transformar (el dataset Parquet se lee por lotes si existe)
         transformer = EstacionesTransformer()
-        df_clean = transformer.transform(df_raw)
+        if existe_dataset(parquet_path):
+            df_clean = transformer.transform_dataset(parquet_path)
+        else:
+            df_clean = transformer.transform(pd.read_csv(raw_path))
         
         # Estadísticas
         stats = transformer.get_summary_stats(df_clean)
@@ -9,6 +9,8 @@ from datetime import datetime
 import logging
 import re
 
+from parquet_source import RAW_DIR, existe_dataset, leer_lotes
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -61,6 +63,31 @@ class FenomenosTransformer:
         
         return df_clean
     
+    def transform_dataset(self, directorio: str) -> pd.DataFrame:
+        """
+        Transforma un dataset Parquet (ver extract_to_parquet) lote a lote.
+        
+        Args:
+            directorio: Directorio del dataset Parquet
+            
+        Returns:
+            DataFrame transformado y limpio
+        """
+        logger.info(f"📂 Leyendo fenómenos por lotes desde {directorio}")
+        
+        resultados = []
+        inicio = 0
+        for lote in leer_lotes(directorio):
+            # Índice global para que id_fenomeno no se repita entre lotes
+            lote.index = pd.RangeIndex(inicio, inicio + len(lote))
+            inicio += len(lote)
+            resultados.append(self.transform(lote))
+        
+        if not resultados:
+            logger.warning("⚠️  Dataset vacío")
+            return pd.DataFrame()
+        return pd.concat(resultados)
+    
     def _clean_municipios(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpia y normaliza nombres de municipios."""
         logger.info("  🧹 Limpiando nombres de municipios...")
@@ -269,14 +296,16 @@ if __name__ == "__main__":
     # Leer datos crudos
     import os
     
-    raw_path = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw', 'fenomenos_naturales_narino.csv')
+    raw_path = os.path.join(RAW_DIR, 'fenomenos_naturales_narino.csv')
+    parquet_path = os.path.join(RAW_DIR, 'fenomenos_naturales_narino')
     
-    if os.path.exists(raw_path):
-        df_raw = pd.read_csv(raw_path)
-        
-        # Transformar
+    if existe_dataset(parquet_path) or os.path.exists(raw_path):
+        # Transformar (el dataset Parquet se lee por lotes si existe)
         transformer = FenomenosTransformer()
-        df_clean = transformer.transform(df_raw)
+        if existe_dataset(parquet_path):
+            df_clean = transformer.transform_dataset(parquet_path)
+        else:
+            df_clean = transformer.transform(pd.read_csv(raw_path))
         
         # Estadísticas
         stats = transformer.get_summary_stats(df_clean)
@@ -0,0 +1,54 @@
+"""
+Lectura perezosa de los datasets Parquet escritos por los extractores
+(ver extractors/parquet_sink.py).
+
+Los archivos del directorio se leen por lotes de filas y solo con las
+columnas pedidas, sin cargar el dataset completo en memoria. El esquema es
+la unión de los de todos los archivos: una columna que llegó en páginas
+posteriores se lee como nula en los archivos anteriores.
+"""
+
+import os
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RAW_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'datasets', 'raw')
+
+# Filas por lote leído
+PARQUET_FILAS_LOTE = int(os.getenv('PARQUET_FILAS_LOTE', '100000'))
+
+
+def existe_dataset(directorio: str) -> bool:
+    """True si el directorio tiene archivos Parquet"""
+    return os.path.isdir(directorio) and any(f.endswith('.parquet') for f in os.listdir(directorio))
+
+
+def leer_lotes(
+    directorio: str,
+    columnas: Optional[List[str]] = None,
+    filas_por_lote: int = PARQUET_FILAS_LOTE
+) -> Iterator[pd.DataFrame]:
+    """
+    Recorre el dataset Parquet por lotes, en el orden de los archivos.
+
+    Args:
+        directorio: Directorio del dataset
+        columnas: Columnas a leer (las que no existan se omiten; None = todas)
+        filas_por_lote: Filas máximas por lote
+
+    Yields:
+        DataFrame por lote
+    """
+    archivos = sorted(os.path.join(directorio, f) for f in os.listdir(directorio) if f.endswith('.parquet'))
+    schema = pa.unify_schemas([pq.read_schema(f) for f in archivos])
+    dataset = ds.dataset(archivos, format='parquet', schema=schema)
+    if columnas is not None:
+        columnas = [c for c in columnas if c in dataset.schema.names]
+
+    for lote in dataset.to_batches(columns=columnas, batch_size=filas_por_lote):
+        if lote.num_rows:
+            yield lote.to_pandas()